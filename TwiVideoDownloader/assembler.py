@@ -0,0 +1,336 @@
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional
+from TwiVideoDownloader.budget import TransferBudget, get_global_budget
+from TwiVideoDownloader.fastcopy import BUFFER_SIZE, copy_range
+
+
+class SegmentSuperseded(Exception):
+    """片段已由另一次请求写入，当前写入端失效"""
+
+
+class _SegmentState:
+    """单个片段的组装状态"""
+    def __init__(self):
+        self.generation = 0      # 每次被其他请求取代时加一，旧的写入端随之失效
+        self.buffer: List[bytes] = []
+        self.buffered_bytes = 0
+        self.complete = False
+        self.direct = False      # 是否已直接写入输出文件
+        self.start_offset = 0    # 直接写入时在文件中的起始位置
+        self.length = 0
+        self.hasher = hashlib.sha256()
+
+
+class SegmentSink:
+    """单个片段的写入端，供下载线程按块写入"""
+    def __init__(self, assembler: 'SegmentAssembler', index: int, generation: int = 0):
+        self.assembler = assembler
+        self.index = index
+        self.generation = generation
+
+    @property
+    def is_head(self) -> bool:
+        """是否为当前待写入文件的片段"""
+        return self.assembler._next_index == self.index
+
+    @contextmanager
+    def limited(self, limiter):
+        """在共享并发限制下下载本片段
+
+        队首片段不再等待名额，否则它可能与占满名额、等待缓冲预算的片段互相等待。
+        """
+        acquired = False
+        if limiter is not None:
+            while not limiter.acquire(timeout=0.1):
+                if self.is_head:
+                    break
+            else:
+                acquired = True
+        try:
+            yield
+        finally:
+            if acquired:
+                limiter.release()
+
+    def write(self, chunk: bytes):
+        """写入一块数据"""
+        self.assembler._write_chunk(self.index, chunk, generation=self.generation)
+
+    def write_reserved(self, chunk: bytes, reserved: int):
+        """写入一块已由调用方申请过预算的数据，供不能阻塞的调用方使用"""
+        self.assembler._write_chunk(self.index, chunk, reserved, self.generation)
+
+    def reserve(self, size: int) -> int:
+        """为即将读入内存、稍后才写入的size字节申请缓冲预算，返回预留的字节数
+
+        与write相同，队首片段或输出已无法写入时不等待预算，返回0。预留的字节用release释放。
+        """
+        assembler = self.assembler
+        if assembler.budget.acquire_bytes(
+            size, bypass=lambda: self.is_head or assembler._write_error is not None
+        ):
+            return size
+        return 0
+
+    def release(self, size: int):
+        """释放reserve预留的字节"""
+        self.assembler.budget.release_bytes(size)
+
+    def buffer_reserved(self, chunk: bytes, reserved: int) -> bool:
+        """与write_reserved相同，但只在数据可以直接进入重排缓冲区时写入
+
+        需要写盘或其他线程正持锁写盘时不写入并返回False，供事件循环中的调用方改在线程池中调用write_reserved。
+        """
+        return self.assembler._write_chunk(self.index, chunk, reserved, self.generation, buffer_only=True)
+
+    def write_file(self, f: BinaryIO, size: int) -> bool:
+        """把整个文件作为本片段的内容在内核中复制到输出文件
+
+        只有尚未写入数据的队首片段可以这样写入，返回False时调用方应改为按块写入。
+        """
+        return self.assembler._write_file(self.index, f, size, self.generation)
+
+    def reset(self):
+        """丢弃已写入的数据，用于重试"""
+        self.assembler._reset_segment(self.index, self.generation)
+
+    def finish(self):
+        """标记片段已完整下载"""
+        self.assembler._finish_segment(self.index, self.generation)
+
+
+class SegmentAssembler:
+    """片段组装器
+
+    下载线程把片段直接写入最终输出文件。当前位于文件末尾的片段按块直接写盘，
+    提前到达的片段暂存在重排缓冲区中，缓冲区占用计入进程共享的下载预算。
+    续传时从start_index/start_offset处接着写，每个片段落盘后通过on_segment回调
+    报告序号、长度和sha256摘要。
+
+    提供output_stream(例如通向ffmpeg的管道)时写入该流而不是文件。流不能回退，
+    因此片段完整下载后才会写出，关闭组装器时同时关闭该流。
+    """
+    def __init__(self, output_path: Optional[Path], budget: Optional[TransferBudget] = None,
+                 start_index: int = 0, start_offset: int = 0,
+                 on_segment: Optional[Callable[[int, int, str], None]] = None,
+                 output_stream: Optional[BinaryIO] = None):
+        self.output_path = Path(output_path) if output_path else None
+        self.budget = budget or get_global_budget()
+        self._seekable = output_stream is None
+        if output_stream is not None:
+            self._file = output_stream
+        elif start_index > 0:
+            self._file = open(self.output_path, 'r+b')
+            self._file.truncate(start_offset)
+            self._file.seek(start_offset)
+        else:
+            self._file = open(self.output_path, 'wb')
+        self._lock = threading.Lock()
+        self._next_index = start_index
+        self._segments: Dict[int, _SegmentState] = {}
+        self.bytes_written = start_offset
+        self.on_segment = on_segment
+        self._write_error: Optional[OSError] = None  # 写出缓存的片段时出错后不再写出任何片段
+
+    def open_segment(self, index: int, blocking: bool = True) -> Optional[SegmentSink]:
+        """获取第index个片段的写入端，blocking为False且其他线程正持锁写盘时返回None"""
+        if not self._lock.acquire(blocking):
+            return None
+        try:
+            if index < self._next_index:
+                raise ValueError(f"片段 {index} 重复写入")
+            state = self._segments.setdefault(index, _SegmentState())
+            return SegmentSink(self, index, state.generation)
+        finally:
+            self._lock.release()
+
+    def supersede(self, index: int) -> Optional[SegmentSink]:
+        """丢弃片段已写入的数据并让现有写入端失效，返回新的写入端
+
+        用于尾部对冲：另一次请求先拿到完整数据时由它接管该片段。片段已完成时返回None。
+        """
+        with self._lock:
+            state = self._segments.get(index)
+            if state is None or state.complete:
+                return None
+            self._clear_state(state)
+            state.generation += 1
+            return SegmentSink(self, index, state.generation)
+
+    def _current_state(self, index: int, generation: int) -> _SegmentState:
+        state = self._segments.get(index)
+        if state is None or state.generation != generation:
+            raise SegmentSuperseded(f"片段 {index} 已由其他请求写入")
+        return state
+
+    def write(self, index: int, data: bytes):
+        """一次性提交第index个片段的完整内容"""
+        sink = self.open_segment(index)
+        sink.write(data)
+        sink.finish()
+
+    def _write_chunk(self, index: int, chunk: bytes, reserved: Optional[int] = None,
+                     generation: int = 0, buffer_only: bool = False) -> bool:
+        if not chunk:
+            self.budget.release_bytes(reserved or 0)
+            return True
+        # 先在锁外申请预算，成为队首片段时放弃等待直接写盘
+        if reserved is None:
+            reserved = 0
+            if self._next_index != index:
+                if self.budget.acquire_bytes(
+                    len(chunk), bypass=lambda: self._next_index == index or self._write_error is not None
+                ):
+                    reserved = len(chunk)
+
+        if not buffer_only:
+            self._lock.acquire()
+        elif not self._lock.acquire(blocking=False):
+            return False  # 其他线程正在持锁写盘，不在事件循环中等待
+        try:
+            return self._store_chunk(index, chunk, reserved, generation, buffer_only)
+        finally:
+            self._lock.release()
+
+    def _store_chunk(self, index: int, chunk: bytes, reserved: int, generation: int,
+                     buffer_only: bool) -> bool:
+        try:
+            state = self._current_state(index, generation)
+            if self._file.closed or self._write_error is not None:
+                # 出错后仍在进行的下载，输出已无法继续写入，让它尽快退出
+                raise SegmentSuperseded(f"组装器已失效，丢弃片段 {index} 的数据")
+        except SegmentSuperseded:
+            self.budget.release_bytes(reserved)
+            raise
+        if state.complete:
+            self.budget.release_bytes(reserved)
+            raise ValueError(f"片段 {index} 已完成，不能继续写入")
+        direct = index == self._next_index and self._seekable
+        if direct and buffer_only:
+            return False
+        if self.on_segment:
+            state.hasher.update(chunk)
+        state.length += len(chunk)
+        if direct:
+            self._make_direct(state)
+            self._file.write(chunk)
+            self.bytes_written += len(chunk)
+            self.budget.release_bytes(reserved)
+        else:
+            state.buffer.append(chunk)
+            state.buffered_bytes += reserved
+        return True
+
+    def _write_file(self, index: int, f: BinaryIO, size: int, generation: int = 0) -> bool:
+        with self._lock:
+            state = self._current_state(index, generation)
+            if index != self._next_index or not self._seekable or state.length or state.complete:
+                return False
+            self._make_direct(state)
+            copied = copy_range(f, self._file, 0, size)
+            if self.on_segment:
+                f.seek(0)
+                for chunk in iter(lambda: f.read(BUFFER_SIZE), b''):
+                    state.hasher.update(chunk)
+            state.length += copied
+            self.bytes_written += copied
+            if copied < size:
+                raise IOError(f"片段 {index} 的源文件不完整: {copied}/{size}")
+            return True
+
+    def _reset_segment(self, index: int, generation: int = 0):
+        with self._lock:
+            state = self._segments.get(index)
+            if state is None or state.generation != generation:
+                return
+            self._clear_state(state)
+
+    def _clear_state(self, state: _SegmentState):
+        self.budget.release_bytes(state.buffered_bytes)
+        state.buffer.clear()
+        state.buffered_bytes = 0
+        state.complete = False
+        state.length = 0
+        state.hasher = hashlib.sha256()
+        if state.direct:
+            state.direct = False
+            if not self._seekable:
+                raise IOError("片段已部分写入输出流，无法重新写入")
+            self._file.seek(state.start_offset)
+            self._file.truncate()
+            self.bytes_written = state.start_offset
+
+    def _finish_segment(self, index: int, generation: int = 0):
+        with self._lock:
+            self._current_state(index, generation).complete = True
+            self._advance()
+        self.budget.wake()
+
+    def _make_direct(self, state: _SegmentState):
+        """把队首片段切换为直接写盘模式，并写出已缓存的数据
+
+        写出途中出错时片段只写出了一部分，之后的片段不能再接在后面，缓冲区留到关闭时释放。
+        """
+        if self._write_error is not None:
+            raise IOError(f"写入输出失败，不能继续写入: {str(self._write_error)}")
+        if state.direct or (not self._seekable and not state.complete):
+            return
+        state.direct = True
+        state.start_offset = self.bytes_written
+        try:
+            for chunk in state.buffer:
+                self._file.write(chunk)
+                self.bytes_written += len(chunk)
+        except OSError as e:
+            self._write_error = e
+            self.budget.wake()  # 等待预算的写入端不会再等到队首推进
+            raise
+        state.buffer.clear()
+        self.budget.release_bytes(state.buffered_bytes)
+        state.buffered_bytes = 0
+
+    def _advance(self):
+        """写出所有已就绪的连续片段"""
+        while True:
+            state = self._segments.get(self._next_index)
+            if state is None:
+                return
+            self._make_direct(state)
+            if not state.complete:
+                return
+            del self._segments[self._next_index]
+            if self.on_segment:
+                # 先落盘再记录，保证日志中的片段一定已经写入文件
+                self._file.flush()
+                self.on_segment(self._next_index, state.length, state.hasher.hexdigest())
+            self._next_index += 1
+
+    def close(self, expected_count: int = None):
+        """关闭输出文件，并检查是否所有片段都已写入"""
+        with self._lock:
+            self._release_buffers()
+            if not self._file.closed:
+                self._file.close()
+            if expected_count is not None and self._next_index != expected_count:
+                raise IOError(
+                    f"片段不完整: 已写入 {self._next_index}/{expected_count}"
+                )
+
+    def _release_buffers(self):
+        for state in self._segments.values():
+            self.budget.release_bytes(state.buffered_bytes)
+            state.buffer.clear()
+            state.buffered_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._lock:
+            self._release_buffers()
+            if not self._file.closed:
+                self._file.close()
+        return False
@@ -0,0 +1,733 @@
+import asyncio
+import os
+import queue as queue_module
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Awaitable, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+from TwiVideoDownloader.assembler import SegmentAssembler, SegmentSink, SegmentSuperseded
+from TwiVideoDownloader.budget import TransferBudget, get_global_budget
+from TwiVideoDownloader.journal import SegmentJournal
+from TwiVideoDownloader.cache import SegmentCache
+from TwiVideoDownloader.concurrency import AdaptiveConcurrency
+from TwiVideoDownloader.retry import CircuitBreaker, RetryPolicy, call_with_retry_async, get_global_breaker, status_of
+from TwiVideoDownloader.metrics import DownloadMetrics, get_global_metrics
+from TwiVideoDownloader.ratelimit import TokenBucket, get_global_limiter
+from TwiVideoDownloader.segment_fetch import (
+    RANGE_PART_SIZE, TailHedger, check_length, check_part_response, expected_length, parse_content_range,
+    range_validator, split_ranges
+)
+from TwiVideoDownloader.integrity import IntegrityError, StreamDigest, checker_for, segment_recorder
+
+try:
+    import aiohttp
+except ImportError:  # 异步引擎为可选功能
+    aiohttp = None
+
+CHUNK_SIZE = 64 * 1024
+PIPE_QUEUE_BYTES = 8 * 1024 * 1024  # 每个管道排队等待写出的数据超过该值时暂停开始新片段
+WRITE_BATCH_SIZE = 1024 * 1024  # 需要写盘的数据每攒够该大小交给线程池写出一次
+
+
+@contextmanager
+def _notified(*sources) -> Iterator[asyncio.Event]:
+    """在任一source(TransferBudget、AdaptiveConcurrency)通知时设置返回的事件
+
+    通知可能来自其他线程，经call_soon_threadsafe转到事件循环中设置。
+    """
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+
+    def listener():
+        if not event.is_set():
+            loop.call_soon_threadsafe(event.set)
+
+    for source in sources:
+        source.add_listener(listener)
+    try:
+        yield event
+    finally:
+        for source in sources:
+            source.remove_listener(listener)
+
+
+def _copy_into(f: BinaryIO, sink: SegmentSink, size: int, reserved: int) -> int:
+    """从f读出至多size字节按块写入sink，reserved为已为这些数据申请的预算，返回读出的字节数"""
+    copied = 0
+    try:
+        while copied < size:
+            chunk = f.read(min(CHUNK_SIZE, size - copied))
+            if not chunk:
+                break
+            share = min(len(chunk), reserved)
+            reserved -= share
+            sink.write_reserved(chunk, share)
+            copied += len(chunk)
+    finally:
+        sink.release(reserved)
+    return copied
+
+
+class _PipeWriter:
+    """在专用线程中写管道，供组装器作为output_stream使用
+
+    管道写满时(例如ffmpeg正在读取另一个流)只阻塞该线程，不阻塞事件循环。
+    排队中的数据计入下载预算，超过max_queued时协程在wait_writable中等待，不再开始新片段。
+    数据由线程写完后连同底层流一起关闭，写入出错后的write抛出该错误。
+    """
+    def __init__(self, stream: BinaryIO, budget: TransferBudget, max_queued: int = PIPE_QUEUE_BYTES):
+        self._stream = stream
+        self._budget = budget
+        self.max_queued = max_queued
+        self.closed = False
+        self._queue = queue_module.Queue()
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._discard = False
+        self._loop = asyncio.get_running_loop()
+        self._written = asyncio.Event()  # 线程每写完一块数据时设置
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, chunk: bytes):
+        if self._error is not None:
+            raise self._error
+        with self._lock:
+            self._queued += len(chunk)
+        self._budget.charge_bytes(len(chunk))
+        self._queue.put(chunk)
+
+    def flush(self):
+        """数据由线程按顺序写出，这里无需等待"""
+
+    async def wait_writable(self):
+        """等待排队的数据降到max_queued以下"""
+        await self._wait_queued(self.max_queued)
+
+    async def drain(self):
+        """等待排队的数据全部写出，写入出错时抛出该错误"""
+        await self._wait_queued(0)
+        if self._error is not None:
+            raise self._error
+
+    async def _wait_queued(self, limit: int):
+        while self._queued > limit and self._error is None:
+            self._written.clear()
+            await self._written.wait()
+
+    def close(self):
+        """结束写入线程；数据已全部写出时等待线程关闭底层流，否则丢弃剩余数据，不阻塞事件循环"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._queued:
+            self._discard = True
+        self._queue.put(None)
+        if not self._discard:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self._error is None and not self._discard:
+                try:
+                    self._stream.write(chunk)
+                    self._stream.flush()
+                except (OSError, ValueError) as e:
+                    self._error = e
+            with self._lock:
+                self._queued -= len(chunk)
+            self._budget.release_bytes(len(chunk))
+            try:
+                self._loop.call_soon_threadsafe(self._written.set)
+            except RuntimeError:  # 事件循环已关闭
+                pass
+        try:
+            self._stream.close()
+        except OSError:
+            pass
+
+
+class AsyncDownloadEngine:
+    """异步下载引擎
+
+    在单个事件循环中完成配置、播放列表和所有片段的请求，
+    使用带连接池的aiohttp会话，不再为每个并发片段占用一个线程。
+    """
+    def __init__(self, base_url: str = "https://video.twimg.com", max_connections: int = 100,
+                 max_concurrency: int = 32, budget: Optional[TransferBudget] = None,
+                 cache: Optional[SegmentCache] = None, retry_policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None, range_parts: int = 4, hedge: bool = True,
+                 metrics: Optional[DownloadMetrics] = None):
+        if aiohttp is None:
+            raise ImportError("异步引擎需要安装 aiohttp: pip install aiohttp")
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.budget = budget or get_global_budget()
+        self.cache = cache
+        self.retry_policy = retry_policy
+        self.breaker = breaker or get_global_breaker()
+        self.range_parts = range_parts  # 大片段拆成的范围请求数，1表示不拆分
+        self.hedge = hedge  # 是否在尾部对冲最慢的片段
+        self.metrics = metrics or get_global_metrics()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    def _get_session(self):
+        """延迟创建会话，必须在事件循环中调用"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,
+                ttl_dns_cache=300,
+                keepalive_timeout=30
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+            )
+        return self._session
+
+    async def close(self):
+        """关闭会话并释放连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _full_url(self, uri: str) -> str:
+        return uri if uri.startswith('http') else f"{self.base_url.rstrip('/')}{uri}"
+
+    async def fetch_text(self, uri: str, headers: Optional[dict] = None) -> str:
+        """获取文本内容"""
+        session = self._get_session()
+        full_url = self._full_url(uri)
+
+        async def attempt_fetch(attempt: int) -> str:
+            async with session.get(full_url, headers=headers) as response:
+                response.raise_for_status()
+                return await response.text()
+
+        return await self._with_retry(attempt_fetch, full_url)
+
+    async def fetch_json(self, uri: str, headers: Optional[dict] = None):
+        """获取JSON内容"""
+        session = self._get_session()
+        full_url = self._full_url(uri)
+
+        async def attempt_fetch(attempt: int):
+            async with session.get(full_url, headers=headers) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+        return await self._with_retry(attempt_fetch, full_url)
+
+    async def _with_retry(self, func, full_url: str):
+        return await call_with_retry_async(
+            func, full_url, self.retry_policy, self.breaker,
+            exceptions=(aiohttp.ClientError, asyncio.TimeoutError, IOError)
+        )
+
+    async def download_segments(self, uris: List[str], output_file: Path,
+                                init_uri: Optional[str] = None,
+                                progress_callback=None, speed_callback=None,
+                                journal: Optional[SegmentJournal] = None,
+                                output_stream: Optional[BinaryIO] = None,
+                                concurrency: Optional[AdaptiveConcurrency] = None,
+                                stream: str = "media", bytes_callback=None,
+                                rate_limiter: Optional[TokenBucket] = None,
+                                refresh: Optional[Callable[[], Awaitable[Tuple[List[str], bool]]]] = None,
+                                digest: Optional[StreamDigest] = None) -> int:
+        """按顺序下载初始化片段和所有媒体片段，直接组装到输出文件或output_stream，返回写出的字节数
+
+        提供concurrency时按其上限动态限制同时进行的请求数，否则使用max_concurrency个协程。
+        stream为指标中的流名称(video或audio)，bytes_callback在每收到一块数据时以字节数调用。
+        rate_limiter为该任务的带宽限制，默认使用进程共享的限速。
+        提供refresh时跟随直播：refresh等待到下一次刷新时间并重新获取播放列表，返回(新片段URL, 是否已结束)，
+        新片段追加到输出末尾，直到播放列表结束。
+        提供digest时边下载边检查每个片段的box结构，并把每个片段的摘要记入digest。
+        """
+        rate_limiter = rate_limiter or get_global_limiter()
+        tasks = ([init_uri] if init_uri else []) + list(uris)
+        index_offset = 1 if init_uri else 0
+        total_segments = len(uris)
+
+        # 续传时跳过日志中已完成的片段
+        start_index, start_offset = journal.resume_point(Path(output_file)) if journal else (0, 0)
+        queue = deque((index, uri) for index, uri in enumerate(tasks) if index >= start_index)
+
+        if journal and digest:
+            # 续传时沿用的片段不再经过组装器，摘要取自日志
+            for entry in journal.entries.values():
+                if entry.index < start_index:
+                    digest.record(entry.index, entry.length, entry.checksum)
+        verify = digest is not None
+
+        completed_segments = max(0, start_index - index_offset)
+        downloaded_bytes = 0
+        start_time = time.time()
+        if completed_segments and progress_callback:
+            progress_callback(completed_segments, total_segments)
+
+        # 管道由专用线程写出，管道写满时不阻塞事件循环中另一个流的下载
+        pipe = _PipeWriter(output_stream, self.budget) if output_stream is not None else None
+        with SegmentAssembler(output_file, self.budget, start_index, start_offset,
+                              on_segment=segment_recorder(journal, digest),
+                              output_stream=pipe) as assembler:
+            hedger = TailHedger() if self.hedge else None
+            uri_of = dict((index, uri) for index, uri in queue)
+            running: Dict[int, asyncio.Future] = {}  # 序号 -> 正在下载该片段的任务
+            completed = set()
+            live = refresh is not None
+            queue_changed = asyncio.Condition()  # 跟随直播时有新片段或直播结束
+
+            def segment_done(index: int, bytes_downloaded: int):
+                nonlocal completed_segments, downloaded_bytes
+                completed.add(index)
+                if hedger:
+                    hedger.finished(index)
+                if index < index_offset:
+                    return
+
+                downloaded_bytes += bytes_downloaded
+                completed_segments += 1
+                if progress_callback:
+                    progress_callback(completed_segments, total_segments)
+
+                elapsed_time = time.time() - start_time
+                if elapsed_time > 0 and speed_callback:
+                    speed_callback(self._format_speed(downloaded_bytes / elapsed_time))
+
+            async def wait_running():
+                """等待任一进行中的片段结束，最多0.2秒，最后一个片段完成时空闲的协程立即退出"""
+                if running:
+                    await asyncio.wait(list(running.values()), timeout=0.2,
+                                       return_when=asyncio.FIRST_COMPLETED)
+
+            async def worker():
+                while queue or live:
+                    if not queue:
+                        # 跟随直播时等待下一次刷新带来新片段
+                        async with queue_changed:
+                            await queue_changed.wait_for(lambda: queue or not live)
+                        continue
+                    if pipe:
+                        await pipe.wait_writable()
+                        if not queue:
+                            continue
+                    index, uri = queue.popleft()
+                    task = asyncio.ensure_future(self._download_file(
+                        uri, assembler, index, concurrency, hedger, stream, bytes_callback, rate_limiter, verify
+                    ))
+                    running[index] = task
+                    try:
+                        bytes_downloaded = await task
+                    except asyncio.CancelledError:
+                        if index in completed:
+                            continue  # 已由对冲请求完成
+                        raise
+                    except Exception as e:
+                        print(f"下载片段 {uri} 失败: {str(e)}")
+                        raise
+                    finally:
+                        running.pop(index, None)
+                    if bytes_downloaded is not None and index not in completed:
+                        segment_done(index, bytes_downloaded)
+
+                # 队列已空，用空闲的协程对冲最慢的片段
+                while hedger and running:
+                    if concurrency and not concurrency.acquire(blocking=False):
+                        await wait_running()
+                        continue
+                    index = hedger.candidate(list(running))
+                    if index is None:
+                        if concurrency:
+                            concurrency.release()
+                        await wait_running()
+                        continue
+                    try:
+                        bytes_downloaded = await self._hedge_file(uri_of[index], assembler, index, stream,
+                                                                  rate_limiter, verify)
+                    finally:
+                        if concurrency:
+                            concurrency.release()
+                    if bytes_downloaded is None or index in completed:
+                        continue
+                    segment_done(index, bytes_downloaded)
+                    original = running.get(index)
+                    if original:
+                        original.cancel()
+
+            async def follow():
+                """按refresh的节奏把新片段加入队列，直播结束或刷新失败时让等待中的协程退出"""
+                nonlocal live, total_segments
+                while live:
+                    try:
+                        new_uris, ended = await refresh()
+                    except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                        print(f"刷新播放列表失败: {str(e)}，停止跟随直播")
+                        new_uris, ended = [], True
+                    for uri in new_uris:
+                        queue.append((len(tasks), uri))
+                        uri_of[len(tasks)] = uri
+                        tasks.append(uri)
+                    total_segments += len(new_uris)
+                    live = not ended
+                    async with queue_changed:
+                        queue_changed.notify_all()
+
+            worker_count = concurrency.maximum if concurrency else self.max_concurrency
+            workers = [
+                asyncio.ensure_future(worker())
+                for _ in range(worker_count if live else min(worker_count, len(queue)))
+            ]
+            if live:
+                workers.append(asyncio.ensure_future(follow()))
+            with self.metrics.phase("download"):
+                try:
+                    await asyncio.gather(*workers)
+                except BaseException:
+                    for task in workers:
+                        task.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    raise
+                if pipe:
+                    await pipe.drain()
+
+            # 片段已按顺序写入，这里只需关闭文件并校验片段数
+            with self.metrics.phase("merge"):
+                await self._run_blocking(assembler.close, len(tasks))
+            if digest:
+                digest.uris = tasks
+                digest.bytes = assembler.bytes_written
+
+        return assembler.bytes_written
+
+    async def _download_file(self, uri: str, assembler: SegmentAssembler, index: int,
+                             concurrency: Optional[AdaptiveConcurrency] = None,
+                             hedger: Optional[TailHedger] = None, stream: str = "media",
+                             bytes_callback=None, rate_limiter: Optional[TokenBucket] = None,
+                             verify: bool = False) -> Optional[int]:
+        """下载单个片段写入组装器，并返回下载的字节数；被对冲请求取代时返回None
+
+        verify为True时边下载边检查box结构，长度或结构不符时按失败处理并重新下载。
+        """
+        session = self._get_session()
+        full_url = self._full_url(uri)
+
+        # 组装器正在其他线程中持锁写盘时改在线程池中等待
+        sink = assembler.open_segment(index, blocking=False)
+        if sink is None:
+            sink = await self._run_blocking(assembler.open_segment, index)
+        if self.cache:
+            cached_size = await self._read_cached(full_url, sink)
+            if cached_size is not None:
+                if bytes_callback:
+                    bytes_callback(cached_size)
+                self.metrics.record_segment(stream, cached_size, 0.0, 0, source="cache")
+                return cached_size
+
+        attempts = 0
+
+        async def attempt_download(attempt: int) -> int:
+            nonlocal attempts
+            attempts = attempt + 1
+            if attempt > 0:
+                await self._run_blocking(sink.reset)
+            writer = await self._run_blocking(self.cache.writer, full_url) if self.cache else None
+            checker = checker_for(full_url) if verify else None
+
+            # 需要写盘的数据攒够WRITE_BATCH_SIZE再交给线程池，(数据, 预留字节, 是否已进入重排缓冲区)
+            batch: List[Tuple[bytes, int, bool]] = []
+            batch_size = 0
+
+            def store(items: List[Tuple[bytes, int, bool]], finish: bool = False):
+                for position, (chunk, reserved, buffered) in enumerate(items):
+                    try:
+                        if not buffered:
+                            sink.write_reserved(chunk, reserved)
+                        if writer:
+                            writer.write(chunk)
+                    except BaseException:
+                        self.budget.release_bytes(sum(r for _, r, b in items[position + 1:] if not b))
+                        raise
+                if finish:
+                    sink.finish()
+
+            async def flush(finish: bool = False):
+                nonlocal batch, batch_size
+                items, batch, batch_size = batch, [], 0
+                if items or finish:
+                    await self._run_blocking(store, items, finish)
+
+            async def write(chunk: bytes):
+                nonlocal batch_size
+                if checker:
+                    checker.feed(chunk)
+                reserved = await self._reserve(sink, len(chunk))
+                # 进入重排缓冲区的数据不涉及磁盘，无需经过线程池
+                buffered = not batch and sink.buffer_reserved(chunk, reserved)
+                if writer or not buffered:
+                    batch.append((chunk, reserved, buffered))
+                    batch_size += len(chunk)
+                    if batch_size >= WRITE_BATCH_SIZE:
+                        await flush()
+                if bytes_callback:
+                    bytes_callback(len(chunk))
+
+            request_start = time.time()
+            status = None
+
+            def on_response(code: int):
+                nonlocal status
+                status = code
+                self.metrics.record_ttfb(stream, time.time() - request_start)
+
+            try:
+                downloaded = await self._fetch_ranged(session, full_url, write, on_response, rate_limiter, sink)
+                if checker:
+                    checker.finish()
+                await flush(finish=True)
+            except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                if writer:
+                    writer.discard()
+                if isinstance(e, IntegrityError):
+                    self.metrics.record_integrity_failure(stream)
+                self.metrics.record_response(stream, status_of(e))
+                if concurrency:
+                    concurrency.record_failure(status_of(e))
+                raise
+            except (SegmentSuperseded, asyncio.CancelledError):
+                if writer:
+                    writer.discard()
+                raise
+            finally:
+                # 出错时尚未交给组装器的数据
+                self.budget.release_bytes(sum(reserved for _, reserved, buffered in batch if not buffered))
+                batch.clear()
+            if writer:
+                await self._run_blocking(writer.commit)
+            self.metrics.record_response(stream, status)
+            if concurrency:
+                concurrency.record_success(downloaded, time.time() - request_start)
+            return downloaded
+
+        acquired = await self._acquire(concurrency, sink) if concurrency else False
+        if hedger:
+            hedger.started(index)
+        segment_start = time.time()
+        try:
+            downloaded = await self._with_retry(attempt_download, full_url)
+            self.metrics.record_segment(stream, downloaded, time.time() - segment_start, attempts)
+            return downloaded
+        except SegmentSuperseded:
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError):
+            await self._run_blocking(sink.reset)
+            raise
+        finally:
+            if acquired:
+                concurrency.release()
+
+    async def _fetch_ranged(self, session, full_url: str, write, on_response=None,
+                            limiter: Optional[TokenBucket] = None, sink: Optional[SegmentSink] = None) -> int:
+        """下载full_url并按顺序交给协程函数write，返回字节数
+
+        与segment_fetch.fetch_ranged相同：首段边下载边写出，服务器支持范围请求且对象更大时，
+        其余部分拆成至多range_parts-1个范围并发下载，首段结束后再按顺序写出；
+        分段带上首个响应的If-Range，与首个响应不属于同一个对象时抛出IntegrityError。
+        提供sink时每个分段在请求前先申请整段的缓冲预算，写出后释放。
+        """
+        headers = {'Range': f'bytes=0-{RANGE_PART_SIZE - 1}'} if self.range_parts > 1 else None
+        parts = []
+        size = 0
+        try:
+            async with session.get(full_url, headers=headers) as response:
+                response.raise_for_status()
+                if on_response:
+                    on_response(response.status)
+                if response.status == 206:
+                    start, end, total = parse_content_range(response.headers.get('Content-Range'))
+                    if start != 0:
+                        raise IOError(f"服务器返回了错误的范围 {start}-{end}")
+                    if total is not None and end + 1 < total:
+                        validator = range_validator(response.headers)
+                        parts = [
+                            asyncio.ensure_future(self._fetch_part(session, full_url, part_start, part_end, total,
+                                                                   validator, limiter, sink))
+                            for part_start, part_end in split_ranges(end + 1, total, self.range_parts - 1)
+                        ]
+                expected = expected_length(response.status, response.headers)
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if limiter:
+                        await limiter.consume_async(len(chunk))
+                    await write(chunk)
+                    size += len(chunk)
+                check_length(full_url, size, expected)
+            while parts:
+                data, reserved = await parts.pop(0)
+                try:
+                    for offset in range(0, len(data), CHUNK_SIZE):
+                        await write(data[offset:offset + CHUNK_SIZE])
+                finally:
+                    self.budget.release_bytes(reserved)
+                size += len(data)
+            return size
+        finally:
+            for part in parts:
+                part.cancel()
+            if parts:
+                # 已下载但未写出的分段
+                for result in await asyncio.gather(*parts, return_exceptions=True):
+                    if isinstance(result, tuple):
+                        self.budget.release_bytes(result[1])
+
+    async def _fetch_part(self, session, full_url: str, start: int, end: int, total: int,
+                          validator: Optional[dict] = None, limiter: Optional[TokenBucket] = None,
+                          sink: Optional[SegmentSink] = None) -> Tuple[bytes, int]:
+        """下载一个范围，返回数据和在读取前为sink预留的缓冲预算字节数"""
+        reserved = await self._reserve(sink, end - start + 1) if sink is not None else 0
+        try:
+            headers = dict(validator or {}, Range=f'bytes={start}-{end}')
+            async with session.get(full_url, headers=headers) as response:
+                check_part_response(full_url, response.status, response.headers, start, end, total)
+                response.raise_for_status()
+                if limiter is None or not limiter.limited:
+                    data = await response.read()
+                else:
+                    data = bytearray()
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        await limiter.consume_async(len(chunk))
+                        data += chunk
+                    data = bytes(data)
+            check_length(full_url, len(data), end - start + 1)
+        except BaseException:
+            self.budget.release_bytes(reserved)
+            raise
+        return data, reserved
+
+    async def _hedge_file(self, uri: str, assembler: SegmentAssembler, index: int,
+                          stream: str = "media", rate_limiter: Optional[TokenBucket] = None,
+                          verify: bool = False) -> Optional[int]:
+        """重新完整下载片段，先于原请求拿到数据时接管该片段；未能接管时返回None"""
+        chunks = []
+        checker = checker_for(self._full_url(uri)) if verify else None
+
+        async def write(chunk: bytes):
+            if checker:
+                checker.feed(chunk)
+            chunks.append(chunk)
+
+        try:
+            size = await self._fetch_ranged(self._get_session(), self._full_url(uri), write,
+                                            limiter=rate_limiter)
+            if checker:
+                checker.finish()
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError):
+            return None
+
+        def store() -> bool:
+            sink = assembler.supersede(index)
+            if sink is None:
+                return False
+            # 数据已在内存中，无需再申请缓冲预算
+            for chunk in chunks:
+                sink.write_reserved(chunk, 0)
+            sink.finish()
+            return True
+
+        if not await self._run_blocking(store):
+            return None
+        self.metrics.record_segment(stream, size, 0.0, 0, source="hedge")
+        return size
+
+    async def _acquire(self, concurrency: AdaptiveConcurrency, sink: SegmentSink) -> bool:
+        """在不阻塞事件循环的前提下申请并发名额，队首片段不等待名额
+
+        名额归还、上限变化或队首推进(组装器通过预算通知)时再重新申请。
+        """
+        with _notified(concurrency, self.budget) as changed:
+            while not sink.is_head:
+                if concurrency.acquire(blocking=False):
+                    return True
+                await changed.wait()
+                changed.clear()
+        return False
+
+    async def _read_cached(self, full_url: str, sink: SegmentSink) -> Optional[int]:
+        """从片段缓存读取并完成片段，未命中或读取失败时返回None，读取失败时已丢弃写入的数据"""
+        def open_cached():
+            cached_file = self.cache.open(full_url)
+            if cached_file is None:
+                return None, None
+            try:
+                file_size = os.fstat(cached_file.fileno()).st_size
+                # 队首片段直接在内核中复制到输出文件，与完成片段在同一次线程池调用中进行
+                copied = sink.write_file(cached_file, file_size)
+            except OSError:
+                cached_file.close()
+                sink.reset()
+                return None, None
+            if not copied:
+                return cached_file, file_size
+            cached_file.close()
+            sink.finish()
+            return None, file_size
+
+        cached_file, file_size = await self._run_blocking(open_cached)
+        if cached_file is None:
+            return file_size
+        size = 0
+        try:
+            with cached_file:
+                while size < file_size:
+                    # 每次为至多WRITE_BATCH_SIZE字节申请预算，在线程池中读出并写入
+                    want = min(WRITE_BATCH_SIZE, file_size - size)
+                    reserved = await self._reserve(sink, want)
+                    copied = await self._run_blocking(_copy_into, cached_file, sink, want, reserved)
+                    if not copied:
+                        break
+                    size += copied
+        except OSError:
+            await self._run_blocking(sink.reset)
+            return None
+        await self._run_blocking(sink.finish)
+        return size
+
+    async def _reserve(self, sink: SegmentSink, size: int) -> int:
+        """在不阻塞事件循环的前提下申请缓冲预算，队首片段直接写盘无需预算
+
+        预算释放或队首推进时再重新申请。
+        """
+        with _notified(self.budget) as changed:
+            while not sink.is_head:
+                if self.budget.acquire_bytes(size, blocking=False):
+                    return size
+                await changed.wait()
+                changed.clear()
+        return 0
+
+    @staticmethod
+    async def _run_blocking(func, *args):
+        """在线程池中执行写文件等阻塞操作，不阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _format_speed(self, bytes_per_second: float) -> str:
+        """格式化下载速度"""
+        if bytes_per_second >= 1024 * 1024:
+            return f"{bytes_per_second / (1024 * 1024):.1f} MB/s"
+        elif bytes_per_second >= 1024:
+            return f"{bytes_per_second / 1024:.1f} KB/s"
+        else:
+            return f"{bytes_per_second:.1f} B/s"
@@ -1,13 +1,27 @@
 from dataclasses import dataclass
-from typing import List, Optional
-import re
+from typing import BinaryIO, Callable, List, Optional
 import os
 import requests
 from pathlib import Path
-import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from TwiVideoDownloader.assembler import SegmentAssembler, SegmentSuperseded
+from TwiVideoDownloader.budget import TransferBudget, get_global_budget
+from TwiVideoDownloader.transport import HttpTransport
+from TwiVideoDownloader.journal import SegmentJournal, variant_key
+from TwiVideoDownloader.cache import SegmentCache
+from TwiVideoDownloader.concurrency import AdaptiveConcurrency
+from TwiVideoDownloader.retry import CircuitBreaker, RetryPolicy, call_with_retry, get_global_breaker, status_of
+from TwiVideoDownloader.segment_fetch import TailHedger, fetch_ranged
+from TwiVideoDownloader.metrics import DownloadMetrics, get_global_metrics
+from TwiVideoDownloader.ratelimit import TokenBucket, get_global_limiter
+from TwiVideoDownloader.integrity import IntegrityError, StreamDigest, checker_for, segment_recorder
+from TwiVideoDownloader.playlist import (
+    MediaPlaylist, iter_playlist_tail, live_poll_interval, parse_media_playlist, segments_in_range
+)
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import time
 
+CHUNK_SIZE = 64 * 1024
+
 @dataclass
 class AudioSegment:
     """音频片段信息"""
@@ -25,126 +39,393 @@ class AudioM3U8Parser:
         self.playlist_type: str = ""
         self.map_uri: Optional[str] = None
         self.segments: List[AudioSegment] = []
+        self.endlist: bool = False    # 是否有EXT-X-ENDLIST，没有时为仍在更新的直播或EVENT列表
+        self.next_sequence: int = 0   # 下一个新片段的媒体序号
     
     def parse(self, content: str):
-        """解析M3U8文件内容"""
-        lines = content.strip().split('\n')
-        current_start = 0
-        
-        for i, line in enumerate(lines):
-            line = line.strip()
-            
-            if line.startswith('#EXT-X-VERSION:'):
-                self.version = int(line.split(':')[1])
-            elif line.startswith('#EXT-X-TARGETDURATION:'):
-                self.target_duration = int(line.split(':')[1])
-            elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
-                self.media_sequence = int(line.split(':')[1])
-            elif line.startswith('#EXT-X-PLAYLIST-TYPE:'):
-                self.playlist_type = line.split(':')[1]
-            elif line.startswith('#EXT-X-MAP:'):
-                self.map_uri = re.search(r'URI="([^"]+)"', line).group(1)
-            elif line.startswith('#EXTINF:'):
-                duration = float(line.split(':')[1].rstrip(','))
-                uri = lines[i + 1].strip()
-                end_time = current_start + int(duration * 1000)
-                self.segments.append(AudioSegment(
-                    duration=duration,
-                    uri=uri,
-                    start_time=current_start,
-                    end_time=end_time
-                ))
-                current_start = end_time
+        """解析M3U8文件内容，每次解析都会替换之前的结果"""
+        playlist = parse_media_playlist(content)
+        self.version = playlist.version
+        self.target_duration = playlist.target_duration
+        self.media_sequence = playlist.media_sequence
+        self.playlist_type = playlist.playlist_type
+        self.map_uri = playlist.map_uri
+        self.endlist = playlist.endlist
+        self.next_sequence = playlist.media_sequence + len(playlist)
+        self.segments = [
+            AudioSegment(
+                duration=segment.duration,
+                uri=segment.uri,
+                start_time=segment.start_time,
+                end_time=segment.end_time
+            )
+            for segment in playlist
+        ]
+    
+    def update(self, content: str) -> List[AudioSegment]:
+        """解析重新获取的直播播放列表，按媒体序号把新出现的片段追加到segments并返回这些片段
+
+        直播列表会从头部移除旧片段，按EXT-X-MEDIA-SEQUENCE而不是按位置对齐；
+        刷新不及时、新片段之前的片段已被移除时跳过它们并给出提示。
+        """
+        playlist = MediaPlaylist()
+        start_time = self.segments[-1].end_time if self.segments else 0
+        tail = list(iter_playlist_tail(content, self.next_sequence, start_time, playlist))
+        self.target_duration = playlist.target_duration or self.target_duration
+        self.endlist = playlist.endlist
+        if not tail:
+            return []
+        if tail[0].index > self.next_sequence:
+            print(f"直播播放列表已移除 {tail[0].index - self.next_sequence} 个未下载的片段，从最新的片段继续")
+        self.next_sequence = tail[-1].index + 1
+        new_segments = [
+            AudioSegment(
+                duration=segment.duration,
+                uri=segment.uri,
+                start_time=segment.start_time,
+                end_time=segment.end_time
+            )
+            for segment in tail
+        ]
+        self.segments.extend(new_segments)
+        return new_segments
 
 class AudioDownloader:
     """音频下载器"""
     def __init__(self, base_url: str, output_dir: str = "downloads", 
-                 max_workers: int = 5, progress_callback=None, speed_callback=None):
+                 max_workers: int = 5, progress_callback=None, speed_callback=None,
+                 budget: Optional[TransferBudget] = None, segment_limiter=None,
+                 transport: Optional[HttpTransport] = None, resume: bool = False,
+                 job_id: Optional[str] = None, cache: Optional[SegmentCache] = None,
+                 concurrency: Optional[AdaptiveConcurrency] = None,
+                 retry_policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None,
+                 range_parts: int = 4, hedge: bool = True, metrics: Optional[DownloadMetrics] = None,
+                 bytes_callback=None, rate_limiter: Optional[TokenBucket] = None, verify: bool = True):
         self.base_url = base_url
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.parser = AudioM3U8Parser()
-        self.session = requests.Session()
+        self.transport = transport or HttpTransport.for_concurrency(max_workers, streams=1)
         self.max_workers = max_workers
         self.progress_callback = progress_callback
         self.speed_callback = speed_callback
+        self.bytes_callback = bytes_callback  # 每收到一块数据时以字节数调用，用于按字节统计速度
+        self.budget = budget or get_global_budget()
+        self.segment_limiter = segment_limiter  # 可选的全局并发限制，多个下载器共享
+        self.resume = resume  # 是否使用片段日志断点续传
+        self.job_id = job_id
+        self.cache = cache  # 可选的片段缓存，命中时不访问网络
+        self.concurrency = concurrency  # 可选的自适应并发控制，提供时并发数由其动态决定
+        self.retry_policy = retry_policy
+        self.breaker = breaker or get_global_breaker()
+        self.range_parts = range_parts  # 大片段拆成的范围请求数，1表示不拆分
+        self.hedge = hedge  # 是否在尾部对冲最慢的片段
+        self.metrics = metrics or get_global_metrics()
+        self.rate_limiter = rate_limiter or get_global_limiter()  # 带宽限制，默认使用进程共享的限速
+        self.verify = verify  # 边下载边检查片段的box结构，并记录每个片段的摘要
+        self.digest: Optional[StreamDigest] = None
+        self.output_bytes = 0
 
-    def download(self, m3u8_content: str) -> str:
-        """下载并合并音频文件"""
+    def download(self, m3u8_content: str, output_stream: Optional[BinaryIO] = None,
+                 start: Optional[float] = None, end: Optional[float] = None,
+                 refresh: Optional[Callable[[], str]] = None) -> str:
+        """下载音频片段并直接组装到输出文件
+
+        提供output_stream时按顺序写入该流(例如ffmpeg的输入管道)，此时不使用续传日志。
+        提供start/end(秒)时只下载与该时间段有重叠的片段，初始化片段照常下载。
+        提供refresh时跟随直播：播放列表没有EXT-X-ENDLIST时大约每个TARGETDURATION调用refresh
+        重新获取播放列表，新片段追加到输出末尾，直到出现EXT-X-ENDLIST；此时不使用续传日志。
+        """
         self.parser.parse(m3u8_content)
+        if start is not None or end is not None:
+            self.parser.segments = segments_in_range(self.parser.segments, start, end)
+            if not self.parser.segments:
+                raise ValueError("指定的时间段内没有音频片段")
         
-        init_file = None
-        if self.parser.map_uri:
-            init_file = self.output_dir / "init.mp4"
-            self._download_file(self.parser.map_uri, init_file)
-        
-        download_tasks = []
-        segment_files = []
-        for i, segment in enumerate(self.parser.segments):
-            segment_file = self.output_dir / f"segment_{i:04d}.m4s"
-            segment_files.append(segment_file)
-            download_tasks.append((segment.uri, segment_file))
-        
-        completed_segments = 0
-        total_segments = len(download_tasks)
+        output_file = self.output_dir / "output.mp4"
+        following = refresh is not None and not self.parser.endlist
+        journal = None
+        start_index, start_offset = 0, 0
+        if self.resume and output_stream is None and not following:
+            uris = ([self.parser.map_uri] if self.parser.map_uri else []) + [
+                segment.uri for segment in self.parser.segments
+            ]
+            journal = SegmentJournal(output_file.with_suffix('.journal'), variant_key(self.job_id, uris))
+            start_index, start_offset = journal.resume_point(output_file)
+        self.digest = StreamDigest() if self.verify else None
+        if journal and self.digest:
+            # 续传时沿用的片段不再经过组装器，摘要取自日志
+            for entry in journal.entries.values():
+                if entry.index < start_index:
+                    self.digest.record(entry.index, entry.length, entry.checksum)
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_file = {
-                executor.submit(self._download_file, uri, file_path): file_path
-                for uri, file_path in download_tasks
-            }
-            
-            start_time = time.time()
-            downloaded_bytes = 0
-            
-            for future in as_completed(future_to_file):
-                file_path = future_to_file[future]
-                try:
-                    bytes_downloaded = future.result()
-                    downloaded_bytes += bytes_downloaded
-                    completed_segments += 1
+        try:
+            with SegmentAssembler(output_file, self.budget, start_index, start_offset,
+                                  on_segment=segment_recorder(journal, self.digest),
+                                  output_stream=output_stream) as assembler:
+                index_offset = 1 if self.parser.map_uri else 0
+                # 初始化片段作为第0个任务和媒体片段一起进入提交窗口，不单独占用一次往返；
+                # 续传时跳过日志中已完成的片段
+                uris = ([self.parser.map_uri] if self.parser.map_uri else []) + [
+                    segment.uri for segment in self.parser.segments
+                ]
+                download_tasks = [(uri, i) for i, uri in enumerate(uris) if i >= start_index]
+                
+                total_segments = len(self.parser.segments)
+                completed_segments = min(total_segments, max(0, start_index - index_offset))
+                task_count = len(download_tasks)
+                if completed_segments and self.progress_callback:
+                    self.progress_callback(completed_segments, total_segments)
+                
+                pool_size = self.concurrency.maximum if self.concurrency else self.max_workers
+                hedger = TailHedger() if self.hedge else None
+                with self.metrics.phase("download"):
+                    executor = ThreadPoolExecutor(max_workers=pool_size)
+                    try:
+                        # 按顺序滚动提交，未完成的片段数同时受本地窗口和全局预算限制
+                        future_to_task = {}  # future -> (uri, 序号, 是否为对冲请求)
+                        not_done = set()
+                        completed_indexes = set()
+                        next_task = 0
                     
-                    if self.progress_callback:
-                        self.progress_callback(completed_segments, total_segments)
+                        start_time = time.time()
+                        downloaded_bytes = 0
+                        next_poll = start_time + live_poll_interval(self.parser.target_duration, True)
                     
-                    elapsed_time = time.time() - start_time
-                    if elapsed_time > 0 and self.speed_callback:
-                        speed = downloaded_bytes / elapsed_time
-                        speed_str = self._format_speed(speed)
-                        self.speed_callback(speed_str)
+                        while next_task < task_count or not_done or following:
+                            window = (self.concurrency.limit if self.concurrency else self.max_workers) * 2
+                            while next_task < task_count and len(not_done) < window:
+                                if not self.budget.acquire_slot(blocking=not not_done):
+                                    break
+                                uri, index = download_tasks[next_task]
+                                next_task += 1
+                                future = executor.submit(self._download_file, uri, assembler, index, hedger)
+                                future.add_done_callback(lambda _: self.budget.release_slot())
+                                future_to_task[future] = (uri, index, False)
+                                not_done.add(future)
                         
-                except Exception as e:
-                    print(f"下载文件 {file_path} 失败: {str(e)}")
-                    raise
-        
-        output_file = self.output_dir / "output.mp4"
-        self._merge_files(init_file, segment_files, output_file)
+                            # 全部提交后进入尾部，定期检查是否需要对冲
+                            tail = hedger is not None and next_task >= task_count
+                            if tail:
+                                self._submit_hedges(executor, assembler, hedger, future_to_task, not_done, pool_size)
+                        
+                            timeout = 0.2 if tail else None
+                            if following:
+                                if time.time() >= next_poll:
+                                    following, new_count = self._follow(refresh, download_tasks, index_offset)
+                                    total_segments += new_count
+                                    task_count = len(download_tasks)
+                                    next_poll = time.time() + live_poll_interval(self.parser.target_duration, new_count > 0)
+                                    continue  # 立即提交新片段
+                                until_poll = next_poll - time.time()
+                                timeout = until_poll if timeout is None else min(timeout, until_poll)
+                        
+                            done, not_done = wait(not_done, timeout=timeout, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                uri, index, is_hedge = future_to_task.pop(future)
+                                try:
+                                    bytes_downloaded = future.result()
+                                except Exception as e:
+                                    if is_hedge or index in completed_indexes:
+                                        continue
+                                    print(f"下载片段 {uri} 失败: {str(e)}")
+                                    for pending in not_done:
+                                        pending.cancel()
+                                    raise
+                                # 被对冲请求取代的原请求返回None
+                                if bytes_downloaded is None or index in completed_indexes:
+                                    continue
+                                completed_indexes.add(index)
+                                if hedger:
+                                    hedger.finished(index)
+                                downloaded_bytes += bytes_downloaded
+                                if index < index_offset:
+                                    continue  # 初始化片段不计入进度
+                                completed_segments += 1
+                            
+                                if self.progress_callback:
+                                    self.progress_callback(completed_segments, total_segments)
+                            
+                                elapsed_time = time.time() - start_time
+                                if elapsed_time > 0 and self.speed_callback:
+                                    speed = downloaded_bytes / elapsed_time
+                                    speed_str = self._format_speed(speed)
+                                    self.speed_callback(speed_str)
+                        
+                            # 片段已由另一次请求完成时不再等待落后的那个请求
+                            not_done = {f for f in not_done if future_to_task[f][1] not in completed_indexes}
+                    except BaseException:
+                        executor.shutdown(wait=True)
+                        raise
+                    else:
+                        # 被取代的请求写入时会发现自己已失效并退出，无需等待
+                        executor.shutdown(wait=False)
+                
+                # 片段已按顺序写入，这里只需关闭文件并校验片段数
+                with self.metrics.phase("merge"):
+                    assembler.close(total_segments + index_offset)
+                self.output_bytes = assembler.bytes_written
+                if self.digest:
+                    self.digest.uris = ([self.parser.map_uri] if self.parser.map_uri else []) + [
+                        segment.uri for segment in self.parser.segments
+                    ]
+                    self.digest.bytes = assembler.bytes_written
         
-        cleanup_files = segment_files
-        if init_file:
-            cleanup_files.append(init_file)
-        self._cleanup_files(cleanup_files)
+        finally:
+            if journal:
+                journal.close()
         
         return str(output_file)
 
-    def _download_file(self, uri: str, output_path: Path) -> int:
-        """下载单个文件并返回下载的字节数"""
+    def _follow(self, refresh: Callable[[], str], download_tasks: list, index_offset: int):
+        """重新获取直播播放列表，把新片段追加到download_tasks，返回(是否继续跟随, 新片段数)
+
+        刷新在重试后仍失败时停止跟随，保留已下载的部分。
+        """
+        try:
+            content = refresh()
+        except (requests.RequestException, IOError) as e:
+            print(f"刷新音频播放列表失败: {str(e)}，停止跟随直播")
+            return False, 0
+        first_index = index_offset + len(self.parser.segments)
+        new_segments = self.parser.update(content)
+        download_tasks.extend((segment.uri, first_index + i) for i, segment in enumerate(new_segments))
+        return not self.parser.endlist, len(new_segments)
+
+    def _download_file(self, uri: str, assembler: SegmentAssembler, index: int,
+                       hedger: Optional[TailHedger] = None) -> Optional[int]:
+        """下载单个片段写入组装器，并返回下载的字节数；被对冲请求取代时返回None"""
         full_url = uri if uri.startswith('http') else f"{self.base_url.rstrip('/')}{uri}"
         
-        max_retries = 3
-        for attempt in range(max_retries):
+        sink = assembler.open_segment(index)
+        if self.cache:
+            cached_size = self.cache.read_into(full_url, sink.write, CHUNK_SIZE, sink.write_file)
+            if cached_size is not None:
+                sink.finish()
+                if self.bytes_callback:
+                    self.bytes_callback(cached_size)
+                self.metrics.record_segment("audio", cached_size, 0.0, 0, source="cache")
+                return cached_size
+            sink.reset()
+        
+        attempts = 0
+        
+        def attempt_download(attempt: int) -> int:
+            nonlocal attempts
+            attempts = attempt + 1
+            if attempt > 0:
+                sink.reset()
+            writer = self.cache.writer(full_url) if self.cache else None
+            checker = checker_for(full_url) if self.verify else None
+            
+            def write(chunk: bytes):
+                if checker:
+                    checker.feed(chunk)
+                sink.write(chunk)
+                if writer:
+                    writer.write(chunk)
+                if self.bytes_callback:
+                    self.bytes_callback(len(chunk))
+            
+            request_start = time.time()
+            status = None
+            
+            def on_response(code: int):
+                nonlocal status
+                status = code
+                self.metrics.record_ttfb("audio", time.time() - request_start)
+            
             try:
-                response = self.session.get(full_url, timeout=30)
-                response.raise_for_status()
-                
-                content = response.content
-                with open(output_path, 'wb') as f:
-                    f.write(content)
-                return len(content)
+                downloaded = fetch_ranged(self.transport, full_url, write, self.range_parts,
+                                          on_response=on_response, limiter=self.rate_limiter, sink=sink)
+                if checker:
+                    checker.finish()
+                sink.finish()
             except (requests.RequestException, IOError) as e:
-                if attempt == max_retries - 1:
-                    raise
-                continue
+                if writer:
+                    writer.discard()
+                if isinstance(e, IntegrityError):
+                    self.metrics.record_integrity_failure("audio")
+                self.metrics.record_response("audio", status_of(e))
+                if self.concurrency:
+                    self.concurrency.record_failure(status_of(e))
+                raise
+            except SegmentSuperseded:
+                if writer:
+                    writer.discard()
+                raise
+            if writer:
+                writer.commit()
+            self.metrics.record_response("audio", status)
+            if self.concurrency:
+                self.concurrency.record_success(downloaded, time.time() - request_start)
+            return downloaded
+        
+        with sink.limited(self.segment_limiter), sink.limited(self.concurrency):
+            if hedger:
+                hedger.started(index)
+            segment_start = time.time()
+            try:
+                downloaded = call_with_retry(attempt_download, full_url, self.retry_policy, self.breaker,
+                                             exceptions=(requests.RequestException, IOError))
+                self.metrics.record_segment("audio", downloaded, time.time() - segment_start, attempts)
+                return downloaded
+            except SegmentSuperseded:
+                return None
+            except (requests.RequestException, IOError):
+                sink.reset()
+                raise
+
+    def _submit_hedges(self, executor: ThreadPoolExecutor, assembler: SegmentAssembler,
+                       hedger: TailHedger, future_to_task: dict, not_done: set, pool_size: int):
+        """尾部有空闲线程时为最慢的片段发起对冲请求，对冲请求同样占用并发名额"""
+        while len(not_done) < pool_size:
+            limiters = []
+            for limiter in (self.segment_limiter, self.concurrency):
+                if limiter is None:
+                    continue
+                if not limiter.acquire(blocking=False):
+                    break
+                limiters.append(limiter)
+            else:
+                running = {task[1]: task[0] for f, task in future_to_task.items() if f in not_done and not task[2]}
+                index = hedger.candidate(running)
+                if index is not None:
+                    future = executor.submit(self._hedge_file, running[index], assembler, index, limiters)
+                    future_to_task[future] = (running[index], index, True)
+                    not_done.add(future)
+                    continue
+            for limiter in limiters:
+                limiter.release()
+            return
+
+    def _hedge_file(self, uri: str, assembler: SegmentAssembler, index: int, limiters: list) -> Optional[int]:
+        """重新完整下载片段，先于原请求拿到数据时接管该片段；未能接管时返回None"""
+        full_url = uri if uri.startswith('http') else f"{self.base_url.rstrip('/')}{uri}"
+        chunks = []
+        try:
+            size = fetch_ranged(self.transport, full_url, chunks.append, self.range_parts,
+                                limiter=self.rate_limiter)
+            checker = checker_for(full_url) if self.verify else None
+            if checker:
+                for chunk in chunks:
+                    checker.feed(chunk)
+                checker.finish()
+        except (requests.RequestException, IOError):
+            return None
+        finally:
+            for limiter in limiters:
+                limiter.release()
+        
+        sink = assembler.supersede(index)
+        if sink is None:
+            return None
+        # 数据已在内存中，无需再申请缓冲预算
+        for chunk in chunks:
+            sink.write_reserved(chunk, 0)
+        sink.finish()
+        self.metrics.record_segment("audio", size, 0.0, 0, source="hedge")
+        return size
 
     def _format_speed(self, bytes_per_second: float) -> str:
         """格式化下载速度"""
@@ -154,20 +435,3 @@ class AudioDownloader:
             return f"{bytes_per_second / 1024:.1f} KB/s"
         else:
             return f"{bytes_per_second:.1f} B/s"
-
-    def _merge_files(self, init_file: Path, segment_files: List[Path], output_file: Path):
-        """合并初始化片段和音频片段"""
-        with open(output_file, 'wb') as outfile:
-            if init_file:
-                with open(init_file, 'rb') as infile:
-                    outfile.write(infile.read())
-            
-            for segment_file in segment_files:
-                with open(segment_file, 'rb') as infile:
-                    outfile.write(infile.read())
-
-    def _cleanup_files(self, files: List[Path]):
-        """清理临时文件"""
-        for file in files:
-            if file.exists():
-                file.unlink()
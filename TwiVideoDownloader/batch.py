@@ -0,0 +1,225 @@
+import asyncio
+import json
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Iterable, List, Optional
+from TwiVideoDownloader.fetch_source import VideoSourceFetcher
+from TwiVideoDownloader.media_downloader import MediaDownloader
+from TwiVideoDownloader.async_engine import AsyncDownloadEngine
+from TwiVideoDownloader.transport import HttpTransport
+from TwiVideoDownloader.cache import SegmentCache
+from TwiVideoDownloader.metadata_cache import MetadataCache
+from TwiVideoDownloader.concurrency import AdaptiveConcurrency
+from TwiVideoDownloader.retry import RetryPolicy
+from TwiVideoDownloader.selection import VariantPolicy
+from TwiVideoDownloader.mux_stage import MuxStage
+
+
+@dataclass
+class BatchJob:
+    """批量下载任务"""
+    url: str       # 推文URL
+    tweet_id: str  # 推文ID
+
+
+@dataclass
+class JobResult:
+    """单个任务的下载结果"""
+    url: str
+    tweet_id: str
+    status: str                   # ok 或 error
+    output: Optional[str] = None  # 输出文件路径
+    bytes: int = 0                # 下载的媒体字节数
+    elapsed: float = 0.0          # 耗时(秒)
+    error: Optional[str] = None   # 错误信息
+    resolution: Optional[str] = None      # 选定视频流的分辨率
+    estimated_bytes: Optional[int] = None  # 选定视频流的预计大小(字节)
+    manifest: Optional[str] = None         # 清单文件路径，包含各流和逐片段的摘要
+
+
+def read_urls(lines: Iterable[str]) -> List[str]:
+    """读取URL列表，忽略空行和#开头的注释"""
+    urls = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.append(line)
+    return urls
+
+
+def build_jobs(urls: Iterable[str]) -> List[BatchJob]:
+    """按推文ID去重并生成任务列表，保持原有顺序"""
+    jobs = []
+    seen = set()
+    for url in urls:
+        tweet_id = VideoSourceFetcher.extract_tweet_id(url)
+        if tweet_id in seen:
+            continue
+        seen.add(tweet_id)
+        jobs.append(BatchJob(url=url, tweet_id=tweet_id))
+    return jobs
+
+
+class BatchScheduler:
+    """批量下载调度器
+
+    所有任务共享同一个获取器和全局片段并发名额；每个任务的并发数单独受限，
+    长视频不会占满全部名额而拖慢短视频。
+    max_jobs只限制同时下载的任务数：文件合并模式下任务下载完成后交给共享的合并进程池，
+    下载名额立即让给下一个任务，合并与下载流水线并行，两者的并发分别由max_jobs和mux_workers控制。
+    """
+    def __init__(self, base_url: str, output_dir: str = "downloads", max_jobs: int = 4,
+                 global_segment_limit: int = 32, per_job_segment_limit: int = 8,
+                 summary_path: Optional[str] = None, engine: str = "thread",
+                 job_callback=None, cache: Optional[SegmentCache] = None,
+                 metadata_cache: Optional[MetadataCache] = None, mux_mode: str = "file",
+                 muxer: str = "auto", adaptive_max: Optional[int] = None,
+                 retry_policy: Optional[RetryPolicy] = None, range_parts: int = 4,
+                 hedge: bool = True, api_base: Optional[str] = None,
+                 job_rate_limit: Optional[float] = None,
+                 variant_policy: Optional[VariantPolicy] = None,
+                 start: Optional[float] = None, end: Optional[float] = None,
+                 exact_trim: bool = False, mux_workers: Optional[int] = 0, follow: bool = False,
+                 verify: bool = True):
+        self.base_url = base_url
+        self.output_dir = output_dir
+        self.max_jobs = max_jobs
+        self.global_segment_limit = global_segment_limit
+        self.per_job_segment_limit = per_job_segment_limit
+        self.summary_path = Path(summary_path) if summary_path else None
+        self.engine = engine
+        self.job_callback = job_callback  # 每个任务结束时回调，参数为JobResult
+        self.cache = cache
+        self.metadata_cache = metadata_cache
+        self.mux_mode = mux_mode
+        self.muxer = muxer
+        # 设置后每个任务使用自适应并发，per_job_segment_limit为初始值，adaptive_max为上限
+        self.adaptive_max = adaptive_max
+        self.retry_policy = retry_policy
+        self.range_parts = range_parts
+        self.hedge = hedge
+        self.api_base = api_base  # 配置接口地址，默认为api.twitter.com
+        self.job_rate_limit = job_rate_limit  # 单个任务的带宽上限(字节/秒)，总限速由进程共享的限速器控制
+        self.variant_policy = variant_policy  # 视频流选择策略，默认选码率最高的流
+        # 每个任务只下载start到end秒之间的片段，exact_trim为True时合并时精确裁剪
+        self.start = start
+        self.end = end
+        self.exact_trim = exact_trim
+        self.follow = follow  # 跟随直播直到结束，任务在此期间一直占用下载名额
+        self.verify = verify  # 边下载边校验片段结构，并为每个任务写入清单
+        self.mux_workers = mux_workers  # 合并进程数，0表示CPU核数，None表示在任务内用线程合并
+        self._summary_lock = threading.Lock()
+        # 所有任务共用的连接池，大小与全局并发上限一致
+        self.transport = HttpTransport(pool_size=global_segment_limit + max_jobs * 2)
+
+    async def run(self, urls: Iterable[str]) -> List[JobResult]:
+        """执行批量下载并返回每个任务的结果"""
+        jobs = build_jobs(urls)
+        segment_limiter = threading.BoundedSemaphore(self.global_segment_limit)
+        job_slots = asyncio.Semaphore(self.max_jobs)
+
+        async_engine = None
+        if self.engine == "async":
+            # 连接池上限即全局并发上限，每个任务的协程数即单任务上限
+            async_engine = AsyncDownloadEngine(
+                self.base_url,
+                max_connections=self.global_segment_limit,
+                max_concurrency=self.per_job_segment_limit,
+                cache=self.cache,
+                retry_policy=self.retry_policy,
+                range_parts=self.range_parts,
+                hedge=self.hedge
+            )
+        fetcher = VideoSourceFetcher(
+            engine=async_engine,
+            transport=self.transport,
+            metadata_cache=self.metadata_cache,
+            retry_policy=self.retry_policy,
+            api_base=self.api_base
+        )
+
+        mux_stage = MuxStage(self.mux_workers) if self.mux_workers is not None and self.mux_mode == "file" else None
+
+        async def run_job(job: BatchJob) -> JobResult:
+            result = await self._run_job(job, fetcher, segment_limiter, async_engine, job_slots, mux_stage)
+            self._write_summary(result)
+            if self.job_callback:
+                self.job_callback(result)
+            return result
+
+        try:
+            return await asyncio.gather(*(run_job(job) for job in jobs))
+        finally:
+            if async_engine:
+                await async_engine.close()
+            if mux_stage:
+                mux_stage.close()
+
+    async def _run_job(self, job: BatchJob, fetcher: VideoSourceFetcher,
+                       segment_limiter, async_engine, job_slots: asyncio.Semaphore,
+                       mux_stage: Optional[MuxStage]) -> JobResult:
+        # 只有获取信息和下载占用任务名额，合并时名额已让给下一个任务
+        async with job_slots:
+            start_time = time.time()
+            downloader = MediaDownloader(
+                self.base_url,
+                self.output_dir,
+                self.per_job_segment_limit,
+                engine=self.engine,
+                async_engine=async_engine,
+                job_id=job.tweet_id,
+                segment_limiter=segment_limiter,
+                transport=self.transport,
+                cache=self.cache,
+                metadata_cache=self.metadata_cache,
+                mux_mode=self.mux_mode,
+                muxer=self.muxer,
+                concurrency=AdaptiveConcurrency(
+                    initial=self.per_job_segment_limit, maximum=self.adaptive_max
+                ) if self.adaptive_max else None,
+                retry_policy=self.retry_policy,
+                range_parts=self.range_parts,
+                hedge=self.hedge,
+                rate_limit=self.job_rate_limit,
+                variant_policy=self.variant_policy,
+                mux_stage=mux_stage,
+                verify=self.verify
+            )
+            try:
+                m3u8_content = await fetcher.fetch_m3u8_content(job.url)
+                media = await downloader.download_media(m3u8_content, self.start, self.end, self.exact_trim,
+                                                     self.follow)
+            except Exception as e:
+                return self._job_result(job, downloader, start_time, error=e)
+        try:
+            output_file = await downloader.mux(media)
+        except Exception as e:
+            return self._job_result(job, downloader, start_time, error=e)
+        return self._job_result(job, downloader, start_time, output=output_file)
+
+    @staticmethod
+    def _job_result(job: BatchJob, downloader: MediaDownloader, start_time: float,
+                    output: Optional[str] = None, error: Optional[Exception] = None) -> JobResult:
+        choice = downloader.variant_choice
+        return JobResult(
+            url=job.url,
+            tweet_id=job.tweet_id,
+            status="ok" if error is None else "error",
+            output=output,
+            bytes=downloader.downloaded_bytes,
+            elapsed=round(time.time() - start_time, 3),
+            error=str(error) if error is not None else None,
+            resolution=choice.stream.resolution if choice else None,
+            estimated_bytes=choice.estimated_bytes if choice else None,
+            manifest=downloader.manifest
+        )
+
+    def _write_summary(self, result: JobResult):
+        """以JSONL格式追加写入任务结果"""
+        if not self.summary_path:
+            return
+        with self._summary_lock:
+            with open(self.summary_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(asdict(result), ensure_ascii=False) + '\n')
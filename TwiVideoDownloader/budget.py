@@ -0,0 +1,106 @@
+import threading
+from typing import Callable, List, Optional
+
+DEFAULT_MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_PENDING_SEGMENTS = 64
+
+
+class TransferBudget:
+    """下载资源预算
+
+    限制进程内所有下载器缓存在内存中的字节数以及已提交但未完成的片段数，
+    超出预算时阻塞调用方，从而对下载线程形成背压。
+    不能阻塞的调用方(协程)用非阻塞模式申请，并通过add_listener在预算释放时得到通知。
+    """
+    def __init__(self, max_buffered_bytes: int = DEFAULT_MAX_BUFFERED_BYTES,
+                 max_pending_segments: int = DEFAULT_MAX_PENDING_SEGMENTS):
+        self.max_buffered_bytes = max_buffered_bytes
+        self.max_pending_segments = max_pending_segments
+        self.buffered_bytes = 0
+        self.pending_segments = 0
+        self._cond = threading.Condition()
+        self._listeners: List[Callable[[], None]] = []
+
+    def add_listener(self, listener: Callable[[], None]):
+        """预算释放或需要重新检查条件时调用listener，listener应尽快返回"""
+        with self._cond:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]):
+        with self._cond:
+            self._listeners.remove(listener)
+
+    def _notify(self):
+        self._cond.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def acquire_bytes(self, size: int, bypass: Optional[Callable[[], bool]] = None,
+                      blocking: bool = True) -> bool:
+        """申请缓存size字节
+
+        bypass返回True或非阻塞模式下预算不足时返回False，调用方无需再释放。
+        预算为空时总是允许申请，避免单个大块永远等不到预算。
+        """
+        with self._cond:
+            while (self.buffered_bytes > 0
+                   and self.buffered_bytes + size > self.max_buffered_bytes):
+                if not blocking or (bypass and bypass()):
+                    return False
+                self._cond.wait(timeout=0.1)
+            self.buffered_bytes += size
+            return True
+
+    def charge_bytes(self, size: int):
+        """记入已经在内存中的size字节，不等待预算，之后同样用release_bytes释放"""
+        with self._cond:
+            self.buffered_bytes += size
+
+    def release_bytes(self, size: int):
+        """释放缓存的字节"""
+        if size <= 0:
+            return
+        with self._cond:
+            self.buffered_bytes = max(0, self.buffered_bytes - size)
+            self._notify()
+
+    def acquire_slot(self, blocking: bool = True) -> bool:
+        """申请一个片段提交名额"""
+        with self._cond:
+            while self.pending_segments >= self.max_pending_segments:
+                if not blocking:
+                    return False
+                self._cond.wait(timeout=0.1)
+            self.pending_segments += 1
+            return True
+
+    def release_slot(self):
+        """归还片段提交名额"""
+        with self._cond:
+            self.pending_segments = max(0, self.pending_segments - 1)
+            self._notify()
+
+    def wake(self):
+        """唤醒等待中的线程重新检查条件"""
+        with self._cond:
+            self._notify()
+
+
+_global_budget = TransferBudget()
+
+
+def get_global_budget() -> TransferBudget:
+    """获取进程共享的下载预算"""
+    return _global_budget
+
+
+def configure_global_budget(max_buffered_bytes: Optional[int] = None,
+                            max_pending_segments: Optional[int] = None) -> TransferBudget:
+    """调整进程共享的下载预算"""
+    with _global_budget._cond:
+        if max_buffered_bytes is not None:
+            _global_budget.max_buffered_bytes = max_buffered_bytes
+        if max_pending_segments is not None:
+            _global_budget.max_pending_segments = max_pending_segments
+        _global_budget._notify()
+    return _global_budget
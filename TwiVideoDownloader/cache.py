@@ -0,0 +1,176 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# 缓存只管理自己创建的文件：条目名为sha256十六进制，临时文件为 .{条目名}.{uuid}.tmp
+_KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+_TMP_PATTERN = re.compile(r'\.[0-9a-f]{64}\.[0-9a-f]{32}\.tmp')
+
+
+class CacheWriter:
+    """缓存写入端，先写临时文件，提交时再改名为正式条目"""
+    def __init__(self, cache: 'SegmentCache', key: str):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        self._tmp_path = cache.cache_dir / f".{key}.{uuid.uuid4().hex}.tmp"
+        self._file = open(self._tmp_path, 'wb')
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """写入完成，加入缓存；缓存失败不影响下载"""
+        try:
+            self._file.close()
+            self.cache._commit(self.key, self._tmp_path, self.size)
+        except OSError:
+            self.discard()
+
+    def discard(self):
+        """放弃写入"""
+        if not self._file.closed:
+            self._file.close()
+        try:
+            self._tmp_path.unlink()
+        except OSError:
+            pass
+
+
+class SegmentCache:
+    """片段缓存
+
+    以片段URI的sha256作为文件名保存在本地目录中，总大小超过上限时按最近最少使用淘汰。
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """按最近访问时间恢复已有条目
+
+        缓存目录可能是用户已有的目录，名称不符合条目或临时文件格式的文件一律不动，也不会被淘汰。
+        """
+        files = []
+        for path in self.cache_dir.iterdir():
+            if _TMP_PATTERN.fullmatch(path.name):
+                try:
+                    path.unlink()  # 上次中断遗留的临时文件
+                except OSError:
+                    pass
+                continue
+            if _KEY_PATTERN.fullmatch(path.name) and path.is_file():
+                stat = path.stat()
+                files.append((max(stat.st_atime, stat.st_mtime), path.name, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.total_bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def key_for(uri: str) -> str:
+        return hashlib.sha256(uri.encode('utf-8')).hexdigest()
+
+    def open(self, uri: str) -> Optional[BinaryIO]:
+        """打开缓存的片段，未命中时返回None"""
+        key = self.key_for(uri)
+        with self._lock:
+            if key in self._entries:
+                try:
+                    f = open(self.cache_dir / key, 'rb')
+                except OSError:
+                    self.total_bytes -= self._entries.pop(key)
+                else:
+                    self._entries.move_to_end(key)
+                    try:
+                        os.utime(self.cache_dir / key)  # 记录访问时间，重启后仍按LRU顺序恢复
+                    except OSError:
+                        pass
+                    self.hits += 1
+                    self.bytes_served += self._entries[key]
+                    return f
+            self.misses += 1
+            return None
+
+    def read_into(self, uri: str, write, chunk_size: int = 64 * 1024, write_file=None) -> Optional[int]:
+        """把缓存的片段按块交给write，返回字节数；未命中或读取失败时返回None
+
+        提供write_file(文件, 大小)时先尝试整体交给它(例如在内核中复制)，它返回False时再按块读取。
+        """
+        cached_file = self.open(uri)
+        if cached_file is None:
+            return None
+        size = 0
+        try:
+            with cached_file:
+                if write_file is not None:
+                    file_size = os.fstat(cached_file.fileno()).st_size
+                    if write_file(cached_file, file_size):
+                        return file_size
+                for chunk in iter(lambda: cached_file.read(chunk_size), b''):
+                    write(chunk)
+                    size += len(chunk)
+        except OSError:
+            return None
+        return size
+
+    def writer(self, uri: str) -> CacheWriter:
+        """获取片段的缓存写入端"""
+        return CacheWriter(self, self.key_for(uri))
+
+    def _commit(self, key: str, tmp_path: Path, size: int):
+        if size > self.max_bytes:
+            tmp_path.unlink()
+            return
+        with self._lock:
+            os.replace(tmp_path, self.cache_dir / key)
+            if key in self._entries:
+                self.total_bytes -= self._entries[key]
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """淘汰最久未使用的条目直到总大小不超过上限"""
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            try:
+                (self.cache_dir / key).unlink()
+            except OSError:
+                pass
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'bytes_served': self.bytes_served,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,156 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+THROTTLE_STATUSES = (429, 503)
+
+
+class AdaptiveConcurrency:
+    """自适应片段并发控制器
+
+    按加性增、乘性减(AIMD)调整允许同时下载的片段数。每完成一轮(约limit个)请求评估一次：
+    出现429/503、错误率过高或请求耗时明显高于基线时把上限乘以decrease_factor，
+    否则加一；加大并发后吞吐量没有明显提升时暂停增长若干轮再试探。
+    同一任务的视频和音频下载器共用一个控制器，用法与信号量相同。
+    """
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32,
+                 decrease_factor: float = 0.5, max_error_rate: float = 0.1,
+                 latency_tolerance: float = 2.0, on_change: Optional[Callable[[dict], None]] = None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.decrease_factor = decrease_factor
+        self.max_error_rate = max_error_rate
+        self.latency_tolerance = latency_tolerance
+        self.on_change = on_change  # 上限变化时回调，参数为snapshot()
+        self.in_flight = 0
+        self.throughput = 0.0        # 最近一轮的总吞吐量(字节/秒)
+        self.latency = 0.0           # 最近一轮的平均请求耗时(秒)
+        self.baseline_latency = 0.0  # 观察到的最低平均耗时
+        self._cond = threading.Condition()
+        self._listeners: List[Callable[[], None]] = []
+        self._reset_window()
+        self._previous_throughput = 0.0
+        self._hold_rounds = 0
+        self._last_decrease = 0.0
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_requests = 0
+        self._window_errors = 0
+        self._window_latency = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """申请一个并发名额，接口与threading.Semaphore一致"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= self.limit:
+                if not blocking:
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        """归还并发名额"""
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._notify()
+
+    def add_listener(self, listener: Callable[[], None]):
+        """名额归还或上限变化时调用listener，供不能阻塞的调用方等待，listener应尽快返回"""
+        with self._cond:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]):
+        with self._cond:
+            self._listeners.remove(listener)
+
+    def _notify(self):
+        self._cond.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def record_success(self, size: int, elapsed: float):
+        """记录一次成功的请求"""
+        with self._cond:
+            self._window_requests += 1
+            self._window_bytes += size
+            self._window_latency += elapsed
+            self._maybe_adjust()
+
+    def record_failure(self, status: Optional[int] = None):
+        """记录一次失败的请求，status为HTTP状态码(如有)"""
+        with self._cond:
+            self._window_requests += 1
+            self._window_errors += 1
+            # 限流时不等本轮结束立即减小并发
+            if status in THROTTLE_STATUSES and not self._cooling_down():
+                self._adjust(self._decreased())
+                return
+            self._maybe_adjust()
+
+    def _cooling_down(self) -> bool:
+        """刚减小过并发时，减小前发出的请求仍可能失败，这段时间内不再重复减小"""
+        return time.monotonic() - self._last_decrease < max(self.latency * 2, 0.1)
+
+    def _decreased(self) -> int:
+        return max(self.minimum, int(self.limit * self.decrease_factor))
+
+    def _maybe_adjust(self):
+        if self._window_requests < self.limit:
+            return
+        elapsed = time.monotonic() - self._window_start
+        successes = self._window_requests - self._window_errors
+        self.throughput = self._window_bytes / elapsed if elapsed > 0 else 0.0
+        self.latency = self._window_latency / successes if successes else 0.0
+        if self.latency and (not self.baseline_latency or self.latency < self.baseline_latency):
+            self.baseline_latency = self.latency
+
+        congested = (self._window_errors / self._window_requests > self.max_error_rate
+                     or (self.baseline_latency
+                         and self.latency > self.baseline_latency * self.latency_tolerance))
+        if congested:
+            new_limit = self.limit if self._cooling_down() else self._decreased()
+        elif self._hold_rounds > 0:
+            # 保持结束后再试探一次加大并发
+            self._hold_rounds -= 1
+            new_limit = self.limit if self._hold_rounds else min(self.maximum, self.limit + 1)
+        elif self._previous_throughput and self.throughput < self._previous_throughput * 1.05:
+            # 上一次加大并发没有带来吞吐提升，先保持几轮
+            self._hold_rounds = 3
+            new_limit = self.limit
+        else:
+            new_limit = min(self.maximum, self.limit + 1)
+        self._previous_throughput = self.throughput
+        self._adjust(new_limit)
+
+    def _adjust(self, new_limit: int):
+        changed = new_limit != self.limit
+        if new_limit < self.limit:
+            self._last_decrease = time.monotonic()
+            self._previous_throughput = 0.0
+            self._hold_rounds = 0
+        self.limit = new_limit
+        self._reset_window()
+        if changed:
+            self._notify()
+            if self.on_change:
+                self.on_change(self._snapshot())
+
+    def _snapshot(self) -> dict:
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'throughput': round(self.throughput, 1),
+            'latency': round(self.latency, 3),
+        }
+
+    def snapshot(self) -> dict:
+        """当前并发决策"""
+        with self._cond:
+            return self._snapshot()
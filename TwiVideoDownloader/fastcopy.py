@@ -0,0 +1,71 @@
+import errno
+import os
+from typing import BinaryIO
+
+BUFFER_SIZE = 1024 * 1024
+
+# 表示当前系统或文件系统不支持该调用，改用下一种方式
+_UNSUPPORTED = {
+    errno.ENOSYS, errno.EINVAL, errno.EXDEV, errno.EOPNOTSUPP, errno.EBADF,
+    getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP), getattr(errno, 'ENOTSOCK', errno.EINVAL),
+}
+
+_use_copy_file_range = hasattr(os, 'copy_file_range')
+_use_sendfile = hasattr(os, 'sendfile')
+
+
+def copy_range(src: BinaryIO, dst: BinaryIO, offset: int, count: int, kernel: bool = True) -> int:
+    """把src中从offset开始的count字节写到dst的当前位置，dst的位置随之后移，返回复制的字节数
+
+    依次尝试copy_file_range(数据不经过用户态，支持的文件系统上直接共享数据块)和sendfile，
+    都不可用时用缓冲区复制。返回值小于count说明src提前结束。kernel为False时只用缓冲区复制。
+    """
+    if count <= 0:
+        return 0
+    dst.flush()
+    position = dst.tell()
+    copied = _kernel_copy(src.fileno(), dst.fileno(), offset, position, count) if kernel else 0
+    dst.seek(position + copied)
+    if copied < count:
+        src.seek(offset + copied)
+        while copied < count:
+            chunk = src.read(min(BUFFER_SIZE, count - copied))
+            if not chunk:
+                break
+            dst.write(chunk)
+            copied += len(chunk)
+    return copied
+
+
+def _kernel_copy(src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, count: int) -> int:
+    """在内核中复制，返回已复制的字节数；不支持时返回已完成的部分，由调用方继续"""
+    global _use_copy_file_range, _use_sendfile
+    copied = 0
+    if _use_copy_file_range:
+        try:
+            while copied < count:
+                n = os.copy_file_range(src_fd, dst_fd, count - copied,
+                                       src_offset + copied, dst_offset + copied)
+                if n == 0:
+                    return copied
+                copied += n
+            return copied
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            if e.errno != errno.EXDEV:  # 跨文件系统只影响这一对文件
+                _use_copy_file_range = False
+    if _use_sendfile:
+        try:
+            # sendfile写到dst的当前位置
+            os.lseek(dst_fd, dst_offset + copied, os.SEEK_SET)
+            while copied < count:
+                n = os.sendfile(dst_fd, src_fd, src_offset + copied, count - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            _use_sendfile = False
+    return copied
@@ -1,38 +1,78 @@
 import re
 import json
+import asyncio
 import requests
+from TwiVideoDownloader.transport import HttpTransport
+from TwiVideoDownloader.metadata_cache import MetadataCache
+from TwiVideoDownloader.retry import RetryPolicy, call_with_retry
+from TwiVideoDownloader.metrics import DownloadMetrics, get_global_metrics
 
 class VideoSourceFetcher:
     """Twitter视频源获取器"""
     BEARER_TOKEN = "AAAAAAAAAAAAAAAAAAAAANRILgAAAAAAnNwIzUejRCOuH5E6I8xnZz4puTs%3D1Zv7ttfk8LF81IUq16cHjhLTvJu4FA33AGWWjCpTnA"
 
-    def __init__(self):
-        self.session = None
+    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'
+
+    API_BASE = 'https://api.twitter.com'
+
+    def __init__(self, engine=None, transport: HttpTransport = None,
+                 metadata_cache: MetadataCache = None, retry_policy: RetryPolicy = None,
+                 api_base: str = None, metrics: DownloadMetrics = None):
+        self.transport = transport
+        self.engine = engine  # 可选的AsyncDownloadEngine，提供时所有请求都在事件循环中完成
+        self.metadata_cache = metadata_cache  # 可选的配置和播放列表缓存
+        self.retry_policy = retry_policy  # 阻塞请求的重试策略，异步请求由engine自己的策略重试
+        self.api_base = (api_base or self.API_BASE).rstrip('/')  # 配置接口地址，基准测试时指向本地模拟服务器
+        self.metrics = metrics or get_global_metrics()
+
+    def _headers(self) -> dict:
+        return {
+            'User-Agent': self.USER_AGENT,
+            'Authorization': f'Bearer {self.BEARER_TOKEN}'
+        }
 
     def _init_session(self):
-        """延迟初始化session"""
-        if not self.session:
-            self.session = requests.Session()
-            self.session.headers.update({
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-                'Authorization': f'Bearer {self.BEARER_TOKEN}'
-            })
+        """延迟初始化连接层"""
+        if not self.transport:
+            self.transport = HttpTransport(pool_size=2)
+
+    @staticmethod
+    def extract_tweet_id(post_url: str) -> str:
+        """从推文URL中提取推文ID"""
+        match = re.search(r'/status(?:es)?/(\d+)', post_url)
+        if match:
+            return match.group(1)
+        return post_url.strip().rstrip('/').split('/')[-1].split('?')[0]
 
     async def fetch_m3u8_content(self, post_url):
         """获取Twitter视频的m3u8内容"""
-        self._init_session()  # 使用时才初始化
         try:
-            tweet_id = post_url.split('/')[-1]
-            api_url = f'https://api.twitter.com/1.1/videos/tweet/config/{tweet_id}.json'
+            tweet_id = self.extract_tweet_id(post_url)
+            api_url = f'{self.api_base}/1.1/videos/tweet/config/{tweet_id}.json'
             
-            response = self.session.get(api_url)
-            response.raise_for_status()
-            video_config = response.json()
+            master_key = f"master:{tweet_id}"
+            if self.metadata_cache:
+                cached = self.metadata_cache.get(master_key)
+                if cached is not None:
+                    return cached
+            
+            if self.engine:
+                video_config = self._cached_config(tweet_id)
+                if video_config is None:
+                    with self.metrics.phase("config"):
+                        video_config = await self.engine.fetch_json(api_url, headers=self._headers())
+                    self._store_config(tweet_id, video_config)
+                m3u8_url = video_config['track']['playbackUrl']
+                with self.metrics.phase("playlist"):
+                    m3u8_content = await self.engine.fetch_text(m3u8_url, headers=self._headers())
+            else:
+                # 阻塞请求放到线程中执行，避免卡住事件循环中的其他任务
+                loop = asyncio.get_running_loop()
+                m3u8_content = await loop.run_in_executor(None, self._fetch_blocking, tweet_id, api_url)
             
-            m3u8_url = video_config['track']['playbackUrl']
-            m3u8_response = self.session.get(m3u8_url)
-            m3u8_response.raise_for_status()
-            return m3u8_response.text
+            if self.metadata_cache:
+                self.metadata_cache.set(master_key, m3u8_content)
+            return m3u8_content
 
         except requests.RequestException as e:
             raise Exception(f"获取m3u8内容失败: {str(e)}")
@@ -40,3 +80,33 @@ class VideoSourceFetcher:
             raise Exception(f"解析视频信息失败: {str(e)}")
         except Exception as e:
             raise Exception(f"处理过程中出错: {str(e)}")
+
+    def _cached_config(self, tweet_id: str):
+        return self.metadata_cache.get(f"config:{tweet_id}") if self.metadata_cache else None
+
+    def _store_config(self, tweet_id: str, video_config: dict):
+        if self.metadata_cache:
+            self.metadata_cache.set(f"config:{tweet_id}", video_config)
+
+    def _fetch_blocking(self, tweet_id: str, api_url: str) -> str:
+        """使用requests获取配置和主播放列表"""
+        self._init_session()  # 使用时才初始化
+        video_config = self._cached_config(tweet_id)
+        if video_config is None:
+            # 认证头只随API请求发送，不写入共享Session
+            with self.metrics.phase("config"):
+                video_config = self._get_with_retry(api_url).json()
+            self._store_config(tweet_id, video_config)
+        
+        m3u8_url = video_config['track']['playbackUrl']
+        with self.metrics.phase("playlist"):
+            return self._get_with_retry(m3u8_url).text
+
+    def _get_with_retry(self, url: str) -> requests.Response:
+        def attempt_get(attempt: int) -> requests.Response:
+            response = self.transport.get(url, headers=self._headers(), timeout=30)
+            response.raise_for_status()
+            return response
+        
+        return call_with_retry(attempt_get, url, self.retry_policy,
+                               exceptions=(requests.RequestException,))
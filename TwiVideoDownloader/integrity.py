@@ -0,0 +1,136 @@
+import json
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# 按分片MP4检查结构的文件扩展名，其他格式(如MPEG-TS)只检查长度
+_FMP4_SUFFIXES = ('.mp4', '.m4s', '.m4a', '.m4v', '.cmfv', '.cmfa')
+
+
+class IntegrityError(IOError):
+    """片段数据不完整或结构错误，需要重新下载该片段"""
+
+
+class BoxChecker:
+    """边下载边检查分片MP4的顶层box结构
+
+    逐块输入数据，不缓存box内容：检查每个box头的大小和类型是否合理，
+    数据是否恰好在box边界结束，以及是否包含moov(初始化片段)或moof和mdat(媒体片段)。
+    """
+    def __init__(self):
+        self._header = bytearray()  # 尚未凑满的box头
+        self._remaining = 0         # 当前box还剩的字节数
+        self._to_end = False        # 大小为0的box一直延伸到数据末尾
+        self.types: List[bytes] = []
+
+    def feed(self, chunk: bytes):
+        """输入一块数据，发现结构错误时抛出IntegrityError"""
+        view = memoryview(chunk)
+        pos, size = 0, len(view)
+        while pos < size and not self._to_end:
+            if self._remaining:
+                step = min(self._remaining, size - pos)
+                self._remaining -= step
+                pos += step
+                continue
+            need = 16 if len(self._header) >= 8 else 8  # size为1时后面是64位的大小
+            take = min(need - len(self._header), size - pos)
+            self._header += view[pos:pos + take]
+            pos += take
+            if len(self._header) < 8:
+                continue
+            box_size, box_type = struct.unpack_from('>I4s', self._header)
+            header_size = 8
+            if box_size == 1:
+                if len(self._header) < 16:
+                    continue
+                box_size = struct.unpack_from('>Q', self._header, 8)[0]
+                header_size = 16
+            if not all(0x20 <= byte <= 0x7e for byte in box_type):
+                raise IntegrityError(f"第 {len(self.types) + 1} 个box的类型无效: {bytes(box_type)!r}")
+            if box_size == 0:
+                self._to_end = True
+            elif box_size < header_size:
+                raise IntegrityError(f"{box_type.decode('ascii')} box的大小无效: {box_size}")
+            else:
+                self._remaining = box_size - header_size
+            self.types.append(bytes(box_type))
+            self._header.clear()
+
+    def finish(self):
+        """数据结束时调用，数据在box中间截断或缺少必要的box时抛出IntegrityError"""
+        if self._header or self._remaining:
+            missing = self._remaining or 8 - len(self._header)
+            raise IntegrityError(f"数据在box中间结束，至少缺少 {missing} 字节")
+        types = set(self.types)
+        if b'moov' not in types and not {b'moof', b'mdat'} <= types:
+            found = ', '.join(t.decode('ascii') for t in self.types) or '无'
+            raise IntegrityError(f"缺少moov或moof/mdat，顶层box: {found}")
+
+
+def checker_for(url: str) -> Optional[BoxChecker]:
+    """按URL的扩展名返回结构检查器，不是分片MP4时返回None"""
+    return BoxChecker() if urlsplit(url).path.lower().endswith(_FMP4_SUFFIXES) else None
+
+
+class StreamDigest:
+    """一个流的逐片段摘要，由组装器在每个片段落盘时回调record，摘要在下载时计算，不需要重新读取文件"""
+    def __init__(self, playlist_uri: str = ""):
+        self.playlist_uri = playlist_uri
+        self.segments: Dict[int, Tuple[int, str]] = {}  # 序号(含初始化片段) -> (字节数, sha256)
+        self.uris: List[str] = []  # 按序号排列的片段URL，下载结束时填入
+        self.bytes = 0
+
+    def record(self, index: int, length: int, checksum: str):
+        self.segments[index] = (length, checksum)
+
+    def to_dict(self) -> dict:
+        return {
+            'playlist': self.playlist_uri,
+            'bytes': self.bytes,
+            'segments': [
+                {'uri': uri, 'bytes': self.segments[index][0], 'sha256': self.segments[index][1]}
+                if index in self.segments else {'uri': uri}
+                for index, uri in enumerate(self.uris)
+            ],
+        }
+
+
+def segment_recorder(*recorders):
+    """把多个带record(序号, 长度, 摘要)方法的对象(片段日志、StreamDigest)合并为组装器的on_segment回调
+
+    都为None时返回None，组装器此时不计算片段摘要。
+    """
+    recorders = [recorder for recorder in recorders if recorder is not None]
+    if not recorders:
+        return None
+
+    def on_segment(index: int, length: int, checksum: str):
+        for recorder in recorders:
+            recorder.record(index, length, checksum)
+    return on_segment
+
+
+def manifest_path(output_path: str) -> Path:
+    """输出文件对应的清单文件路径"""
+    return Path(output_path).with_suffix('.manifest.json')
+
+
+def write_manifest(output_path: str, sha256: Optional[str], streams: Dict[str, StreamDigest], **info) -> Path:
+    """在输出文件旁写入任务清单：输出文件的大小和sha256(合并时计算，未知时为null)以及各流的逐片段摘要"""
+    path = manifest_path(output_path)
+    manifest = {
+        'output': Path(output_path).name,
+        'bytes': Path(output_path).stat().st_size,
+        'sha256': sha256,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        **info,
+        'streams': {name: digest.to_dict() for name, digest in streams.items()},
+    }
+    temp_path = path.with_suffix('.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    temp_path.replace(path)
+    return path
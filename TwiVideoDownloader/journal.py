@@ -0,0 +1,97 @@
+import hashlib
+import json
+import threading
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+
+@dataclass
+class JournalEntry:
+    """已完成片段的记录"""
+    index: int     # 片段序号(含初始化片段)
+    length: int    # 字节数
+    checksum: str  # sha256摘要
+
+
+def variant_key(job_id: Optional[str], uris: Iterable[str]) -> str:
+    """由推文ID和变体的全部片段URI生成日志键"""
+    digest = hashlib.sha1('\n'.join(uris).encode('utf-8')).hexdigest()
+    return f"{job_id or ''}:{digest}"
+
+
+class SegmentJournal:
+    """片段下载日志
+
+    以JSONL格式记录已经写入输出文件的片段，中断后重新运行时只下载缺失的片段。
+    第一行记录推文ID和变体，对应不上时整个日志作废。
+    """
+    def __init__(self, path: Path, key: str):
+        self.path = Path(path)
+        self.key = key
+        self.entries: Dict[int, JournalEntry] = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline() or '{}')
+                if header.get('key') != self.key:
+                    return
+                for line in f:
+                    try:
+                        entry = JournalEntry(**json.loads(line))
+                    except (ValueError, TypeError):
+                        break  # 中断时可能留下不完整的最后一行
+                    self.entries[entry.index] = entry
+        except (OSError, ValueError):
+            self.entries.clear()
+
+    def resume_point(self, data_path: Path) -> Tuple[int, int]:
+        """返回可以直接沿用的片段数和字节数，输出文件与日志不符时从头开始"""
+        count = 0
+        offset = 0
+        while count in self.entries:
+            offset += self.entries[count].length
+            count += 1
+
+        size = data_path.stat().st_size if data_path.exists() else -1
+        if count == 0 or size < offset:
+            self.reset()
+            return 0, 0
+        return count, offset
+
+    def reset(self):
+        """清空日志"""
+        with self._lock:
+            self.entries.clear()
+            self._close_file()
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'key': self.key}) + '\n')
+
+    def record(self, index: int, length: int, checksum: str):
+        """记录一个已写入输出文件的片段"""
+        entry = JournalEntry(index=index, length=length, checksum=checksum)
+        with self._lock:
+            if self._file is None:
+                if not self.path.exists():
+                    with open(self.path, 'w', encoding='utf-8') as f:
+                        f.write(json.dumps({'key': self.key}) + '\n')
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self.entries[index] = entry
+            self._file.write(json.dumps(asdict(entry)) + '\n')
+            self._file.flush()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """关闭日志文件"""
+        with self._lock:
+            self._close_file()
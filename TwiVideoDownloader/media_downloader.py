@@ -1,100 +1,549 @@
+import os
 import subprocess
+import threading
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 import asyncio
 import concurrent.futures
 import shutil
 import requests
-from TwiVideoDownloader.video import VideoDownloader
-from TwiVideoDownloader.audio import AudioDownloader
+from TwiVideoDownloader.video import VideoDownloader, VideoM3U8Parser
+from TwiVideoDownloader.audio import AudioDownloader, AudioM3U8Parser
+from TwiVideoDownloader.async_engine import AsyncDownloadEngine
 from TwiVideoDownloader.total import M3U8Parser
+from TwiVideoDownloader.transport import HttpTransport
+from TwiVideoDownloader.journal import SegmentJournal, variant_key
+from TwiVideoDownloader.cache import SegmentCache
+from TwiVideoDownloader.metadata_cache import MetadataCache
+from TwiVideoDownloader.concurrency import AdaptiveConcurrency
+from TwiVideoDownloader.retry import RetryPolicy, call_with_retry
+from TwiVideoDownloader.mux_stage import MuxStage, check_ffmpeg, merge_video_audio, mux_command, start_ffmpeg, wait_ffmpeg
+from TwiVideoDownloader.metrics import DownloadMetrics, get_global_metrics
+from TwiVideoDownloader.progress import ProgressAggregator, ProgressEvent
+from TwiVideoDownloader.ratelimit import job_limiter
+from TwiVideoDownloader.playlist import live_poll_interval, parse_media_playlist, segments_in_range
+from TwiVideoDownloader.selection import VariantChoice, VariantPolicy, estimate_size, select_variant
+from TwiVideoDownloader.integrity import StreamDigest, write_manifest
+
+@dataclass
+class DownloadedMedia:
+    """下载阶段的结果，交给合并阶段"""
+    output_path: str
+    video_file: Optional[str] = None  # 管道模式下已在下载时合并，为None
+    audio_file: Optional[str] = None
+    trim: Optional[Tuple[float, Optional[float]]] = None  # 精确裁剪的(偏移, 时长)
+
+    @property
+    def muxed(self) -> bool:
+        return self.video_file is None
+
 
 class MediaDownloader:
     """媒体下载器，处理视频和音频的下载与合并"""
     def __init__(self, base_url: str, output_dir: str = "downloads", 
-                 max_workers: int = 5, progress_callback=None, speed_callback=None):
+                 max_workers: int = 5, progress_callback=None, speed_callback=None,
+                 engine: str = "thread", async_engine: AsyncDownloadEngine = None,
+                 job_id: str = None, segment_limiter=None, transport: HttpTransport = None,
+                 resume: bool = True, cache: SegmentCache = None,
+                 metadata_cache: MetadataCache = None, mux_mode: str = "file",
+                 muxer: str = "auto", concurrency: AdaptiveConcurrency = None,
+                 retry_policy: RetryPolicy = None, range_parts: int = 4, hedge: bool = True,
+                 metrics: DownloadMetrics = None, progress_listener=None,
+                 progress_interval: float = 0.5, rate_limit: float = None,
+                 variant_policy: VariantPolicy = None, variant_callback=None,
+                 mux_stage: MuxStage = None, verify: bool = True):
+        if engine not in ("thread", "async"):
+            raise ValueError(f"未知的下载引擎: {engine}")
+        if mux_mode not in ("file", "pipe"):
+            raise ValueError(f"未知的合并模式: {mux_mode}")
+        if muxer not in ("auto", "python", "ffmpeg"):
+            raise ValueError(f"未知的合并器: {muxer}")
+        if mux_mode == "pipe" and os.name == 'nt':
+            print("当前系统不支持管道合并，改用文件合并")
+            mux_mode = "file"
         self.base_url = base_url
+        self.max_workers = max_workers
+        self.engine = engine
+        self.async_engine = async_engine
+        self.job_id = job_id
+        self.resume = resume  # 失败时保留临时目录和片段日志，重新运行时续传
+        self.cache = cache
+        self.metadata_cache = metadata_cache  # 可选的变体播放列表缓存
+        self.mux_mode = mux_mode  # file: 下载完成后合并; pipe: 边下载边通过管道交给ffmpeg
+        self.muxer = muxer  # 文件合并使用的合并器，auto: 优先内置合并器，不支持时改用ffmpeg
+        self.concurrency = concurrency  # 可选的自适应并发控制，视频和音频共用
+        self.retry_policy = retry_policy  # 播放列表和片段请求的重试策略，默认使用DEFAULT_POLICY
+        self.range_parts = range_parts  # 大片段拆成的范围请求数，1表示不拆分
+        self.hedge = hedge  # 是否在尾部对冲最慢的片段
+        self.metrics = metrics or get_global_metrics()
+        # 带宽限制，视频和音频共用；rate_limit为本任务的上限(字节/秒)，同时受进程共享的限速约束
+        self.rate_limiter = job_limiter(rate_limit)
+        self.variant_policy = variant_policy  # 视频流选择策略，默认选码率最高的流
+        self.variant_callback = variant_callback  # 选定视频流后、开始下载前以VariantChoice调用
+        self.variant_choice: VariantChoice = None
+        self._variant_pending = False  # 选定的视频流是否还没有带上时长报告
+        self._variant_lock = threading.Lock()
+        self.mux_stage = mux_stage  # 可选的进程池合并阶段，默认在线程中合并
+        # 边下载边校验片段(长度总是核对)，记录片段和各流的摘要，合并后写入输出文件旁的清单
+        self.verify = verify
+        self.digests: Dict[str, StreamDigest] = {}
+        self.manifest: Optional[str] = None  # 清单文件路径
+        self._playlists = {}  # 本任务已下载的变体播放列表，选择视频流时取到的音频播放列表不再重复请求
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
-        self.video_temp_dir = self.output_dir / "video_temp"
-        self.audio_temp_dir = self.output_dir / "audio_temp"
+        # 批量下载时每个任务使用独立的临时目录，避免并发任务互相覆盖
+        temp_suffix = f"_{job_id}" if job_id else ""
+        self.video_temp_dir = self.output_dir / f"video_temp{temp_suffix}"
+        self.audio_temp_dir = self.output_dir / f"audio_temp{temp_suffix}"
+        self.downloaded_bytes = 0
+        # 视频、音频和播放列表请求共用同一个连接池
+        self.transport = transport or HttpTransport.for_concurrency(
+            concurrency.maximum if concurrency else max_workers
+        )
         
         self.video_downloader = VideoDownloader(
             base_url, 
             str(self.video_temp_dir), 
             max_workers,
             progress_callback=lambda current, total: self._handle_progress("视频", current, total),
-            speed_callback=self._handle_speed
+            speed_callback=self._handle_speed,
+            segment_limiter=segment_limiter,
+            transport=self.transport,
+            resume=resume,
+            job_id=job_id,
+            cache=cache,
+            concurrency=concurrency,
+            retry_policy=retry_policy,
+            range_parts=range_parts,
+            hedge=hedge,
+            metrics=self.metrics,
+            bytes_callback=lambda size: self._handle_bytes("视频", size),
+            rate_limiter=self.rate_limiter,
+            verify=verify
         )
         self.audio_downloader = AudioDownloader(
             base_url, 
             str(self.audio_temp_dir), 
             max_workers,
             progress_callback=lambda current, total: self._handle_progress("音频", current, total),
-            speed_callback=self._handle_speed
+            speed_callback=self._handle_speed,
+            segment_limiter=segment_limiter,
+            transport=self.transport,
+            resume=resume,
+            job_id=job_id,
+            cache=cache,
+            concurrency=concurrency,
+            retry_policy=retry_policy,
+            range_parts=range_parts,
+            hedge=hedge,
+            metrics=self.metrics,
+            bytes_callback=lambda size: self._handle_bytes("音频", size),
+            rate_limiter=self.rate_limiter,
+            verify=verify
         )
         self.parser = M3U8Parser()
-        self.session = requests.Session()
         self.progress_callback = progress_callback
         self.speed_callback = speed_callback
+        # progress_listener接收汇总了视频和音频的ProgressEvent，最多每progress_interval秒一次
+        self.progress_listener = progress_listener
+        self.progress = ProgressAggregator(self._emit_progress, progress_interval) if progress_listener else None
 
-    async def download(self, m3u8_content: str) -> str:
-        """下载并合并最高质量的视频和音频流"""
+    async def download(self, m3u8_content: str, start: float = None, end: float = None,
+                       exact_trim: bool = False, follow: bool = False) -> str:
+        """按选择策略下载并合并视频和音频流
+
+        提供start/end(秒)时只下载与该时间段有重叠的片段，输出从片段边界开始；
+        exact_trim为True时合并时用ffmpeg重新编码，精确裁剪到start/end。
+        follow为True时跟随仍在进行的直播或EVENT播放列表，不断下载新片段直到播放列表结束。
+        """
+        return await self.mux(await self.download_media(m3u8_content, start, end, exact_trim, follow))
+
+    async def download_media(self, m3u8_content: str, start: float = None, end: float = None,
+                             exact_trim: bool = False, follow: bool = False) -> DownloadedMedia:
+        """下载阶段：选择视频流并下载视频和音频，文件模式下返回待合并的文件，参数同download
+
+        失败时按resume设置清理临时目录；成功时临时文件保留到mux完成。
+        """
+        if start is not None and start < 0:
+            raise ValueError("开始时间不能为负数")
+        if end is not None and end <= (start or 0):
+            raise ValueError("结束时间必须晚于开始时间")
+        clipped = bool(start) or end is not None
+        if follow and clipped:
+            raise ValueError("跟随直播时不能指定开始或结束时间")
+        succeeded = False
+        if self.progress:
+            self.progress.start()
         try:
             self.video_temp_dir.mkdir(parents=True, exist_ok=True)
             self.audio_temp_dir.mkdir(parents=True, exist_ok=True)
             
             self.parser.parse(m3u8_content)
-            best_stream = self.parser.get_highest_quality_stream()
-            if not best_stream:
+            if not self.parser.stream_items:
                 raise ValueError("没有找到可用的视频流")
             
             audio_streams = self.parser.get_audio_streams()
             if not audio_streams:
                 raise ValueError("没有找到可用的音频流")
             
+            # 各变体时长相同。按大小上限选择时需要先取一个播放列表得到时长；
+            # 否则直接选择，视频和音频播放列表并行获取，先到的那个用于估计大小并报告
+            duration = None
+            if self.variant_policy is not None and self.variant_policy.max_bytes is not None:
+                with self.metrics.phase("playlist"):
+                    duration = await asyncio.get_event_loop().run_in_executor(
+                        None, self._playlist_duration, audio_streams[0].uri
+                    )
+                duration = self._clip_duration(duration, start, end)
+            self.variant_choice = select_variant(self.parser.stream_items, self.variant_policy, duration)
+            best_stream = self.variant_choice.stream
+            self._variant_pending = True
+            if duration is not None:
+                self._report_variant()
+            
             audio_stream = next(
                 (audio for audio in audio_streams if audio.group_id == best_stream.audio),
                 audio_streams[0]
             )
             
-            video_m3u8 = self._download_m3u8(best_stream.uri)
-            audio_m3u8 = self._download_m3u8(audio_stream.uri)
+            if self.job_id:
+                output_filename = f"final_output_{self.job_id}_{best_stream.resolution}.mp4"
+            else:
+                output_filename = f"final_output_{best_stream.resolution}.mp4"
+            if clipped:
+                # 片段区间与完整视频使用不同的文件名
+                clip_end = f"{end:g}" if end is not None else "end"
+                output_filename = output_filename.replace(".mp4", f"_{start or 0:g}-{clip_end}.mp4")
+            output_path = self.output_dir / output_filename
             
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                loop = asyncio.get_event_loop()
-                video_future = loop.run_in_executor(executor, self.video_downloader.download, video_m3u8)
-                audio_future = loop.run_in_executor(executor, self.audio_downloader.download, audio_m3u8)
-                video_file, audio_file = await asyncio.gather(video_future, audio_future)
+            trim = None
+            if exact_trim and clipped:
+                with self.metrics.phase("playlist"):
+                    trim = await asyncio.get_event_loop().run_in_executor(
+                        None, self._trim_window, best_stream.uri, audio_stream.uri, start, end
+                    )
             
-            output_filename = f"final_output_{best_stream.resolution}.mp4"
-            output_path = self.output_dir / output_filename
-            self._merge_video_audio(video_file, audio_file, str(output_path))
+            if self.mux_mode == "pipe":
+                await self._download_and_mux_piped(best_stream.uri, audio_stream.uri, str(output_path),
+                                                   start, end, trim, follow)
+                media = DownloadedMedia(str(output_path))
+            else:
+                video_file, audio_file = await self._download_streams(
+                    best_stream.uri, audio_stream.uri, start=start, end=end, follow=follow
+                )
+                media = DownloadedMedia(str(output_path), video_file, audio_file, trim)
             
-            return str(output_path)
+            succeeded = True
+            return media
             
         finally:
-            self._cleanup_temp_dirs()
+            if self.progress:
+                self.progress.close()
+            if not succeeded and not self.resume:
+                with self.metrics.phase("cleanup"):
+                    self._cleanup_temp_dirs()
 
-    def _download_m3u8(self, uri: str) -> str:
-        """下载m3u8文件内容"""
-        full_url = uri if uri.startswith('http') else f"{self.base_url.rstrip('/')}{uri}"
-        response = self.session.get(full_url, timeout=30)
-        response.raise_for_status()
-        return response.text
-
-    def _merge_video_audio(self, video_path: str, audio_path: str, output_path: str):
-        """使用ffmpeg合并视频和音频"""
-        command = [
-            'ffmpeg',
-            '-i', video_path,
-            '-i', audio_path,
-            '-c:v', 'copy',
-            '-c:a', 'copy',
-            '-y',
-            output_path
+    async def mux(self, media: DownloadedMedia) -> str:
+        """合并阶段：合并download_media下载的文件并清理临时目录，返回输出文件路径"""
+        succeeded = False
+        sha256 = None  # 合并时计算的输出摘要，管道模式或由ffmpeg合并时未知
+        digest = self.verify and bool(self.digests)
+        try:
+            if not media.muxed:
+                with self.metrics.phase("mux"):
+                    if self.mux_stage:
+                        sha256 = await self.mux_stage.merge(
+                            media.video_file, media.audio_file, media.output_path, self.muxer, media.trim, digest
+                        )
+                    else:
+                        sha256 = await asyncio.get_event_loop().run_in_executor(
+                            None, self._merge_video_audio,
+                            media.video_file, media.audio_file, media.output_path, media.trim, digest
+                        )
+            if self.digests:
+                self._write_manifest(media.output_path, sha256)
+            succeeded = True
+            return media.output_path
+        finally:
+            if succeeded or not self.resume:
+                with self.metrics.phase("cleanup"):
+                    self._cleanup_temp_dirs()
+
+    async def _download_streams(self, video_uri: str, audio_uri: str,
+                                video_stream=None, audio_stream=None, start: float = None, end: float = None,
+                                follow: bool = False):
+        """下载视频和音频流，提供输出流时直接写入输出流"""
+        if self.engine == "async":
+            return await self._download_streams_async(video_uri, audio_uri, video_stream, audio_stream,
+                                                      start, end, follow)
+        
+        # 视频和音频各自获取播放列表，到达后立即开始下载片段，不等待另一个流
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            loop = asyncio.get_event_loop()
+            video_future = loop.run_in_executor(
+                executor, self._download_stream, self.video_downloader, video_uri, video_stream, start, end, follow
+            )
+            audio_future = loop.run_in_executor(
+                executor, self._download_stream, self.audio_downloader, audio_uri, audio_stream, start, end, follow
+            )
+            video_file, audio_file = await asyncio.gather(video_future, audio_future)
+        self.downloaded_bytes = self.video_downloader.output_bytes + self.audio_downloader.output_bytes
+        for name, downloader, uri in (("video", self.video_downloader, video_uri),
+                                      ("audio", self.audio_downloader, audio_uri)):
+            if downloader.digest:
+                downloader.digest.playlist_uri = uri
+                self.digests[name] = downloader.digest
+        return video_file, audio_file
+
+    def _download_stream(self, downloader, uri: str, output_stream=None,
+                         start: float = None, end: float = None, follow: bool = False) -> str:
+        """获取一个流的播放列表并下载其片段，跟随直播时每次刷新都重新请求播放列表"""
+        with self.metrics.phase("playlist"):
+            content = self._download_m3u8(uri, live=follow)
+        # 直播的时长还不确定，不估计大小
+        self._report_variant(None if follow else content, start, end)
+        refresh = (lambda: self._download_m3u8(uri, live=True)) if follow else None
+        return downloader.download(content, output_stream, start, end, refresh)
+
+    async def _download_and_mux_piped(self, video_uri: str, audio_uri: str, output_path: str,
+                                      start: float = None, end: float = None, trim=None, follow: bool = False):
+        """边下载边把按序组装好的数据通过管道交给ffmpeg，不落地中间文件"""
+        video_read, video_write = os.pipe()
+        audio_read, audio_write = os.pipe()
+        command = mux_command(f'pipe:{video_read}', f'pipe:{audio_read}', output_path, trim)
+        try:
+            process, stderr_tail, stderr_thread = start_ffmpeg(command, pass_fds=(video_read, audio_read))
+        except OSError:
+            os.close(video_write)
+            os.close(audio_write)
+            raise
+        finally:
+            os.close(video_read)
+            os.close(audio_read)
+        
+        video_stream = os.fdopen(video_write, 'wb')
+        audio_stream = os.fdopen(audio_write, 'wb')
+        loop = asyncio.get_event_loop()
+        try:
+            await self._download_streams(video_uri, audio_uri, video_stream, audio_stream, start, end, follow)
+        except BaseException:
+            # ffmpeg提前退出时下载端只会看到BrokenPipe，优先报告ffmpeg的错误
+            failed_early = process.poll() not in (None, 0)
+            if not failed_early:
+                process.kill()
+            await loop.run_in_executor(None, wait_ffmpeg, process, stderr_thread)
+            if failed_early:
+                raise subprocess.CalledProcessError(process.returncode, command, stderr='\n'.join(stderr_tail))
+            raise
+        finally:
+            for stream in (video_stream, audio_stream):
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+        
+        # 数据已全部写入管道，剩下的是等待ffmpeg写完输出文件
+        with self.metrics.phase("mux"):
+            await loop.run_in_executor(None, wait_ffmpeg, process, stderr_thread)
+        check_ffmpeg(process, stderr_tail, command)
+
+    async def _download_streams_async(self, video_uri: str, audio_uri: str,
+                                      video_stream=None, audio_stream=None,
+                                      start: float = None, end: float = None, follow: bool = False):
+        """使用异步引擎在当前事件循环中下载视频和音频流，每个流的播放列表到达后立即开始下载"""
+        engine = self.async_engine or AsyncDownloadEngine(
+            self.base_url, max_concurrency=self.max_workers, cache=self.cache,
+            retry_policy=self.retry_policy, range_parts=self.range_parts, hedge=self.hedge,
+            metrics=self.metrics
+        )
+        try:
+            (video_file, video_bytes), (audio_file, audio_bytes) = await asyncio.gather(
+                self._download_stream_async(
+                    engine, video_uri, VideoM3U8Parser(),
+                    lambda parser: self.video_temp_dir / f"output_{parser.resolution}.mp4",
+                    "视频", "video", video_stream, start, end, follow
+                ),
+                self._download_stream_async(
+                    engine, audio_uri, AudioM3U8Parser(),
+                    lambda parser: self.audio_temp_dir / "output.mp4",
+                    "音频", "audio", audio_stream, start, end, follow
+                )
+            )
+            self.downloaded_bytes = video_bytes + audio_bytes
+            return str(video_file), str(audio_file)
+        finally:
+            if self.async_engine is None:
+                await engine.close()
+
+    async def _download_stream_async(self, engine: AsyncDownloadEngine, uri: str, parser, output_file_for,
+                                     type_str: str, stream: str, output_stream=None,
+                                     start: float = None, end: float = None, follow: bool = False):
+        """获取一个流的播放列表并下载其片段，返回(输出文件, 字节数)"""
+        with self.metrics.phase("playlist"):
+            content = await self._fetch_m3u8_async(engine, uri, live=follow)
+        self._report_variant(None if follow else content, start, end)
+        parser.parse(content)
+        following = follow and not parser.endlist
+        if start is not None or end is not None:
+            parser.segments = segments_in_range(parser.segments, start, end)
+            if not parser.segments:
+                raise ValueError(f"指定的时间段内没有{type_str}片段")
+        
+        output_file = output_file_for(parser)
+        digest = StreamDigest(uri) if self.verify else None
+        journal = None
+        if self.resume and output_stream is None and not following:
+            journal = self._open_journal(output_file, parser)
+        try:
+            size = await engine.download_segments(
+                [segment.uri for segment in parser.segments], output_file,
+                init_uri=parser.map_uri,
+                progress_callback=lambda current, total: self._handle_progress(type_str, current, total),
+                speed_callback=self._handle_speed,
+                journal=journal,
+                output_stream=output_stream,
+                concurrency=self.concurrency,
+                stream=stream,
+                bytes_callback=lambda size: self._handle_bytes(type_str, size),
+                rate_limiter=self.rate_limiter,
+                refresh=self._live_refresh(engine, uri, parser) if following else None,
+                digest=digest
+            )
+        finally:
+            if journal:
+                journal.close()
+        if digest:
+            self.digests[stream] = digest
+        return output_file, size
+
+    def _live_refresh(self, engine: AsyncDownloadEngine, uri: str, parser):
+        """生成异步引擎跟随直播时使用的刷新函数
+
+        每次调用等待一个刷新间隔(有新片段时为TARGETDURATION，否则为一半)，
+        重新获取播放列表并返回(新片段URL, 是否已结束)。
+        """
+        changed = True
+        
+        async def refresh():
+            nonlocal changed
+            await asyncio.sleep(live_poll_interval(parser.target_duration, changed))
+            new_segments = parser.update(await self._fetch_m3u8_async(engine, uri, live=True))
+            changed = bool(new_segments)
+            return [segment.uri for segment in new_segments], parser.endlist
+        
+        return refresh
+
+    def _open_journal(self, output_file: Path, parser) -> SegmentJournal:
+        """打开某个流的片段日志"""
+        uris = ([parser.map_uri] if parser.map_uri else []) + [
+            segment.uri for segment in parser.segments
         ]
-        subprocess.run(command, check=True, capture_output=True)
+        return SegmentJournal(output_file.with_suffix('.journal'), variant_key(self.job_id, uris))
+
+    async def _fetch_m3u8_async(self, engine: AsyncDownloadEngine, uri: str, live: bool = False) -> str:
+        """通过异步引擎下载m3u8文件内容，优先使用缓存；live为True时总是重新请求且不写入缓存"""
+        full_url = uri if uri.startswith('http') else f"{self.base_url.rstrip('/')}{uri}"
+        if live:
+            return await engine.fetch_text(full_url)
+        if full_url in self._playlists:
+            return self._playlists[full_url]
+        if self.metadata_cache:
+            cached = self.metadata_cache.get(f"playlist:{full_url}")
+            if cached is not None:
+                return cached
+        content = await engine.fetch_text(full_url)
+        if self.metadata_cache:
+            self.metadata_cache.set(f"playlist:{full_url}", content)
+        self._playlists[full_url] = content
+        return content
+
+    @staticmethod
+    def _clip_duration(duration: float, start: float = None, end: float = None) -> float:
+        """按start/end截取后的时长"""
+        if (start or 0) >= duration:
+            raise ValueError(f"开始时间超出视频时长({duration:.1f}秒)")
+        return min(duration, end if end is not None else duration) - (start or 0)
+
+    def _report_variant(self, playlist_content: str = None, start: float = None, end: float = None):
+        """报告选定的视频流，每次下载只报告一次，在该流的片段开始下载之前调用
+
+        选择时还不知道时长的，用最先到达的变体播放列表计算时长和预计大小。
+        """
+        with self._variant_lock:
+            if not self._variant_pending:
+                return
+            self._variant_pending = False
+            choice = self.variant_choice
+            if choice.duration is None and playlist_content is not None:
+                duration = self._clip_duration(parse_media_playlist(playlist_content).total_duration, start, end)
+                choice = self.variant_choice = VariantChoice(
+                    choice.stream, duration, estimate_size(choice.stream, duration), choice.within_policy
+                )
+            if self.variant_callback:
+                self.variant_callback(choice)
+
+    def _playlist_duration(self, uri: str) -> float:
+        """下载变体播放列表并返回总时长(秒)"""
+        return parse_media_playlist(self._download_m3u8(uri)).total_duration
+
+    def _trim_window(self, video_uri: str, audio_uri: str, start: float = None, end: float = None):
+        """计算精确裁剪的(偏移, 时长)秒数
+
+        只下载重叠片段时输出从最早的片段边界开始，ffmpeg会把该时刻作为0点，
+        因此偏移为start与片段边界之差；时长为None表示裁剪到结尾。
+        """
+        boundaries = []
+        for uri in (video_uri, audio_uri):
+            segments = segments_in_range(list(parse_media_playlist(self._download_m3u8(uri))), start, end)
+            if not segments:
+                raise ValueError("指定的时间段内没有片段")
+            boundaries.append(segments[0].start_time)
+        clip_start = min(boundaries) / 1000
+        offset = max(0.0, (start or 0) - clip_start)
+        duration = end - max(start or 0, clip_start) if end is not None else None
+        return offset, duration
+
+    def _download_m3u8(self, uri: str, live: bool = False) -> str:
+        """下载m3u8文件内容，优先使用缓存；live为True时总是重新请求且不写入缓存"""
+        full_url = uri if uri.startswith('http') else f"{self.base_url.rstrip('/')}{uri}"
+        if full_url in self._playlists and not live:
+            return self._playlists[full_url]
+        if self.metadata_cache and not live:
+            cached = self.metadata_cache.get(f"playlist:{full_url}")
+            if cached is not None:
+                return cached
+        
+        def attempt_fetch(attempt: int) -> str:
+            response = self.transport.get(full_url, timeout=30)
+            response.raise_for_status()
+            return response.text
+        
+        content = call_with_retry(attempt_fetch, full_url, self.retry_policy,
+                                  exceptions=(requests.RequestException,))
+        if live:
+            return content
+        if self.metadata_cache:
+            self.metadata_cache.set(f"playlist:{full_url}", content)
+        self._playlists[full_url] = content
+        return content
+
+    def _write_manifest(self, output_path: str, sha256: Optional[str]):
+        """写入任务清单，失败时只给出提示，不影响已完成的输出"""
+        choice = self.variant_choice
+        try:
+            self.manifest = str(write_manifest(
+                output_path, sha256, self.digests, job_id=self.job_id,
+                resolution=choice.stream.resolution if choice else None
+            ))
+        except OSError as e:
+            print(f"写入清单失败: {str(e)}")
+
+    def _merge_video_audio(self, video_path: str, audio_path: str, output_path: str, trim=None,
+                           digest: bool = False) -> Optional[str]:
+        """在当前进程中合并视频和音频，返回值同merge_video_audio"""
+        return merge_video_audio(video_path, audio_path, output_path, self.muxer, trim, digest)
 
     def _cleanup_temp_dirs(self):
         """清理临时目录"""
@@ -108,10 +557,23 @@ class MediaDownloader:
 
     def _handle_progress(self, type_str: str, current: int, total: int):
         """处理进度回调"""
+        if self.progress:
+            self.progress.update_segments(type_str, current, total)
         if self.progress_callback:
             self.progress_callback(type_str, current, total)
 
+    def _handle_bytes(self, type_str: str, size: int):
+        if self.progress:
+            self.progress.add_bytes(type_str, size)
+
+    def _emit_progress(self, event: ProgressEvent):
+        if self.concurrency:
+            event.concurrency = self.concurrency.limit
+        self.progress_listener(event)
+
     def _handle_speed(self, speed_str: str):
-        """处理速度回调"""
+        """处理速度回调，启用自适应并发时附带当前并发数"""
+        if self.concurrency:
+            speed_str = f"{speed_str} 并发 {self.concurrency.limit}"
         if self.speed_callback:
             self.speed_callback(speed_str)
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_TTL = 600
+DEFAULT_SAVE_INTERVAL = 5.0
+
+
+class MetadataCache:
+    """元数据缓存
+
+    缓存推文配置JSON和各级播放列表文本，条目在ttl秒后过期。
+    指定persist_path时同时保存到磁盘，进程重启后仍可使用：写入只标记为待保存，
+    距上次保存超过save_interval秒时才重写文件，close时保存剩余的修改。
+    """
+    def __init__(self, ttl: float = DEFAULT_TTL, persist_path: Optional[str] = None,
+                 save_interval: float = DEFAULT_SAVE_INTERVAL):
+        self.ttl = ttl
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[float, Any]] = {}  # 键 -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 保存时只持有该锁，不阻塞读写
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._load()
+
+    def _load(self):
+        if not self.persist_path or not self.persist_path.exists():
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, (expires_at, value) in data.items():
+            if expires_at > now:
+                self._entries[key] = (expires_at, value)
+
+    def get(self, key: str) -> Optional[Any]:
+        """获取未过期的缓存值"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any):
+        """写入缓存值"""
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._dirty = True
+        self._maybe_save()
+
+    def invalidate(self, key: str):
+        """删除缓存值"""
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return
+            self._dirty = True
+        self._maybe_save()
+
+    def _maybe_save(self):
+        """距上次保存超过save_interval时保存；其他线程正在保存时跳过，修改留到下次保存"""
+        if not self.persist_path or time.monotonic() - self._last_save < self.save_interval:
+            return
+        if self._save_lock.acquire(blocking=False):
+            try:
+                self._save()
+            finally:
+                self._save_lock.release()
+
+    def flush(self):
+        """立即保存尚未写入磁盘的修改"""
+        if self.persist_path:
+            with self._save_lock:
+                self._save()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _save(self):
+        """在_save_lock中调用，只在复制条目时持有_lock"""
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            data = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+            self._dirty = False
+            self._last_save = time.monotonic()
+        tmp_path = self.persist_path.with_name(self.persist_path.name + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            with self._lock:
+                self._dirty = True  # close时再试一次
+            print(f"保存元数据缓存失败: {str(e)}")
+
+    def stats(self) -> dict:
+        """命中统计"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
@@ -0,0 +1,258 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+ATTEMPT_BUCKETS = (1, 2, 3, 5, 8)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """只增不减的计数器，按标签值分别计数"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        key = tuple(str(label) for label in label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *label_values) -> float:
+        with self._lock:
+            return self._values.get(tuple(str(label) for label in label_values), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}' for key, value in items]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {','.join(key): value for key, value in sorted(self._values.items())}
+
+
+class Histogram:
+    """固定分桶的直方图，记录分布、总和与次数"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        # 标签值 -> [各桶计数(非累积, 最后一个为+Inf), 总和, 次数]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        key = tuple(str(label) for label in label_values)
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values) -> Iterator[None]:
+        """记录with块的耗时(秒)，块内抛出异常时同样记录"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values) -> int:
+        with self._lock:
+            series = self._series.get(tuple(str(label) for label in label_values))
+            return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                ','.join(key): {
+                    'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], counts)),
+                    'sum': total,
+                    'count': count,
+                }
+                for key, (counts, total, count) in sorted(self._series.items())
+            }
+
+
+class MetricsRegistry:
+    """指标注册表，可输出Prometheus文本格式或JSON"""
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float],
+                  labels: Sequence[str] = ()) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets, labels))
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.to_dict() for metric in metrics}
+
+    def dump_json(self, path: str):
+        """把当前指标写入JSON文件，便于离线分析"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': time.time(), 'metrics': self.to_dict()}, f, ensure_ascii=False, indent=2)
+
+
+class DownloadMetrics:
+    """下载过程的指标
+
+    片段级: 首字节时间、总耗时、字节数、尝试次数、每次响应的HTTP状态码和校验失败次数；
+    任务级: 配置获取、播放列表获取、片段下载、合并和清理各阶段的耗时。
+    """
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or MetricsRegistry()
+        registry = self.registry
+        self.segment_ttfb = registry.histogram(
+            'twi_segment_ttfb_seconds', '片段请求发出到收到响应头的时间', TIME_BUCKETS, ('stream',))
+        self.segment_seconds = registry.histogram(
+            'twi_segment_seconds', '片段从发出请求到写入完成的总耗时(含重试)', TIME_BUCKETS, ('stream',))
+        self.segment_bytes = registry.histogram(
+            'twi_segment_bytes', '片段大小(字节)', SIZE_BUCKETS, ('stream',))
+        self.segment_attempts = registry.histogram(
+            'twi_segment_attempts', '片段成功前的请求次数', ATTEMPT_BUCKETS, ('stream',))
+        self.segments = registry.counter(
+            'twi_segments_total', '完成的片段数，source为network、cache或hedge', ('stream', 'source'))
+        self.responses = registry.counter(
+            'twi_segment_responses_total', '片段请求的结果，status为HTTP状态码或error', ('stream', 'status'))
+        self.integrity_failures = registry.counter(
+            'twi_segment_integrity_failures_total', '长度或box结构校验失败而重新下载的片段请求数', ('stream',))
+        self.phase_seconds = registry.histogram(
+            'twi_phase_seconds', '任务各阶段耗时', PHASE_BUCKETS, ('phase',))
+
+    def record_segment(self, stream: str, size: int, elapsed: float, attempts: int, source: str = 'network'):
+        self.segments.inc(stream, source)
+        self.segment_bytes.observe(size, stream)
+        if source == 'network':
+            self.segment_seconds.observe(elapsed, stream)
+            self.segment_attempts.observe(attempts, stream)
+
+    def record_response(self, stream: str, status: Optional[int]):
+        """记录一次片段请求的结果，status为None表示连接错误等没有状态码的失败"""
+        self.responses.inc(stream, status if status is not None else 'error')
+
+    def record_integrity_failure(self, stream: str):
+        self.integrity_failures.inc(stream)
+
+    def record_ttfb(self, stream: str, seconds: float):
+        self.segment_ttfb.observe(seconds, stream)
+
+    def phase(self, name: str):
+        """记录任务阶段耗时: with metrics.phase('download'): ..."""
+        return self.phase_seconds.time(name)
+
+
+_global_metrics = DownloadMetrics()
+
+
+def get_global_metrics() -> DownloadMetrics:
+    """获取进程共享的下载指标"""
+    return _global_metrics
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server: 'MetricsServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            body = self.server.registry.render_prometheus().encode()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/metrics.json':
+            body = json.dumps(self.server.registry.to_dict(), ensure_ascii=False).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """在后台线程中提供 /metrics(Prometheus文本格式) 和 /metrics.json"""
+    daemon_threads = True
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = '127.0.0.1'):
+        super().__init__((host, port), _MetricsHandler)
+        self.registry = registry
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self) -> 'MetricsServer':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
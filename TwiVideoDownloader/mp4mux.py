@@ -0,0 +1,288 @@
+import hashlib
+import os
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from TwiVideoDownloader.fastcopy import BUFFER_SIZE, copy_range
+
+TFHD_BASE_DATA_OFFSET = 0x000001
+
+
+class MuxUnsupportedError(Exception):
+    """内置合并器不支持的输入，调用方应改用ffmpeg"""
+
+
+@dataclass
+class Box:
+    """MP4盒子的位置信息"""
+    type: str
+    offset: int       # 盒子起始位置
+    size: int         # 含头部的总大小
+    header_size: int  # 头部大小(8或16)
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+
+def _parse_header(header: bytes, offset: int, end: int) -> Box:
+    size, box_type = struct.unpack('>I4s', header[:8])
+    header_size = 8
+    if size == 1:
+        if len(header) < 16:
+            raise MuxUnsupportedError("盒子头部不完整")
+        size = struct.unpack('>Q', header[8:16])[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+    box_type = box_type.decode('latin-1')
+    if size < header_size or offset + size > end:
+        raise MuxUnsupportedError(f"盒子 {box_type} 大小异常")
+    return Box(box_type, offset, size, header_size)
+
+
+def iter_file_boxes(f: BinaryIO, start: int, end: int) -> Iterator[Box]:
+    """遍历文件中[start, end)范围内的顶层盒子，每次都重新定位，调用方可以在迭代间读写文件"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        box = _parse_header(f.read(16), pos, end)
+        yield box
+        pos = box.end
+
+
+def iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Box]:
+    """遍历内存数据中[start, end)范围内的盒子"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        box = _parse_header(bytes(data[pos:pos + 16]), pos, end)
+        yield box
+        pos = box.end
+
+
+def find_box(data: bytes, path: List[str], start: int = 0, end: Optional[int] = None) -> Optional[Box]:
+    """按路径查找嵌套盒子，例如['mdia', 'mdhd']"""
+    for box in iter_boxes(data, start, end):
+        if box.type == path[0]:
+            if len(path) == 1:
+                return box
+            return find_box(data, path[1:], box.payload_offset, box.end)
+    return None
+
+
+def make_box(box_type: str, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type.encode('latin-1')) + payload
+
+
+class _InputTrack:
+    """只包含一条轨道的分片MP4输入"""
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.ftyp: Optional[bytes] = None
+        moov_box = None
+        for box in iter_file_boxes(self.file, 0, self.size):
+            if box.type == 'ftyp':
+                self.ftyp = self._read(box)
+            elif box.type == 'moov':
+                moov_box = box
+                break
+            elif box.type in ('moof', 'mdat'):
+                raise MuxUnsupportedError(f"{path}: moov之前出现媒体数据")
+        if moov_box is None:
+            raise MuxUnsupportedError(f"{path}: 缺少moov")
+        self.fragments_start = moov_box.end
+
+        moov = self._read(moov_box)
+        self.mvhd: Optional[bytes] = None
+        self.trak: Optional[bytearray] = None
+        self.mvex: Optional[bytes] = None
+        self.extra: List[bytes] = []  # moov中其余需要保留的盒子
+        for box in iter_boxes(moov, moov_box.header_size):
+            data = moov[box.offset:box.end]
+            if box.type == 'mvhd':
+                self.mvhd = data
+            elif box.type == 'trak':
+                if self.trak is not None:
+                    raise MuxUnsupportedError(f"{path}: 包含多条轨道")
+                self.trak = bytearray(data)
+            elif box.type == 'mvex':
+                self.mvex = data
+            elif box.type == 'pssh':
+                raise MuxUnsupportedError(f"{path}: 加密内容")
+            else:
+                self.extra.append(data)
+        if self.mvhd is None or self.trak is None or self.mvex is None:
+            raise MuxUnsupportedError(f"{path}: 不是分片MP4")
+        if find_box(self.trak, ['tref'], 8) is not None:
+            raise MuxUnsupportedError(f"{path}: 包含轨道引用")
+
+        mdhd = find_box(self.trak, ['mdia', 'mdhd'], 8)
+        if mdhd is None:
+            raise MuxUnsupportedError(f"{path}: 缺少mdhd")
+        version = self.trak[mdhd.payload_offset]
+        timescale_offset = mdhd.payload_offset + (20 if version == 1 else 12)
+        self.timescale = struct.unpack('>I', self.trak[timescale_offset:timescale_offset + 4])[0]
+        self.movie_timescale = struct.unpack('>I', self.mvhd[(28 if self.mvhd[8] == 1 else 20):][:4])[0]
+        self.has_edit_list = find_box(self.trak, ['edts'], 8) is not None
+        if not self.timescale:
+            raise MuxUnsupportedError(f"{path}: 时间刻度无效")
+
+    def _read(self, box: Box) -> bytes:
+        self.file.seek(box.offset)
+        return self.file.read(box.size)
+
+    def trak_with_id(self, track_id: int) -> bytes:
+        """返回改写track_ID后的trak"""
+        tkhd = find_box(self.trak, ['tkhd'], 8)
+        if tkhd is None:
+            raise MuxUnsupportedError(f"{self.path}: 缺少tkhd")
+        version = self.trak[tkhd.payload_offset]
+        id_offset = tkhd.payload_offset + (20 if version == 1 else 12)
+        trak = bytearray(self.trak)
+        struct.pack_into('>I', trak, id_offset, track_id)
+        return bytes(trak)
+
+    def trex_with_id(self, track_id: int) -> bytes:
+        """返回改写track_ID后的trex"""
+        trex = find_box(self.mvex, ['trex'], 8)
+        if trex is None:
+            raise MuxUnsupportedError(f"{self.path}: 缺少trex")
+        data = bytearray(self.mvex[trex.offset:trex.end])
+        struct.pack_into('>I', data, trex.header_size + 4, track_id)
+        return bytes(data)
+
+    def fragments(self, track_id: int) -> Iterator[Tuple[float, bytearray, int, int]]:
+        """依次产出(解码时间秒, 改写后的moof, 其后需原样复制的起止位置)
+
+        moof到对应mdat结尾之间的字节原样保留，trun中相对moof的数据偏移因此保持有效。
+        """
+        moof_box = None
+        for box in iter_file_boxes(self.file, self.fragments_start, self.size):
+            if box.type == 'moof':
+                if moof_box is not None:
+                    raise MuxUnsupportedError(f"{self.path}: moof之后缺少mdat")
+                moof_box = box
+            elif box.type == 'mdat':
+                if moof_box is None:
+                    raise MuxUnsupportedError(f"{self.path}: mdat之前缺少moof")
+                moof = bytearray(self._read(moof_box))
+                decode_time = self._rewrite_moof(moof, track_id)
+                yield decode_time / self.timescale, moof, moof_box.end, box.end
+                moof_box = None
+            # styp、sidx等片段外的盒子直接丢弃，moof与mdat之间的盒子随复制范围保留
+        if moof_box is not None:
+            raise MuxUnsupportedError(f"{self.path}: 文件在moof之后截断")
+
+    def _rewrite_moof(self, moof: bytearray, track_id: int) -> int:
+        """改写traf中的track_ID，返回baseMediaDecodeTime"""
+        trafs = [box for box in iter_boxes(moof, 8) if box.type == 'traf']
+        if len(trafs) != 1:
+            raise MuxUnsupportedError(f"{self.path}: 每个moof需要恰好一个traf")
+        traf = trafs[0]
+        tfhd = find_box(moof, ['tfhd'], traf.payload_offset, traf.end)
+        tfdt = find_box(moof, ['tfdt'], traf.payload_offset, traf.end)
+        if tfhd is None or tfdt is None:
+            raise MuxUnsupportedError(f"{self.path}: traf缺少tfhd或tfdt")
+
+        flags = int.from_bytes(moof[tfhd.payload_offset + 1:tfhd.payload_offset + 4], 'big')
+        if flags & TFHD_BASE_DATA_OFFSET:
+            raise MuxUnsupportedError(f"{self.path}: 使用了绝对数据偏移")
+        struct.pack_into('>I', moof, tfhd.payload_offset + 4, track_id)
+
+        if moof[tfdt.payload_offset] == 1:
+            return struct.unpack('>Q', moof[tfdt.payload_offset + 4:tfdt.payload_offset + 12])[0]
+        return struct.unpack('>I', moof[tfdt.payload_offset + 4:tfdt.payload_offset + 8])[0]
+
+    def close(self):
+        self.file.close()
+
+
+class FragmentedMP4Muxer:
+    """分片MP4合并器
+
+    把只含视频轨和只含音频轨的两个分片MP4合并为一个双轨分片MP4，
+    按解码时间交错写出片段，媒体数据在内核中从输入文件复制到输出文件，不经过Python内存；
+    kernel_copy为False时改用缓冲区复制。遇到不支持的输入时抛出MuxUnsupportedError。
+    digest为True时边写边计算输出的sha256(结果在sha256属性中)，媒体数据此时需经过Python，改为缓冲区复制。
+    """
+    def __init__(self, kernel_copy: bool = True, digest: bool = False):
+        self.kernel_copy = kernel_copy
+        self.digest = digest
+        self.sha256: Optional[str] = None
+        self._hasher = None
+
+    def mux(self, video_path: str, audio_path: str, output_path: str):
+        video = _InputTrack(video_path)
+        try:
+            audio = _InputTrack(audio_path)
+        except Exception:
+            video.close()
+            raise
+        try:
+            if (audio.has_edit_list or video.has_edit_list) and video.movie_timescale != audio.movie_timescale:
+                raise MuxUnsupportedError("编辑列表的时间刻度不一致")
+            self._hasher = hashlib.sha256() if self.digest else None
+            with open(output_path, 'wb') as out:
+                self._write(out, video.ftyp or audio.ftyp or b'')
+                self._write(out, self._build_moov(video, audio))
+                self._write_fragments(out, video, audio)
+            self.sha256 = self._hasher.hexdigest() if self._hasher else None
+        finally:
+            video.close()
+            audio.close()
+
+    def _write(self, out: BinaryIO, data: bytes):
+        out.write(data)
+        if self._hasher:
+            self._hasher.update(data)
+
+    def _build_moov(self, video: _InputTrack, audio: _InputTrack) -> bytes:
+        mvhd = bytearray(video.mvhd)
+        struct.pack_into('>I', mvhd, len(mvhd) - 4, 3)  # next_track_ID
+        mvex = make_box('mvex', video.trex_with_id(1) + audio.trex_with_id(2))
+        children = [bytes(mvhd), video.trak_with_id(1), audio.trak_with_id(2), mvex] + video.extra
+        return make_box('moov', b''.join(children))
+
+    def _write_fragments(self, out: BinaryIO, video: _InputTrack, audio: _InputTrack):
+        sources = [(video, video.fragments(1)), (audio, audio.fragments(2))]
+        heads = [next(iterator, None) for _, iterator in sources]
+        sequence = 1
+        while any(head is not None for head in heads):
+            # 取解码时间最早的片段，时间相同时先写视频
+            i = min(
+                (i for i, head in enumerate(heads) if head is not None),
+                key=lambda i: heads[i][0]
+            )
+            track, iterator = sources[i]
+            _, moof, copy_start, copy_end = heads[i]
+
+            mfhd = find_box(moof, ['mfhd'], 8)
+            if mfhd is not None:
+                struct.pack_into('>I', moof, mfhd.payload_offset + 4, sequence)
+            sequence += 1
+
+            self._write(out, moof)
+            self._copy_range(track.file, out, copy_start, copy_end)
+            heads[i] = next(iterator, None)
+
+    def _copy_range(self, src: BinaryIO, out: BinaryIO, start: int, end: int):
+        if self._hasher is None:
+            if copy_range(src, out, start, end - start, self.kernel_copy) < end - start:
+                raise MuxUnsupportedError("输入文件在mdat中截断")
+            return
+        src.seek(start)
+        remaining = end - start
+        while remaining:
+            chunk = src.read(min(BUFFER_SIZE, remaining))
+            if not chunk:
+                raise MuxUnsupportedError("输入文件在mdat中截断")
+            self._write(out, chunk)
+            remaining -= len(chunk)
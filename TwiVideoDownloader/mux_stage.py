@@ -0,0 +1,135 @@
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+from TwiVideoDownloader.mp4mux import FragmentedMP4Muxer, MuxUnsupportedError
+
+
+def mux_command(video_input: str, audio_input: str, output_path: str,
+                trim: Optional[Tuple[float, Optional[float]]] = None) -> list:
+    """生成ffmpeg合并命令，提供trim=(偏移, 时长)时重新编码并精确裁剪"""
+    command = [
+        'ffmpeg',
+        '-nostdin',
+        '-loglevel', 'error',
+        '-i', video_input,
+        '-i', audio_input,
+    ]
+    if trim:
+        # 直接复制只能从关键帧开始，精确裁剪需要重新编码
+        offset, duration = trim
+        command += ['-ss', f'{offset:.3f}']
+        if duration is not None:
+            command += ['-t', f'{duration:.3f}']
+        command += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-c:a', 'aac']
+    else:
+        command += ['-c:v', 'copy', '-c:a', 'copy']
+    return command + ['-y', output_path]
+
+
+def start_ffmpeg(command: list, pass_fds=()):
+    """启动ffmpeg，只保留最后若干行错误输出，不在内存中累积全部输出"""
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        pass_fds=pass_fds
+    )
+    stderr_tail = deque(maxlen=20)
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+    return process, stderr_tail, stderr_thread
+
+
+def wait_ffmpeg(process: subprocess.Popen, stderr_thread: threading.Thread):
+    process.wait()
+    stderr_thread.join()
+    process.stderr.close()
+
+
+def check_ffmpeg(process: subprocess.Popen, stderr_tail, command: list):
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr='\n'.join(stderr_tail))
+
+
+def merge_with_ffmpeg(video_path: str, audio_path: str, output_path: str, trim=None):
+    """使用ffmpeg合并视频和音频"""
+    command = mux_command(video_path, audio_path, output_path, trim)
+    process, stderr_tail, stderr_thread = start_ffmpeg(command)
+    wait_ffmpeg(process, stderr_thread)
+    check_ffmpeg(process, stderr_tail, command)
+
+
+def merge_video_audio(video_path: str, audio_path: str, output_path: str,
+                      muxer: str = "auto", trim=None, digest: bool = False) -> Optional[str]:
+    """合并视频和音频，默认使用内置合并器，不支持的输入或需要精确裁剪时改用ffmpeg
+
+    digest为True且由内置合并器合并时返回边写边计算的输出sha256，否则返回None。
+    只依赖参数，可以在进程池中执行。
+    """
+    if muxer != "ffmpeg" and not trim:
+        try:
+            mp4_muxer = FragmentedMP4Muxer(digest=digest)
+            mp4_muxer.mux(video_path, audio_path, output_path)
+            return mp4_muxer.sha256
+        except MuxUnsupportedError as e:
+            Path(output_path).unlink(missing_ok=True)
+            if muxer == "python":
+                raise
+            print(f"内置合并器不支持该输入({str(e)})，改用ffmpeg")
+    merge_with_ffmpeg(video_path, audio_path, output_path, trim)
+    return None
+
+
+class MuxStage:
+    """独立的合并阶段
+
+    批量下载时任务下载完成后把合并交给进程池，下载名额随即让给下一个任务，
+    合并与下载并行且互不占用对方的并发数。workers为进程数，0表示CPU核数。
+    进程池在第一次合并时创建，使用spawn方式启动，不继承下载线程的状态。
+    """
+    def __init__(self, workers: int = 0):
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    async def merge(self, video_path: str, audio_path: str, output_path: str,
+                    muxer: str = "auto", trim=None, digest: bool = False) -> Optional[str]:
+        """在进程池中合并，等待时不阻塞事件循环，返回值同merge_video_audio"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), merge_video_audio, video_path, audio_path, output_path, muxer, trim, digest
+        )
+
+    def close(self):
+        """等待进行中的合并完成并关闭进程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,248 @@
+import re
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+_ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=(?:"([^"]*)"|([^,]*))')
+_RESOLUTION_PATTERN = re.compile(r'/(\d+x\d+)/')
+# 播放列表没有EXT-X-TARGETDURATION时使用的片段时长上限(秒)
+DEFAULT_TARGET_DURATION = 6
+
+
+@dataclass
+class MediaInfo:
+    """媒体信息数据类"""
+    type: str        # 媒体类型
+    name: str        # 名称
+    group_id: str    # 组ID
+    uri: str         # 资源URL
+    language: Optional[str] = None  # 语言
+    autoselect: bool = False        # 自动选择
+    default: bool = False           # 是否默认
+    characteristics: Optional[str] = None  # 特征
+
+
+@dataclass
+class StreamInfo:
+    """流信息数据类"""
+    bandwidth: int           # 带宽
+    resolution: str         # 分辨率
+    codecs: str            # 编码格式
+    subtitles: Optional[str] # 字幕
+    audio: str             # 音频
+    uri: str              # 资源URL
+    average_bandwidth: Optional[int] = None  # 平均带宽
+
+
+class PlaylistSegment(NamedTuple):
+    """媒体播放列表中的一个片段"""
+    index: int        # 在播放列表中的序号
+    duration: float   # 持续时间(秒)
+    uri: str          # 片段URL
+    start_time: int   # 开始时间(ms)
+    end_time: int     # 结束时间(ms)
+
+
+def parse_attributes(attr_string: str) -> Dict[str, str]:
+    """解析标签属性，带引号的值去掉引号"""
+    return {
+        match.group(1): match.group(2) if match.group(2) is not None else match.group(3)
+        for match in _ATTRIBUTE_PATTERN.finditer(attr_string)
+    }
+
+
+def _tag_value(line: str) -> str:
+    return line[line.index(':') + 1:]
+
+
+class MediaPlaylist:
+    """媒体播放列表的解析结果
+
+    片段URI和时长分别保存在列表和array中，不为每个片段保留对象；
+    迭代时按需生成PlaylistSegment。
+    """
+    __slots__ = ('version', 'target_duration', 'media_sequence', 'playlist_type',
+                 'map_uri', 'resolution', 'endlist', 'uris', 'durations')
+
+    def __init__(self):
+        self.version = 0
+        self.target_duration = 0
+        self.media_sequence = 0
+        self.playlist_type = ""
+        self.map_uri: Optional[str] = None
+        self.resolution = ""
+        self.endlist = False
+        self.uris: List[str] = []
+        self.durations = array('d')
+
+    def __len__(self) -> int:
+        return len(self.uris)
+
+    def __iter__(self) -> Iterator[PlaylistSegment]:
+        start = 0
+        for index, (duration, uri) in enumerate(zip(self.durations, self.uris)):
+            end = start + int(duration * 1000)
+            yield PlaylistSegment(index, duration, uri, start, end)
+            start = end
+
+    @property
+    def total_duration(self) -> float:
+        """总时长(秒)"""
+        return sum(self.durations)
+
+
+def _scan_media_playlist(content: str, playlist: MediaPlaylist) -> Iterator[Tuple[float, str]]:
+    """单遍扫描媒体播放列表，头部标签写入playlist，逐个产出(时长, URI)"""
+    duration = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != '#':
+            if duration is not None:
+                yield duration, line
+                duration = None
+        elif line.startswith('#EXTINF:'):
+            duration = float(line[8:].split(',', 1)[0])
+        elif line.startswith('#EXT-X-MAP:'):
+            playlist.map_uri = parse_attributes(_tag_value(line)).get('URI')
+            match = _RESOLUTION_PATTERN.search(playlist.map_uri or '')
+            if match:
+                playlist.resolution = match.group(1)
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist.target_duration = int(_tag_value(line))
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            playlist.media_sequence = int(_tag_value(line))
+        elif line.startswith('#EXT-X-VERSION:'):
+            playlist.version = int(_tag_value(line))
+        elif line.startswith('#EXT-X-PLAYLIST-TYPE:'):
+            playlist.playlist_type = _tag_value(line).strip()
+        elif line == '#EXT-X-ENDLIST':
+            playlist.endlist = True
+
+
+_Segment = TypeVar('_Segment')
+
+
+def segments_in_range(segments: Sequence[_Segment], start: Optional[float] = None,
+                      end: Optional[float] = None) -> List[_Segment]:
+    """保留与[start, end)秒有重叠的片段，片段需带start_time/end_time(ms)；start/end为None表示不限"""
+    start_ms = int(start * 1000) if start else 0
+    end_ms = int(end * 1000) if end is not None else None
+    return [
+        segment for segment in segments
+        if segment.end_time > start_ms and (end_ms is None or segment.start_time < end_ms)
+    ]
+
+
+def iter_media_playlist(content: str, playlist: Optional[MediaPlaylist] = None) -> Iterator[PlaylistSegment]:
+    """逐个产出片段，片段不在内存中累积，适合很长的播放列表
+
+    头部标签写入playlist(如提供)。
+    """
+    playlist = playlist if playlist is not None else MediaPlaylist()
+    start = 0
+    for index, (duration, uri) in enumerate(_scan_media_playlist(content, playlist)):
+        end = start + int(duration * 1000)
+        yield PlaylistSegment(index, duration, uri, start, end)
+        start = end
+
+
+def iter_playlist_tail(content: str, next_sequence: int, start_time: int = 0,
+                       playlist: Optional[MediaPlaylist] = None) -> Iterator[PlaylistSegment]:
+    """跟随直播时解析重新获取的播放列表，只产出媒体序号不小于next_sequence的片段
+
+    片段的index为媒体序号(EXT-X-MEDIA-SEQUENCE加上在列表中的位置)，
+    开始时间从start_time(ms)起接着上一次的结尾计算。头部标签写入playlist(如提供)。
+    """
+    playlist = playlist if playlist is not None else MediaPlaylist()
+    start = start_time
+    for position, (duration, uri) in enumerate(_scan_media_playlist(content, playlist)):
+        sequence = playlist.media_sequence + position
+        if sequence < next_sequence:
+            continue
+        end = start + int(duration * 1000)
+        yield PlaylistSegment(sequence, duration, uri, start, end)
+        start = end
+
+
+def live_poll_interval(target_duration: int, changed: bool) -> float:
+    """直播播放列表的刷新间隔(秒)：有新片段时等待一个TARGETDURATION，没有变化时等待一半"""
+    target = target_duration or DEFAULT_TARGET_DURATION
+    return float(target if changed else target / 2)
+
+
+def parse_media_playlist(content: str) -> MediaPlaylist:
+    """解析媒体播放列表，返回紧凑的结果对象"""
+    playlist = MediaPlaylist()
+    uris = playlist.uris
+    durations = playlist.durations
+    for duration, uri in _scan_media_playlist(content, playlist):
+        durations.append(duration)
+        uris.append(uri)
+    return playlist
+
+
+class MasterPlaylist:
+    """主播放列表的解析结果"""
+    def __init__(self):
+        self.media_items: List[MediaInfo] = []
+        self.stream_items: List[StreamInfo] = []
+
+    def get_highest_quality_stream(self) -> Optional[StreamInfo]:
+        """获取最高质量的视频流"""
+        if not self.stream_items:
+            return None
+        return max(self.stream_items, key=lambda x: x.bandwidth)
+
+    def get_audio_streams(self) -> List[MediaInfo]:
+        """获取所有音频流"""
+        return [media for media in self.media_items if media.type == 'AUDIO']
+
+    def get_subtitle_streams(self) -> List[MediaInfo]:
+        """获取所有字幕流"""
+        return [media for media in self.media_items if media.type == 'SUBTITLES']
+
+
+def _media_info(attrs: Dict[str, str]) -> MediaInfo:
+    return MediaInfo(
+        type=attrs.get('TYPE', ''),
+        name=attrs.get('NAME', ''),
+        group_id=attrs.get('GROUP-ID', ''),
+        uri=attrs.get('URI', ''),
+        language=attrs.get('LANGUAGE', None),
+        autoselect=attrs.get('AUTOSELECT', 'NO').upper() == 'YES',
+        default=attrs.get('DEFAULT', 'NO').upper() == 'YES',
+        characteristics=attrs.get('CHARACTERISTICS', None)
+    )
+
+
+def _stream_info(attrs: Dict[str, str], uri: str) -> StreamInfo:
+    return StreamInfo(
+        bandwidth=int(attrs.get('BANDWIDTH', '0')),
+        resolution=attrs.get('RESOLUTION', ''),
+        codecs=attrs.get('CODECS', ''),
+        subtitles=attrs.get('SUBTITLES', None),
+        audio=attrs.get('AUDIO', ''),
+        uri=uri,
+        average_bandwidth=int(attrs.get('AVERAGE-BANDWIDTH', '0'))
+    )
+
+
+def parse_master_playlist(content: str) -> MasterPlaylist:
+    """单遍扫描主播放列表"""
+    playlist = MasterPlaylist()
+    stream_attrs = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != '#':
+            if stream_attrs is not None:
+                playlist.stream_items.append(_stream_info(stream_attrs, line))
+                stream_attrs = None
+        elif line.startswith('#EXT-X-MEDIA:'):
+            playlist.media_items.append(_media_info(parse_attributes(_tag_value(line))))
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            stream_attrs = parse_attributes(_tag_value(line))
+    return playlist
@@ -0,0 +1,150 @@
+import math
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, Optional
+
+
+@dataclass
+class StreamProgress:
+    """单个流的进度"""
+    completed: int = 0  # 已完成的片段数
+    total: int = 0      # 片段总数
+    bytes: int = 0      # 已下载的字节数
+
+
+@dataclass
+class ProgressEvent:
+    """汇总后的进度事件"""
+    streams: Dict[str, StreamProgress] = field(default_factory=dict)  # 流名称 -> 进度
+    bytes: int = 0                   # 所有流已下载的字节数
+    rate: float = 0.0                # 滑动平均速度(字节/秒)
+    eta: Optional[float] = None      # 预计剩余时间(秒)，无法估计时为None
+    elapsed: float = 0.0             # 已用时间(秒)
+    finished: bool = False           # 是否为结束时的最后一个事件
+    concurrency: Optional[int] = None  # 启用自适应并发时的当前并发数
+
+
+def format_speed(bytes_per_second: float) -> str:
+    """格式化下载速度"""
+    if bytes_per_second >= 1024 * 1024:
+        return f"{bytes_per_second / (1024 * 1024):.1f} MB/s"
+    elif bytes_per_second >= 1024:
+        return f"{bytes_per_second / 1024:.1f} KB/s"
+    else:
+        return f"{bytes_per_second:.1f} B/s"
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    """格式化剩余时间，无法估计时返回--:--"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressAggregator:
+    """进度汇总器
+
+    下载线程按字节调用add_bytes、按片段调用update_segments，只做计数；
+    后台线程每隔interval秒计算一次指数加权平均速度(半衰期half_life秒)和剩余时间并回调，
+    因此回调频率与片段数量和大小无关，下载停顿时速度也会随之下降。
+    """
+    def __init__(self, callback: Callable[[ProgressEvent], None], interval: float = 0.5,
+                 half_life: float = 3.0):
+        self.callback = callback
+        self.interval = interval
+        self.half_life = half_life
+        self._streams: Dict[str, StreamProgress] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_time = 0.0
+        self._last_sample = 0.0
+        self._last_bytes = 0
+        self._rate = 0.0
+        self._has_rate = False
+
+    def add_bytes(self, stream: str, size: int):
+        with self._lock:
+            self._stream(stream).bytes += size
+
+    def update_segments(self, stream: str, completed: int, total: int):
+        with self._lock:
+            progress = self._stream(stream)
+            progress.completed = completed
+            progress.total = total
+
+    def _stream(self, stream: str) -> StreamProgress:
+        progress = self._streams.get(stream)
+        if progress is None:
+            progress = self._streams[stream] = StreamProgress()
+        return progress
+
+    def start(self):
+        """开始定时回调，重复调用无效"""
+        if self._thread is not None:
+            return
+        self._start_time = self._last_sample = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止定时回调并发出最后一个事件"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._emit(finished=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._emit()
+
+    def snapshot(self, finished: bool = False) -> ProgressEvent:
+        """采样一次并返回当前进度"""
+        now = time.monotonic()
+        with self._lock:
+            streams = {name: replace(progress) for name, progress in self._streams.items()}
+        total_bytes = sum(progress.bytes for progress in streams.values())
+
+        elapsed = now - self._last_sample
+        if elapsed > 0:
+            instant = (total_bytes - self._last_bytes) / elapsed
+            if self._has_rate:
+                alpha = 1 - math.exp(-elapsed * math.log(2) / self.half_life)
+                self._rate += alpha * (instant - self._rate)
+            else:
+                self._rate = instant
+                self._has_rate = True
+            self._last_sample = now
+            self._last_bytes = total_bytes
+
+        return ProgressEvent(
+            streams=streams,
+            bytes=total_bytes,
+            rate=self._rate,
+            eta=0.0 if finished else self._estimate_eta(streams),
+            elapsed=now - self._start_time,
+            finished=finished
+        )
+
+    def _estimate_eta(self, streams: Dict[str, StreamProgress]) -> Optional[float]:
+        """按各流已完成片段的平均大小估计剩余字节数，再除以当前速度"""
+        remaining = 0.0
+        for progress in streams.values():
+            if progress.total and progress.completed >= progress.total:
+                continue
+            if not progress.completed:
+                return None
+            remaining += max(0.0, progress.bytes / progress.completed * progress.total - progress.bytes)
+        if self._rate <= 0:
+            return None
+        return remaining / self._rate
+
+    def _emit(self, finished: bool = False):
+        self.callback(self.snapshot(finished))
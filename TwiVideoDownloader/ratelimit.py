@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+MAX_SLEEP = 0.1  # 单次等待上限，速率在运行中调整后最多这么久生效
+
+
+class TokenBucket:
+    """令牌桶带宽限制
+
+    rate为每秒字节数，0表示不限速。每读到一块数据就按其大小取令牌，令牌不足时等待；
+    允许单块数据大于桶容量(欠账)，之后的调用方等到欠账还清为止，因此长期平均速度等于rate。
+    设置parent时同时受父级限制，用于在进程共享的总限速下再给单个任务设上限。
+    """
+    def __init__(self, rate: float = 0, burst: Optional[float] = None,
+                 parent: Optional['TokenBucket'] = None):
+        self.parent = parent
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.rate = 0.0
+        self.burst = 0.0
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: Optional[float] = None):
+        """调整速率(字节/秒)，正在等待的调用方在MAX_SLEEP内按新速率继续；burst默认为0.25秒的量"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(0.0, float(rate))
+            self.burst = float(burst) if burst is not None else max(64 * 1024, self.rate * 0.25)
+            self._tokens = min(self._tokens, self.burst)
+
+    @property
+    def limited(self) -> bool:
+        """自身或任一父级是否在限速"""
+        return self.rate > 0 or (self.parent is not None and self.parent.limited)
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, size: int) -> float:
+        """没有欠账时取走size个令牌并返回0，否则返回应等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 0:
+                self._tokens -= size
+                return 0.0
+            return min(MAX_SLEEP, -self._tokens / self.rate)
+
+    def consume(self, size: int):
+        """阻塞直到允许再读取size字节"""
+        bucket = self
+        while bucket is not None:
+            delay = bucket._take(size)
+            while delay > 0:
+                time.sleep(delay)
+                delay = bucket._take(size)
+            bucket = bucket.parent
+
+    async def consume_async(self, size: int):
+        """consume的协程版本，等待时不阻塞事件循环"""
+        bucket = self
+        while bucket is not None:
+            delay = bucket._take(size)
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = bucket._take(size)
+            bucket = bucket.parent
+
+
+_global_limiter = TokenBucket()
+
+
+def get_global_limiter() -> TokenBucket:
+    """获取进程共享的带宽限制，默认不限速，可随时通过set_rate调整"""
+    return _global_limiter
+
+
+def job_limiter(rate: Optional[float] = None) -> TokenBucket:
+    """单个任务使用的限速器：rate为该任务的上限(字节/秒)，同时受进程共享的限速约束"""
+    if not rate:
+        return _global_limiter
+    return TokenBucket(rate, parent=_global_limiter)
@@ -0,0 +1,254 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from urllib.parse import urlsplit
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:  # 异步引擎为可选功能
+    aiohttp = None
+
+T = TypeVar('T')
+
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# 与主机连接有关的错误，计入熔断器
+TRANSPORT_ERRORS = (
+    ConnectionError, TimeoutError, asyncio.TimeoutError,
+    requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+) + ((aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) if aiohttp else ())
+
+
+def status_of(exc: BaseException) -> Optional[int]:
+    """取出异常对应的HTTP状态码，兼容requests和aiohttp"""
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        status = getattr(exc, 'status', None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after_of(exc: BaseException) -> Optional[float]:
+    """解析Retry-After头，支持秒数和HTTP日期两种格式"""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(exc, 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RetryPolicy:
+    """重试策略
+
+    按指数退避加全抖动计算等待时间，服务端给出Retry-After时以其为准(不超过max_retry_after)。
+    408/429/5xx等状态码和连接错误会重试，其余4xx视为致命错误立即失败。
+    """
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    max_retry_after: float = 120.0
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        if isinstance(exc, BrokenPipeError):
+            return False  # 本地输出管道已关闭，重试没有意义
+        status = status_of(exc)
+        return status is None or status in RETRYABLE_STATUSES
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """第attempt次失败后的等待秒数，attempt从1开始"""
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class _HostState:
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.open_count = 0      # 连续打开次数，决定下次暂停多久
+        self.probe_started = 0.0  # 半开状态下试探请求的开始时间，0表示没有试探
+
+
+class CircuitBreaker:
+    """按主机划分的熔断器
+
+    同一主机连续失败failure_threshold次后打开，暂停所有发往该主机的请求reset_timeout秒
+    (有Retry-After时取较大者，连续打开时逐次加倍)。暂停结束后只放行一个试探请求，
+    成功则恢复，失败则再次打开。
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.0,
+                 max_reset_timeout: float = 120.0, probe_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe_timeout = probe_timeout
+        self._hosts: Dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc
+
+    def _state(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState()
+        return state
+
+    def wait_time(self, host: str) -> float:
+        """返回需要等待的秒数，返回0时可以立即发出请求"""
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            if state.open_until > now:
+                return state.open_until - now
+            if state.open_count == 0:
+                return 0.0
+            # 半开：只允许一个试探请求
+            if state.probe_started and now - state.probe_started < self.probe_timeout:
+                return 0.1
+            state.probe_started = now
+            return 0.0
+
+    def wait(self, host: str):
+        """阻塞等待直到允许向host发出请求"""
+        while True:
+            delay = self.wait_time(host)
+            if delay <= 0:
+                return
+            time.sleep(min(delay, 0.5))
+
+    async def wait_async(self, host: str):
+        """在事件循环中等待直到允许向host发出请求"""
+        while True:
+            delay = self.wait_time(host)
+            if delay <= 0:
+                return
+            await asyncio.sleep(min(delay, 0.5))
+
+    def record_success(self, host: str):
+        with self._lock:
+            state = self._state(host)
+            state.failures = 0
+            state.open_count = 0
+            state.open_until = 0.0
+            state.probe_started = 0.0
+
+    def record_failure(self, host: str, retry_after: Optional[float] = None):
+        with self._lock:
+            state = self._state(host)
+            state.failures += 1
+            probing = bool(state.probe_started)
+            state.probe_started = 0.0
+            if probing or state.failures >= self.failure_threshold:
+                timeout = min(self.max_reset_timeout, self.reset_timeout * (2 ** state.open_count))
+                state.open_until = time.monotonic() + max(timeout, retry_after or 0.0)
+                state.open_count += 1
+                state.failures = 0
+
+    def release(self, host: str):
+        """请求因与主机无关的原因结束，只释放试探名额"""
+        with self._lock:
+            self._state(host).probe_started = 0.0
+
+    def is_open(self, host: str) -> bool:
+        with self._lock:
+            return self._state(host).open_until > time.monotonic()
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+_global_breaker: Optional[CircuitBreaker] = None
+_global_lock = threading.Lock()
+
+
+def get_global_breaker() -> CircuitBreaker:
+    """获取进程共享的熔断器"""
+    global _global_breaker
+    with _global_lock:
+        if _global_breaker is None:
+            _global_breaker = CircuitBreaker()
+        return _global_breaker
+
+
+def _settle(breaker: CircuitBreaker, host: str, exc: BaseException, policy: RetryPolicy) -> bool:
+    """记录失败并返回是否可以重试
+
+    只有可重试的状态码和连接、超时错误计入熔断器；磁盘写满、数据校验失败等本地错误
+    照常重试或抛出，但不会让主机进入熔断。
+    """
+    status = status_of(exc)
+    if not policy.is_retryable(exc):
+        # 明确的4xx说明主机正常，其余错误与主机无关
+        if status is not None:
+            breaker.record_success(host)
+        else:
+            breaker.release(host)
+        return False
+    if status is not None or isinstance(exc, TRANSPORT_ERRORS):
+        breaker.record_failure(host, retry_after_of(exc))
+    else:
+        breaker.release(host)
+    return True
+
+
+def call_with_retry(func: Callable[[int], T], url: str, policy: Optional[RetryPolicy] = None,
+                    breaker: Optional[CircuitBreaker] = None,
+                    exceptions=(Exception,)) -> T:
+    """按重试策略调用func(attempt)，attempt从0开始，func每次都应从头完成整个请求"""
+    policy = policy or DEFAULT_POLICY
+    breaker = breaker or get_global_breaker()
+    host = breaker.host_of(url)
+    for attempt in range(policy.max_attempts):
+        breaker.wait(host)
+        try:
+            result = func(attempt)
+        except exceptions as e:
+            if not _settle(breaker, host, e, policy) or attempt == policy.max_attempts - 1:
+                raise
+            time.sleep(policy.delay(attempt + 1, retry_after_of(e)))
+            continue
+        except BaseException:
+            breaker.release(host)
+            raise
+        breaker.record_success(host)
+        return result
+
+
+async def call_with_retry_async(func: Callable[[int], Awaitable[T]], url: str,
+                                policy: Optional[RetryPolicy] = None,
+                                breaker: Optional[CircuitBreaker] = None,
+                                exceptions=(Exception,)) -> T:
+    """call_with_retry的协程版本"""
+    policy = policy or DEFAULT_POLICY
+    breaker = breaker or get_global_breaker()
+    host = breaker.host_of(url)
+    for attempt in range(policy.max_attempts):
+        await breaker.wait_async(host)
+        try:
+            result = await func(attempt)
+        except exceptions as e:
+            if not _settle(breaker, host, e, policy) or attempt == policy.max_attempts - 1:
+                raise
+            await asyncio.sleep(policy.delay(attempt + 1, retry_after_of(e)))
+            continue
+        except BaseException:
+            breaker.release(host)
+            raise
+        breaker.record_success(host)
+        return result
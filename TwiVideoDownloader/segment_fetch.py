@@ -0,0 +1,223 @@
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from TwiVideoDownloader.integrity import IntegrityError
+
+CHUNK_SIZE = 64 * 1024
+RANGE_PART_SIZE = 1024 * 1024  # 首个分段的大小，对象不超过该大小时只需一次请求
+
+_CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+def parse_content_range(value: Optional[str]) -> Tuple[int, int, Optional[int]]:
+    """解析Content-Range，返回(起始, 结束, 总长度)，总长度未知时为None"""
+    match = _CONTENT_RANGE_PATTERN.match(value or '')
+    if not match:
+        raise IOError(f"无效的Content-Range: {value}")
+    total = match.group(3)
+    return int(match.group(1)), int(match.group(2)), None if total == '*' else int(total)
+
+
+def expected_length(status: int, headers) -> Optional[int]:
+    """响应体应有的字节数：206取Content-Range的区间长度，否则取Content-Length；压缩传输或未提供时为None"""
+    if headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return None  # Content-Length为压缩后的长度
+    if status == 206:
+        start, end, _ = parse_content_range(headers.get('Content-Range'))
+        return end - start + 1
+    value = headers.get('Content-Length')
+    return int(value) if value and value.isdigit() else None
+
+
+def check_length(url: str, received: int, expected: Optional[int]):
+    """收到的字节数与响应头不符时抛出IntegrityError，由重试逻辑重新下载"""
+    if expected is not None and received != expected:
+        raise IntegrityError(f"{url} 的数据不完整: 收到 {received} 字节，应为 {expected} 字节")
+
+
+def range_validator(headers) -> dict:
+    """由首个响应的ETag或Last-Modified生成分段请求的If-Range头，服务器未提供或为弱ETag时返回空字典
+
+    对象在下载过程中改变时，服务器对带If-Range的分段请求返回200和整个新对象，而不是新对象的一部分。
+    """
+    validator = headers.get('ETag') or headers.get('Last-Modified')
+    if not validator or validator.startswith('W/'):
+        return {}
+    return {'If-Range': validator}
+
+
+def check_part_response(url: str, status: int, headers, start: int, end: int, total: int):
+    """核对分段响应与首个响应是否来自同一个对象，不是时抛出IntegrityError，由重试逻辑重新下载整个片段
+
+    对象在首个响应之后变短时服务器返回416，带If-Range且对象已改变时返回200，
+    其他情况下表现为Content-Range中的总长度与首个响应不同。其余错误状态码不在这里处理。
+    """
+    if status == 416:
+        raise IntegrityError(f"{url} 的范围 {start}-{end} 超出了对象大小，对象在下载过程中改变")
+    if 200 <= status < 300 and status != 206:
+        raise IntegrityError(f"{url} 未按范围返回 {start}-{end}，对象可能在下载过程中改变")
+    if status == 206:
+        part_start, _, part_total = parse_content_range(headers.get('Content-Range'))
+        if part_start != start:
+            raise IntegrityError(f"{url} 返回了错误的范围，应从 {start} 开始，实际从 {part_start} 开始")
+        if part_total != total:
+            raise IntegrityError(f"{url} 的总长度由 {total} 变为 {part_total}，对象在下载过程中改变")
+
+
+def split_ranges(start: int, total: int, parts: int) -> List[Tuple[int, int]]:
+    """把[start, total)均分为至多parts个闭区间"""
+    size = total - start
+    parts = max(1, min(parts, size))
+    step = -(-size // parts)
+    return [(offset, min(offset + step, total) - 1) for offset in range(start, total, step)]
+
+
+def _write_sliced(data: bytes, write: Callable[[bytes], None]):
+    view = memoryview(data)
+    for offset in range(0, len(view), CHUNK_SIZE):
+        write(bytes(view[offset:offset + CHUNK_SIZE]))
+
+
+def _fetch_part(transport, url: str, start: int, end: int, total: int, timeout: float,
+                headers: Optional[dict] = None, limiter=None, sink=None) -> Tuple[bytes, int]:
+    """下载一个范围，返回数据和在读取前通过sink预留的缓冲预算字节数"""
+    reserved = sink.reserve(end - start + 1) if sink is not None else 0
+    try:
+        part_headers = dict(headers or {}, Range=f'bytes={start}-{end}')
+        with transport.get(url, timeout=timeout, stream=True, headers=part_headers) as response:
+            check_part_response(url, response.status_code, response.headers, start, end, total)
+            response.raise_for_status()
+            if limiter is None or not limiter.limited:
+                data = response.content
+            else:
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    limiter.consume(len(chunk))
+                    data += chunk
+                data = bytes(data)
+        check_length(url, len(data), end - start + 1)
+    except BaseException:
+        if reserved:
+            sink.release(reserved)
+        raise
+    return data, reserved
+
+
+def fetch_ranged(transport, url: str, write: Callable[[bytes], None], parts: int = 1,
+                 timeout: float = 30, headers: Optional[dict] = None,
+                 on_response: Optional[Callable[[int], None]] = None, limiter=None, sink=None) -> int:
+    """下载url并按顺序把数据交给write，返回字节数
+
+    parts大于1时先请求前RANGE_PART_SIZE字节，服务器支持范围请求且对象更大时，
+    把剩余部分拆成至多parts-1个范围并发下载。首段边下载边写出，其余分段在首段结束、
+    连接归还之后再按顺序写出，因此不会出现持有连接等待另一个连接的情况。
+    on_response在首个请求成功收到响应头时以状态码调用。
+    每个请求收到的字节数都与Content-Length或Content-Range核对，分段请求带上首个响应的If-Range，
+    分段与首个响应不属于同一个对象(416、总长度不同等)时同样抛出IntegrityError，由调用方重新下载整个片段。
+    提供limiter(ratelimit.TokenBucket)时每读到一块数据都先从中取令牌，包括并发的范围请求。
+    提供sink(assembler.SegmentSink)时，每个分段在请求前先申请整段的缓冲预算，写出后释放。
+    """
+    request_headers = dict(headers or {})
+    if parts > 1:
+        request_headers['Range'] = f'bytes=0-{RANGE_PART_SIZE - 1}'
+
+    ranges: List[Tuple[int, int]] = []
+    size = 0
+    executor = None
+    futures = []
+    try:
+        with transport.get(url, timeout=timeout, stream=True, headers=request_headers) as response:
+            response.raise_for_status()
+            if on_response:
+                on_response(response.status_code)
+            if response.status_code == 206:
+                start, end, total = parse_content_range(response.headers.get('Content-Range'))
+                if start != 0:
+                    raise IOError(f"服务器返回了错误的范围 {start}-{end}")
+                if total is not None and end + 1 < total:
+                    ranges = split_ranges(end + 1, total, parts - 1)
+                    part_headers = dict(headers or {}, **range_validator(response.headers))
+                    executor = ThreadPoolExecutor(max_workers=len(ranges))
+                    futures = [
+                        executor.submit(_fetch_part, transport, url, part_start, part_end, total, timeout,
+                                        part_headers, limiter, sink)
+                        for part_start, part_end in ranges
+                    ]
+            expected = expected_length(response.status_code, response.headers)
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if limiter:
+                    limiter.consume(len(chunk))
+                write(chunk)
+                size += len(chunk)
+            check_length(url, size, expected)
+        while futures:
+            data, reserved = futures.pop(0).result()
+            try:
+                _write_sliced(data, write)
+            finally:
+                if reserved:
+                    sink.release(reserved)
+            size += len(data)
+        return size
+    finally:
+        if executor:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            # 已下载但未写出的分段
+            for future in futures:
+                if not future.cancelled() and future.exception() is None and future.result()[1]:
+                    sink.release(future.result()[1])
+
+
+class TailHedger:
+    """尾部对冲
+
+    所有片段都已提交后，空闲的工作线程重新请求耗时远超已完成片段中位数的片段，
+    谁先拿到完整数据就由谁写入，避免最后几个慢片段拖住整个任务。
+    """
+    def __init__(self, factor: float = 2.0, min_elapsed: float = 1.0):
+        self.factor = factor
+        self.min_elapsed = min_elapsed
+        self._started: Dict[int, float] = {}
+        self._durations: List[float] = []
+        self._hedged: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def started(self, index: int):
+        """片段开始网络请求"""
+        with self._lock:
+            self._started.setdefault(index, time.monotonic())
+
+    def finished(self, index: int):
+        """片段已写入(无论由哪次请求完成)"""
+        with self._lock:
+            start = self._started.pop(index, None)
+            if start is not None and index not in self._hedged:
+                self._durations.append(time.monotonic() - start)
+            self._hedged.discard(index)
+
+    def threshold(self) -> float:
+        with self._lock:
+            median = statistics.median(self._durations) if self._durations else 0.0
+        return max(self.min_elapsed, median * self.factor)
+
+    def candidate(self, running: Iterable[int]) -> Optional[int]:
+        """从正在下载的片段中选出最值得对冲的一个并标记，没有合适的返回None"""
+        threshold = self.threshold()
+        now = time.monotonic()
+        with self._lock:
+            slowest = None
+            for index in running:
+                start = self._started.get(index)
+                if start is None or index in self._hedged or now - start < threshold:
+                    continue
+                if slowest is None or start < self._started[slowest]:
+                    slowest = index
+            if slowest is not None:
+                self._hedged.add(slowest)
+            return slowest
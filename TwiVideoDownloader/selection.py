@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from TwiVideoDownloader.playlist import StreamInfo
+
+
+@dataclass
+class VariantPolicy:
+    """视频流选择策略
+
+    max_*为上限，在不超过上限的流中选码率最高的；设置min_*时改为在不低于下限的流中选码率最低的
+    ("不低于X的最小流")。清晰度按分辨率的短边计算，竖屏720x1280与横屏1280x720都算720p。
+    没有流满足上限时退而选最小的流，没有流满足下限时选码率最高的流。
+    """
+    max_height: Optional[int] = None   # 清晰度上限，如720
+    max_bitrate: Optional[int] = None  # 码率上限(bit/s)
+    max_bytes: Optional[int] = None    # 预计大小上限(字节)，需要知道时长
+    min_height: Optional[int] = None   # 清晰度下限
+    min_bitrate: Optional[int] = None  # 码率下限(bit/s)
+
+    @property
+    def prefers_smallest(self) -> bool:
+        return self.min_height is not None or self.min_bitrate is not None
+
+
+@dataclass
+class VariantChoice:
+    """选择结果"""
+    stream: StreamInfo
+    duration: Optional[float]        # 时长(秒)，未知时为None
+    estimated_bytes: Optional[int]   # 预计输出大小(字节)，时长未知时为None
+    within_policy: bool = True       # 是否满足策略的全部条件
+
+    @property
+    def height(self) -> int:
+        return stream_height(self.stream)
+
+
+def stream_height(stream: StreamInfo) -> int:
+    """分辨率的短边，没有分辨率时为0"""
+    try:
+        width, height = (int(value) for value in stream.resolution.lower().split('x'))
+    except ValueError:
+        return 0
+    return min(width, height)
+
+
+def stream_bitrate(stream: StreamInfo) -> int:
+    """平均码率，没有AVERAGE-BANDWIDTH时用峰值码率"""
+    return stream.average_bandwidth or stream.bandwidth
+
+
+def estimate_size(stream: StreamInfo, duration: Optional[float]) -> Optional[int]:
+    """按平均码率乘以时长估计输出大小(字节)，码率包含音频"""
+    if duration is None:
+        return None
+    return int(stream_bitrate(stream) * duration / 8)
+
+
+def _within_caps(stream: StreamInfo, policy: VariantPolicy, duration: Optional[float]) -> bool:
+    if policy.max_height is not None and stream_height(stream) > policy.max_height:
+        return False
+    if policy.max_bitrate is not None and stream_bitrate(stream) > policy.max_bitrate:
+        return False
+    if policy.max_bytes is not None and duration is not None and estimate_size(stream, duration) > policy.max_bytes:
+        return False
+    return True
+
+
+def _above_floor(stream: StreamInfo, policy: VariantPolicy) -> bool:
+    if policy.min_height is not None and stream_height(stream) < policy.min_height:
+        return False
+    if policy.min_bitrate is not None and stream_bitrate(stream) < policy.min_bitrate:
+        return False
+    return True
+
+
+def select_variant(streams: List[StreamInfo], policy: Optional[VariantPolicy] = None,
+                   duration: Optional[float] = None) -> Optional[VariantChoice]:
+    """按策略从主播放列表的视频流中选择一个，不指定策略时选码率最高的流"""
+    if not streams:
+        return None
+    policy = policy or VariantPolicy()
+    key = lambda stream: (stream_bitrate(stream), stream.bandwidth)
+
+    candidates = [stream for stream in streams if _within_caps(stream, policy, duration)]
+    within_policy = bool(candidates)
+    if not candidates:
+        candidates = [min(streams, key=key)]
+
+    if policy.prefers_smallest:
+        above = [stream for stream in candidates if _above_floor(stream, policy)]
+        if above:
+            stream = min(above, key=key)
+        else:
+            stream = max(candidates, key=key)
+            within_policy = False
+    else:
+        stream = max(candidates, key=key)
+    return VariantChoice(stream, duration, estimate_size(stream, duration), within_policy)
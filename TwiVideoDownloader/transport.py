@@ -0,0 +1,82 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class _CountingAdapter(HTTPAdapter):
+    """记录新建连接次数的适配器"""
+    def __init__(self, on_new_connection, **kwargs):
+        self._on_new_connection = on_new_connection
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        on_new_connection = self._on_new_connection
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                on_new_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                on_new_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+class HttpTransport:
+    """共享的HTTP连接层
+
+    所有组件共用一个带连接池的Session，连接池大小与配置的并发数一致，
+    池满时阻塞等待而不是新建随后被丢弃的连接。
+    """
+    def __init__(self, pool_size: int = 10, max_hosts: int = 10, pool_block: bool = True):
+        self.pool_size = pool_size
+        self.requests = 0
+        self.new_connections = 0
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers['Connection'] = 'keep-alive'
+        adapter = _CountingAdapter(
+            self._on_new_connection,
+            pool_connections=max_hosts,
+            pool_maxsize=pool_size,
+            pool_block=pool_block
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def for_concurrency(cls, max_workers: int, streams: int = 2) -> 'HttpTransport':
+        """按并发数创建连接层，视频和音频各占一份并发，另留少量给播放列表请求"""
+        return cls(pool_size=max_workers * streams + 2)
+
+    def _on_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """发送GET请求"""
+        with self._lock:
+            self.requests += 1
+        return self.session.get(url, **kwargs)
+
+    def stats(self) -> dict:
+        """连接复用统计"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': max(0, self.requests - self.new_connections),
+            }
+
+    def close(self):
+        """关闭所有连接"""
+        self.session.close()
@@ -0,0 +1,133 @@
+"""文件复制路径基准测试
+
+生成大体积的合成分片MP4(视频和音频各一个)，比较：
+  mux     内置合并器用内核复制(copy_file_range/sendfile)与缓冲区复制合并mdat
+  concat  把片段文件拼接成一个文件(缓存命中时的写入路径)：内核复制、按块复制、整文件read()
+
+输入在第一次运行时生成，之后的每次测量都在页缓存已预热的情况下进行。
+CPU一列为本进程的用户态加内核态时间，内核复制省下的主要是这部分，写盘速度受限时墙钟时间差别不大。
+
+    python benchmarks/bench_copy.py --size-mb 4096
+    python benchmarks/bench_copy.py --size-mb 1024 --dir /mnt/btrfs/tmp --repeat 3
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fake_twimg import _fragment, _init_segment
+from TwiVideoDownloader.fastcopy import BUFFER_SIZE, copy_range
+from TwiVideoDownloader.mp4mux import FragmentedMP4Muxer
+
+
+def make_track(path: Path, timescale: int, handler: bytes, fragments: int, size: int):
+    with open(path, 'wb') as f:
+        f.write(_init_segment(1, timescale, handler))
+        for i in range(fragments):
+            f.write(_fragment(1, i + 1, i * timescale * 3, size))
+
+
+def make_segments(directory: Path, count: int, size: int) -> list:
+    paths = []
+    payload = os.urandom(size)
+    for i in range(count):
+        path = directory / f"{i}.m4s"
+        path.write_bytes(payload)
+        paths.append(path)
+    return paths
+
+
+def concat_kernel(paths: list, output: Path):
+    with open(output, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                copy_range(f, out, 0, os.fstat(f.fileno()).st_size)
+
+
+def concat_buffered(paths: list, output: Path):
+    with open(output, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(BUFFER_SIZE), b''):
+                    out.write(chunk)
+
+
+def concat_read_all(paths: list, output: Path):
+    """整文件读入内存再写出，改造前的拼接方式"""
+    with open(output, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                out.write(f.read())
+
+
+def file_digest(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BUFFER_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def measure(name: str, func, output: Path, size: int, repeat: int, results: dict):
+    best = best_cpu = None
+    for _ in range(repeat):
+        output.unlink(missing_ok=True)
+        start, start_cpu = time.perf_counter(), time.process_time()
+        func()
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+        best = elapsed if best is None else min(best, elapsed)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    results[name] = file_digest(output)
+    print(f"{name:<16} {best:8.3f}s  {size / best / 1024 / 1024:8.1f} MB/s  CPU {best_cpu:6.3f}s")
+    output.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文件复制路径基准测试")
+    parser.add_argument("--size-mb", type=int, default=2048, help="视频输入的大小(MB)，音频为其1/8")
+    parser.add_argument("--fragment-kb", type=int, default=4096, help="每个片段的大小(KB)")
+    parser.add_argument("--dir", help="测试文件所在目录，默认为系统临时目录；放在支持reflink的文件系统上可比较共享数据块")
+    parser.add_argument("--repeat", type=int, default=2, help="每种方式运行的次数，取最快的一次")
+    args = parser.parse_args()
+
+    fragment_size = args.fragment_kb * 1024
+    fragments = max(1, args.size_mb * 1024 * 1024 // fragment_size)
+    with tempfile.TemporaryDirectory(dir=args.dir) as work:
+        work = Path(work)
+        video, audio, output = work / "video.mp4", work / "audio.mp4", work / "output.mp4"
+        print(f"生成输入: {fragments} 个片段, 视频 {fragments * fragment_size / 1024 / 1024:.0f} MB")
+        make_track(video, 90000, b'vide', fragments, fragment_size)
+        make_track(audio, 48000, b'soun', fragments, max(1, fragment_size // 8))
+        mux_size = video.stat().st_size + audio.stat().st_size
+
+        mux_results = {}
+        measure("mux kernel", lambda: FragmentedMP4Muxer().mux(str(video), str(audio), str(output)),
+                output, mux_size, args.repeat, mux_results)
+        measure("mux buffered", lambda: FragmentedMP4Muxer(kernel_copy=False).mux(str(video), str(audio), str(output)),
+                output, mux_size, args.repeat, mux_results)
+        video.unlink()
+        audio.unlink()
+
+        segment_dir = work / "segments"
+        segment_dir.mkdir()
+        paths = make_segments(segment_dir, fragments, fragment_size)
+        concat_size = fragments * fragment_size
+        concat_results = {}
+        measure("concat kernel", lambda: concat_kernel(paths, output), output, concat_size, args.repeat, concat_results)
+        measure("concat buffered", lambda: concat_buffered(paths, output), output, concat_size, args.repeat, concat_results)
+        measure("concat read()", lambda: concat_read_all(paths, output), output, concat_size, args.repeat, concat_results)
+
+    for results in (mux_results, concat_results):
+        if len(set(results.values())) != 1:
+            print("输出不一致: " + ", ".join(results))
+            sys.exit(1)
+    print("各方式输出一致")
+
+
+if __name__ == "__main__":
+    main()
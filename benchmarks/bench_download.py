@@ -0,0 +1,200 @@
+"""下载路径端到端基准测试
+
+在子进程中启动fake_twimg模拟服务器，用MediaDownloader(或BatchScheduler)完成
+获取配置、下载片段和合并的完整流程，报告片段/秒、MB/s、峰值内存和各阶段耗时。
+服务器运行在独立进程中，不占用被测进程的CPU和内存。
+
+    python benchmarks/bench_download.py --segments 100 --latency 20 --bandwidth 4
+    python benchmarks/bench_download.py --jobs 8 --engine async --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fake_twimg import FakeTwimgServer, add_config_arguments, config_from_args
+from TwiVideoDownloader.batch import BatchScheduler
+from TwiVideoDownloader.fetch_source import VideoSourceFetcher
+from TwiVideoDownloader.media_downloader import MediaDownloader
+from TwiVideoDownloader.concurrency import AdaptiveConcurrency
+from TwiVideoDownloader.retry import RetryPolicy
+from TwiVideoDownloader.metrics import get_global_metrics
+from TwiVideoDownloader.ratelimit import get_global_limiter
+
+
+def serve(config, ready, stop):
+    with FakeTwimgServer(config) as server:
+        ready.put(server.base_url)
+        stop.wait()
+        ready.put(server.stats())
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存(MB)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _timed(phases: dict, name: str, func):
+    """包装func，把每次调用的耗时累加到phases[name]"""
+    if asyncio.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+    else:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+    return wrapper
+
+
+async def run_single(base_url: str, output_dir: str, args, retry_policy: RetryPolicy) -> dict:
+    downloader = MediaDownloader(
+        base_url,
+        output_dir,
+        args.workers,
+        engine=args.engine,
+        job_id="1000",
+        resume=False,
+        mux_mode=args.mux_mode,
+        muxer=args.muxer,
+        concurrency=AdaptiveConcurrency(
+            initial=args.workers, maximum=args.adaptive_max
+        ) if args.adaptive else None,
+        retry_policy=retry_policy,
+        range_parts=args.range_parts,
+        hedge=not args.no_hedge,
+        verify=not args.no_verify
+    )
+    fetcher = VideoSourceFetcher(transport=downloader.transport, retry_policy=retry_policy, api_base=base_url)
+
+    phases = {}
+    downloader._download_streams = _timed(phases, "download", downloader._download_streams)
+    downloader._merge_video_audio = _timed(phases, "mux", downloader._merge_video_audio)
+
+    start = time.perf_counter()
+    m3u8_content = await fetcher.fetch_m3u8_content("https://twitter.com/i/status/1000")
+    phases["metadata"] = time.perf_counter() - start
+    await downloader.download(m3u8_content, follow=args.follow)
+    phases["total"] = time.perf_counter() - start
+    return {
+        "bytes": downloader.downloaded_bytes,
+        "segments": 2 * (args.segments + 1),
+        "phases": phases,
+        "failed": 0,
+    }
+
+
+async def run_batch(base_url: str, output_dir: str, args, retry_policy: RetryPolicy) -> dict:
+    scheduler = BatchScheduler(
+        base_url,
+        output_dir,
+        max_jobs=args.max_jobs or args.jobs,
+        global_segment_limit=args.global_limit,
+        per_job_segment_limit=args.workers,
+        engine=args.engine,
+        mux_mode=args.mux_mode,
+        muxer=args.muxer,
+        adaptive_max=args.adaptive_max if args.adaptive else None,
+        retry_policy=retry_policy,
+        range_parts=args.range_parts,
+        hedge=not args.no_hedge,
+        api_base=base_url,
+        mux_workers=None if args.inline_mux else args.mux_workers,
+        verify=not args.no_verify
+    )
+    urls = [f"https://twitter.com/i/status/{1000 + i}" for i in range(args.jobs)]
+    start = time.perf_counter()
+    results = await scheduler.run(urls)
+    total = time.perf_counter() - start
+    elapsed = sorted(result.elapsed for result in results)
+    for result in results:
+        if result.status != "ok":
+            print(f"任务 {result.tweet_id} 失败: {result.error}")
+    return {
+        "bytes": sum(result.bytes for result in results),
+        "segments": 2 * (args.segments + 1) * len(results),
+        "phases": {
+            "total": total,
+            "job_mean": sum(elapsed) / len(elapsed),
+            "job_p95": elapsed[min(len(elapsed) - 1, int(len(elapsed) * 0.95))],
+        },
+        "failed": sum(1 for result in results if result.status != "ok"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载路径端到端基准测试")
+    add_config_arguments(parser)
+    parser.add_argument("--jobs", type=int, default=0, help="批量任务数，0表示单个MediaDownloader")
+    parser.add_argument("--max-jobs", type=int, default=0, help="批量模式下同时下载的任务数，0表示与--jobs相同")
+    parser.add_argument("--workers", type=int, default=5, help="单个任务的片段并发数")
+    parser.add_argument("--global-limit", type=int, default=32, help="批量模式下的全局片段并发上限")
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread")
+    parser.add_argument("--mux-mode", choices=["file", "pipe"], default="file")
+    parser.add_argument("--muxer", choices=["auto", "python", "ffmpeg"], default="python")
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument("--adaptive-max", type=int, default=32)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--range-parts", type=int, default=4)
+    parser.add_argument("--no-hedge", action="store_true")
+    parser.add_argument("--mux-workers", type=int, default=0, help="批量模式下的合并进程数，0表示CPU核数")
+    parser.add_argument("--inline-mux", action="store_true", help="批量模式下在任务内合并，不使用合并进程池")
+    parser.add_argument("--no-verify", action="store_true", help="关闭片段结构校验和摘要，用于测量校验的开销")
+    parser.add_argument("--follow", action="store_true", help="跟随直播下载，配合--live使用")
+    parser.add_argument("--rate-limit", type=float, default=0, help="总带宽上限(MB/s)，0表示不限")
+    parser.add_argument("--json", help="把结果以JSON格式写入该文件，便于比较不同版本")
+    args = parser.parse_args()
+
+    ready = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(config_from_args(args), ready, stop), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=30)
+
+    retry_policy = RetryPolicy(max_attempts=max(1, args.retries), base_delay=0.05)
+    get_global_limiter().set_rate(args.rate_limit * 1024 * 1024)
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            runner = run_batch if args.jobs else run_single
+            result = asyncio.run(runner(base_url, output_dir, args, retry_policy))
+    finally:
+        stop.set()
+        server_stats = ready.get(timeout=30)
+        server.join()
+
+    total = result["phases"]["total"]
+    result.update({
+        "segments_per_sec": result["segments"] / total,
+        "mb_per_sec": result["bytes"] / total / 1024 / 1024,
+        "peak_rss_mb": peak_rss_mb(),
+        "server": server_stats,
+        "metrics": get_global_metrics().registry.to_dict(),
+    })
+
+    print(f"片段 {result['segments']} 个, {result['bytes'] / 1024 / 1024:.1f} MB, 失败任务 {result['failed']} 个")
+    print(f"吞吐 {result['segments_per_sec']:.1f} 片段/秒, {result['mb_per_sec']:.1f} MB/s, "
+          f"峰值内存 {result['peak_rss_mb']:.1f} MB")
+    print("阶段耗时: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in result["phases"].items()))
+    print(f"服务器: 请求 {server_stats['requests']} 次, 注入错误 {server_stats['injected_errors']} 次, "
+          f"截断 {server_stats['injected_corruptions']} 次, 发送 {server_stats['bytes_sent'] / 1024 / 1024:.1f} MB")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
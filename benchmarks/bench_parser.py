@@ -0,0 +1,114 @@
+"""播放列表解析基准测试
+
+生成包含大量片段的合成媒体播放列表(模拟长时间的Spaces/直播录像)，
+比较旧的逐行解析实现与playlist模块的解析速度。
+
+    python benchmarks/bench_parser.py --segments 20000 --repeat 5
+"""
+import argparse
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from TwiVideoDownloader.playlist import iter_media_playlist, parse_master_playlist, parse_media_playlist
+
+
+def make_media_playlist(segments: int) -> str:
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:6',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-TARGETDURATION:3',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+        '#EXT-X-MAP:URI="/ext_tw_video/1683738905412005888/pu/vid/avc1/0/0/1280x720/init.mp4"',
+    ]
+    for i in range(segments):
+        lines.append(f'#EXTINF:{3.0 if i % 7 else 2.969},')
+        lines.append(f'/ext_tw_video/1683738905412005888/pu/vid/avc1/{i * 3000}/{i * 3000 + 3000}/1280x720/seg{i}.m4s')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def make_master_playlist(variants: int) -> str:
+    lines = ['#EXTM3U', '#EXT-X-INDEPENDENT-SEGMENTS']
+    lines.append('#EXT-X-MEDIA:NAME="Audio",TYPE=AUDIO,GROUP-ID="audio-128000",AUTOSELECT=YES,'
+                 'URI="/ext_tw_video/1/pu/pl/mp4a/128000/audio.m3u8"')
+    for i in range(variants):
+        lines.append(f'#EXT-X-STREAM-INF:AVERAGE-BANDWIDTH={200000 + i * 1000},BANDWIDTH={250000 + i * 1000},'
+                     f'RESOLUTION={320 + i}x{180 + i},CODECS="mp4a.40.2,avc1.4D401E",AUDIO="audio-128000"')
+        lines.append(f'/ext_tw_video/1/pu/pl/avc1/{320 + i}x{180 + i}/variant{i}.m3u8')
+    return '\n'.join(lines) + '\n'
+
+
+def legacy_parse(content: str) -> list:
+    """改造前VideoM3U8Parser.parse的实现，作为对照"""
+    segments = []
+    lines = content.strip().split('\n')
+    current_start = 0
+    resolution_pattern = r'/(\d+x\d+)/'
+    resolution = ""
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if line.startswith('#EXT-X-VERSION:'):
+            int(line.split(':')[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            int(line.split(':')[1])
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            int(line.split(':')[1])
+        elif line.startswith('#EXT-X-MAP:'):
+            map_uri = re.search(r'URI="([^"]+)"', line).group(1)
+            match = re.search(resolution_pattern, map_uri)
+            if match:
+                resolution = match.group(1)
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':')[1].rstrip(','))
+            uri = lines[i + 1].strip()
+            end_time = current_start + int(duration * 1000)
+            segments.append((duration, uri, current_start, end_time, resolution))
+            current_start = end_time
+    return segments
+
+
+def measure(name: str, func, repeat: int, count: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(timings)
+    print(f"{name:<28}{best * 1000:>10.1f} ms{count / best:>14,.0f} 条/s{peak / 1024 / 1024:>10.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="播放列表解析基准测试")
+    parser.add_argument("--segments", type=int, default=20000, help="媒体播放列表的片段数")
+    parser.add_argument("--variants", type=int, default=2000, help="主播放列表的变体数")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数，取最快一次")
+    args = parser.parse_args()
+
+    media = make_media_playlist(args.segments)
+    master = make_master_playlist(args.variants)
+    print(f"媒体播放列表: {args.segments} 个片段, {len(media) / 1024:.0f} KB")
+    print(f"{'实现':<28}{'耗时':>13}{'吞吐':>16}{'峰值内存':>12}")
+
+    legacy = measure("legacy_parse", lambda: legacy_parse(media), args.repeat, args.segments)
+    playlist = measure("parse_media_playlist", lambda: parse_media_playlist(media), args.repeat, args.segments)
+    measure("iter_media_playlist", lambda: sum(1 for _ in iter_media_playlist(media)), args.repeat, args.segments)
+    assert [segment.uri for segment in playlist] == [segment[1] for segment in legacy]
+    assert [segment.end_time for segment in playlist] == [segment[3] for segment in legacy]
+
+    print(f"\n主播放列表: {args.variants} 个变体")
+    measure("parse_master_playlist", lambda: parse_master_playlist(master), args.repeat, args.variants)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""片段校验的端到端检查
+
+在fake_twimg模拟服务器上按一定概率返回截断的片段，分别用线程引擎和异步引擎下载小片段
+(单个请求)和大于RANGE_PART_SIZE的片段(拆成范围请求，截断会表现为分段与首个响应不属于同一个对象)，
+检查每次下载都能重新获取出错的片段：输出与无截断时逐字节相同，清单中的输出摘要与文件一致，
+每个片段的摘要与服务器上的原始数据一致。任一项不符时以状态码1退出。
+
+    python benchmarks/check_integrity.py
+    python benchmarks/check_integrity.py --corrupt-rate 0.2 --segments 30
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fake_twimg import FakeTwimgConfig, FakeTwimgServer
+from TwiVideoDownloader.fetch_source import VideoSourceFetcher
+from TwiVideoDownloader.media_downloader import MediaDownloader
+from TwiVideoDownloader.retry import RetryPolicy
+from TwiVideoDownloader.segment_fetch import RANGE_PART_SIZE
+
+
+def file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+async def download(engine: str, segment_kb: int, corrupt_rate: float, args) -> dict:
+    """下载一次，返回输出摘要、清单是否与输出和服务器数据一致以及服务器的截断次数"""
+    config = FakeTwimgConfig(segments=args.segments, segment_size=segment_kb * 1024, corrupt_rate=corrupt_rate)
+    retry_policy = RetryPolicy(max_attempts=args.retries, base_delay=0.05)
+    with FakeTwimgServer(config) as server, tempfile.TemporaryDirectory() as output_dir:
+        downloader = MediaDownloader(
+            server.base_url, output_dir, args.workers, engine=engine, job_id="1", resume=False,
+            muxer="python", retry_policy=retry_policy, range_parts=args.range_parts
+        )
+        fetcher = VideoSourceFetcher(transport=downloader.transport, retry_policy=retry_policy,
+                                     api_base=server.base_url)
+        output = await downloader.download(await fetcher.fetch_m3u8_content("https://twitter.com/i/status/1"))
+        sha256 = file_sha256(output)
+        with open(downloader.manifest, encoding='utf-8') as f:
+            manifest = json.load(f)
+        segments_ok = all(
+            segment.get('sha256') == hashlib.sha256(server.content.media(kind, index - 1)).hexdigest()
+            for name, kind in (("video", "vid"), ("audio", "aud"))
+            for index, segment in enumerate(manifest['streams'][name]['segments'])
+        )
+        return {
+            "sha256": sha256,
+            "manifest_ok": manifest['sha256'] == sha256 and segments_ok,
+            "corruptions": server.stats()['injected_corruptions'],
+        }
+
+
+async def run(args) -> bool:
+    passed = True
+    for engine in ("thread", "async"):
+        for segment_kb in (args.small_kb, args.large_kb):
+            clean = await download(engine, segment_kb, 0, args)
+            try:
+                corrupted = await download(engine, segment_kb, args.corrupt_rate, args)
+            except Exception as e:
+                print(f"{engine:<6} {segment_kb:>5} KB  下载失败: {type(e).__name__}: {str(e)}")
+                passed = False
+                continue
+            ok = clean["manifest_ok"] and corrupted["manifest_ok"] and corrupted["sha256"] == clean["sha256"]
+            passed &= ok
+            print(f"{engine:<6} {segment_kb:>5} KB  截断 {corrupted['corruptions']:>3} 次  "
+                  f"输出{'一致' if corrupted['sha256'] == clean['sha256'] else '不一致'}  "
+                  f"清单{'一致' if corrupted['manifest_ok'] else '不一致'}  {'通过' if ok else '失败'}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="片段校验的端到端检查")
+    parser.add_argument("--segments", type=int, default=20, help="每个变体的片段数")
+    parser.add_argument("--small-kb", type=int, default=256, help="小片段的大小(KB)，整个片段一次请求")
+    parser.add_argument("--large-kb", type=int, default=RANGE_PART_SIZE * 3 // 1024,
+                        help="大片段的大小(KB)，应大于RANGE_PART_SIZE以便拆成范围请求")
+    parser.add_argument("--corrupt-rate", type=float, default=0.1, help="片段请求返回截断数据的概率")
+    parser.add_argument("--workers", type=int, default=5, help="片段并发数")
+    parser.add_argument("--range-parts", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=8)
+    args = parser.parse_args()
+
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+    print("全部通过")
+
+
+if __name__ == "__main__":
+    main()
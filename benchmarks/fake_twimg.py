@@ -0,0 +1,352 @@
+"""本地模拟的 api.twitter.com / video.twimg.com
+
+提供推文配置接口、主播放列表、视频和音频变体播放列表以及合成的fMP4片段，
+可配置延迟、单连接带宽、错误率、截断率和片段数，用于离线测量下载路径的性能；
+--live模拟进行中的直播，片段随时间逐个出现。
+
+    python benchmarks/fake_twimg.py --port 8000 --segments 100 --latency 20
+"""
+import argparse
+import json
+import random
+import re
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from TwiVideoDownloader.mp4mux import make_box
+
+WRITE_CHUNK = 64 * 1024
+
+VIDEO_PATH = "/ext_tw_video/{tweet_id}/pu/vid/avc1/{resolution}"
+# 主播放列表中的视频变体: (分辨率, AVERAGE-BANDWIDTH, BANDWIDTH)，片段内容相同，只有路径不同
+VIDEO_VARIANTS = [
+    ("480x270", 200000, 288000),
+    ("640x360", 650000, 832000),
+    ("1280x720", 2000000, 2500000),
+]
+AUDIO_PATH = "/ext_tw_video/{tweet_id}/pu/aud/mp4a/128000"
+PLAYLIST_PATH = "/ext_tw_video/{tweet_id}/pu/pl"
+
+_CONFIG_PATTERN = re.compile(r'^/1\.1/videos/tweet/config/(\d+)\.json$')
+_MEDIA_PATTERN = re.compile(r'^/ext_tw_video/(\d+)/pu/(vid|aud)/[^?]*/(init\.mp4|(\d+)\.m4s)$')
+_PLAYLIST_PATTERN = re.compile(r'^/ext_tw_video/(\d+)/pu/pl/(master|audio|video(?:_\d+x\d+)?)\.m3u8$')
+_RANGE_PATTERN = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+@dataclass
+class FakeTwimgConfig:
+    """模拟服务器的参数"""
+    segments: int = 50               # 每个变体的片段数
+    segment_size: int = 256 * 1024   # 视频片段大小(字节)，音频片段为其1/8
+    segment_duration: float = 3.0    # 片段时长(秒)
+    latency: float = 0.0             # 每个请求返回响应头前的延迟(秒)
+    bandwidth: int = 0               # 单个连接的带宽上限(字节/秒)，0表示不限
+    error_rate: float = 0.0          # 片段请求返回503的概率
+    corrupt_rate: float = 0.0        # 片段请求只返回前一半数据(Content-Length与之相符)的概率，模拟截断的缓存对象
+    live: bool = False               # 模拟直播：从第一次请求播放列表起每隔segment_duration秒出现一个新片段
+    live_window: int = 0             # 直播播放列表只保留最近的这么多个片段，0表示保留全部(EVENT)
+
+
+def _full_box(box_type: str, version: int, flags: int, payload: bytes) -> bytes:
+    return make_box(box_type, bytes([version]) + flags.to_bytes(3, 'big') + payload)
+
+
+def _init_segment(track_id: int, timescale: int, handler: bytes) -> bytes:
+    mvhd = _full_box('mvhd', 0, 0, struct.pack('>IIII', 0, 0, 1000, 0) + b'\0' * 76 + struct.pack('>I', track_id + 1))
+    tkhd = _full_box('tkhd', 0, 3, struct.pack('>IIII', 0, 0, track_id, 0) + b'\0' * 64)
+    mdhd = _full_box('mdhd', 0, 0, struct.pack('>IIII', 0, 0, timescale, 0) + b'\0' * 4)
+    hdlr = _full_box('hdlr', 0, 0, b'\0' * 4 + handler + b'\0' * 13)
+    trak = make_box('trak', tkhd + make_box('mdia', mdhd + hdlr))
+    trex = _full_box('trex', 0, 0, struct.pack('>IIIII', track_id, 1, 0, 0, 0))
+    return make_box('ftyp', b'iso5\0\0\0\1iso5dash') + make_box('moov', mvhd + trak + make_box('mvex', trex))
+
+
+def _fragment(track_id: int, sequence: int, decode_time: int, size: int) -> bytes:
+    """生成styp+moof+mdat，mdat中只有一个样本"""
+    payload = bytes([sequence % 251]) * size
+    mfhd = _full_box('mfhd', 0, 0, struct.pack('>I', sequence))
+    tfhd = _full_box('tfhd', 0, 0x020000, struct.pack('>I', track_id))
+    tfdt = _full_box('tfdt', 1, 0, struct.pack('>Q', decode_time))
+
+    def build_moof(data_offset: int) -> bytes:
+        trun = _full_box('trun', 0, 0x000201, struct.pack('>IiI', 1, data_offset, size))
+        return make_box('moof', mfhd + make_box('traf', tfhd + tfdt + trun))
+
+    moof = build_moof(0)
+    moof = build_moof(len(moof) + 8)
+    return make_box('styp', b'msdh\0\0\0\0msdh') + moof + make_box('mdat', payload)
+
+
+class FakeTwimg:
+    """生成播放列表和片段内容，片段按需生成并缓存"""
+    def __init__(self, config: FakeTwimgConfig):
+        self.config = config
+        self._video_init = _init_segment(1, 90000, b'vide')
+        self._audio_init = _init_segment(1, 48000, b'soun')
+        self._live_start = None
+        self._live_lock = threading.Lock()
+
+    def available_segments(self) -> int:
+        """当前已出现的片段数，非直播时为全部片段"""
+        if not self.config.live:
+            return self.config.segments
+        with self._live_lock:
+            if self._live_start is None:
+                self._live_start = time.monotonic()
+            elapsed = time.monotonic() - self._live_start
+        return min(self.config.segments, int(elapsed / self.config.segment_duration) + 1)
+
+    def tweet_config(self, base_url: str, tweet_id: str) -> bytes:
+        playback_url = f"{base_url}{PLAYLIST_PATH.format(tweet_id=tweet_id)}/master.m3u8"
+        return json.dumps({'track': {'playbackUrl': playback_url}}).encode()
+
+    def playlist(self, tweet_id: str, name: str) -> bytes:
+        pl_path = PLAYLIST_PATH.format(tweet_id=tweet_id)
+        if name == 'master':
+            lines = [
+                '#EXTM3U',
+                '#EXT-X-INDEPENDENT-SEGMENTS',
+                f'#EXT-X-MEDIA:NAME="Audio",TYPE=AUDIO,GROUP-ID="audio-128000",AUTOSELECT=YES,'
+                f'URI="{pl_path}/audio.m3u8"',
+            ]
+            for resolution, average, peak in VIDEO_VARIANTS:
+                lines.append(f'#EXT-X-STREAM-INF:AVERAGE-BANDWIDTH={average},BANDWIDTH={peak},'
+                             f'RESOLUTION={resolution},CODECS="mp4a.40.2,avc1.640020",AUDIO="audio-128000"')
+                lines.append(f'{pl_path}/video_{resolution}.m3u8')
+            return ('\n'.join(lines) + '\n').encode()
+
+        if name == 'audio':
+            media_path = AUDIO_PATH.format(tweet_id=tweet_id)
+        else:
+            resolution = name[len('video_'):] if name.startswith('video_') else VIDEO_VARIANTS[-1][0]
+            media_path = VIDEO_PATH.format(tweet_id=tweet_id, resolution=resolution)
+        available = self.available_segments()
+        first = max(0, available - self.config.live_window) if self.config.live_window else 0
+        if not self.config.live:
+            playlist_type = 'VOD'
+        else:
+            playlist_type = 'EVENT' if not self.config.live_window else None
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:6',
+            f'#EXT-X-MEDIA-SEQUENCE:{first}',
+            f'#EXT-X-TARGETDURATION:{int(self.config.segment_duration + 0.999)}',
+        ]
+        if playlist_type:
+            lines.append(f'#EXT-X-PLAYLIST-TYPE:{playlist_type}')
+        lines += [
+            '#EXT-X-ALLOW-CACHE:YES',
+            f'#EXT-X-MAP:URI="{media_path}/init.mp4"',
+        ]
+        for i in range(first, available):
+            lines.append(f'#EXTINF:{self.config.segment_duration:.3f},')
+            lines.append(f'{media_path}/{i}.m4s')
+        if available == self.config.segments:
+            lines.append('#EXT-X-ENDLIST')
+        return ('\n'.join(lines) + '\n').encode()
+
+    @lru_cache(maxsize=1024)
+    def media(self, kind: str, index: int) -> bytes:
+        """kind为vid或aud，index为-1时返回初始化片段"""
+        if index < 0:
+            return self._video_init if kind == 'vid' else self._audio_init
+        if kind == 'vid':
+            ticks = int(self.config.segment_duration * 90000)
+            return _fragment(1, index + 1, index * ticks, self.config.segment_size)
+        ticks = int(self.config.segment_duration * 48000)
+        return _fragment(1, index + 1, index * ticks, max(1, self.config.segment_size // 8))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeTwimgServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+        if server.config.latency:
+            time.sleep(server.config.latency)
+
+        path = self.path.split('?', 1)[0]
+        match = _CONFIG_PATTERN.match(path)
+        if match:
+            base_url = f"http://{self.headers.get('Host')}"
+            return self._send(server.content.tweet_config(base_url, match.group(1)), 'application/json')
+        match = _PLAYLIST_PATTERN.match(path)
+        if match:
+            return self._send(server.content.playlist(match.group(1), match.group(2)),
+                              'application/vnd.apple.mpegurl')
+        match = _MEDIA_PATTERN.match(path)
+        if match:
+            index = -1 if match.group(4) is None else int(match.group(4))
+            if index >= server.content.available_segments():
+                return self._error(404)
+            if index >= 0 and server.config.error_rate and random.random() < server.config.error_rate:
+                server.count('injected_errors')
+                return self._error(503)
+            body = server.content.media(match.group(2), index)
+            if index >= 0 and server.config.corrupt_rate and random.random() < server.config.corrupt_rate:
+                server.count('injected_corruptions')
+                body = body[:len(body) // 2]
+            # 截断的响应相当于另一个版本的对象，ETag随长度变化
+            return self._send(body, 'video/mp4', f'"{match.group(2)}-{index}-{len(body)}"')
+        self._error(404)
+
+    def _error(self, status: int):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send(self, body: bytes, content_type: str, etag: str = None):
+        start, end = 0, len(body) - 1
+        status = 200
+        match = _RANGE_PATTERN.match(self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if match and (if_range is None or if_range == etag):  # If-Range不符时忽略Range，返回整个对象
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(end, int(match.group(2)))
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if etag:
+            self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+        self.end_headers()
+
+        view = memoryview(body)[start:end + 1]
+        bandwidth = self.server.config.bandwidth
+        began = time.monotonic()
+        try:
+            for offset in range(0, len(view), WRITE_CHUNK):
+                self.wfile.write(view[offset:offset + WRITE_CHUNK])
+                if bandwidth:
+                    # 按已发送量计算应当经过的时间，提前了就等待
+                    ahead = (offset + WRITE_CHUNK) / bandwidth - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            return
+        self.server.count('bytes_sent', len(view))
+
+
+class FakeTwimgServer(ThreadingHTTPServer):
+    """在后台线程中运行的模拟服务器，base_url同时用作API和媒体地址"""
+    daemon_threads = True
+    # 默认的监听队列只有5，并发建立连接时溢出会导致客户端等待1秒后重发SYN
+    request_queue_size = 1024
+
+    def __init__(self, config: FakeTwimgConfig = None, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config or FakeTwimgConfig()
+        self.content = FakeTwimg(self.config)
+        self._stats = {'requests': 0, 'injected_errors': 0, 'injected_corruptions': 0, 'bytes_sent': 0}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # 客户端取消分段请求或对冲请求时直接断开连接，不打印这类错误
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--segments", type=int, default=50, help="每个变体的片段数")
+    parser.add_argument("--segment-size", type=int, default=256, help="视频片段大小(KB)，音频片段为其1/8")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟(毫秒)")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="单个连接的带宽上限(MB/s)，0表示不限")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="片段请求返回503的概率")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="片段请求返回截断数据的概率")
+    parser.add_argument("--segment-duration", type=float, default=3.0, help="片段时长(秒)")
+    parser.add_argument("--live", action="store_true", help="模拟直播，每隔一个片段时长出现一个新片段")
+    parser.add_argument("--live-window", type=int, default=0, help="直播播放列表保留的片段数，0表示全部保留")
+
+
+def config_from_args(args) -> FakeTwimgConfig:
+    return FakeTwimgConfig(
+        segments=args.segments,
+        segment_size=args.segment_size * 1024,
+        latency=args.latency / 1000,
+        bandwidth=int(args.bandwidth * 1024 * 1024),
+        error_rate=args.error_rate,
+        corrupt_rate=args.corrupt_rate,
+        segment_duration=args.segment_duration,
+        live=args.live,
+        live_window=args.live_window
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的video.twimg.com")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeTwimgServer(config_from_args(args), args.host, args.port)
+    print(f"监听 {server.base_url}，推文配置: {server.base_url}/1.1/videos/tweet/config/<id>.json")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,287 @@
+import sys
+import argparse
 import asyncio
+import multiprocessing
 from pathlib import Path
 from tqdm import tqdm
+from TwiVideoDownloader.async_engine import AsyncDownloadEngine
 from TwiVideoDownloader.media_downloader import MediaDownloader
 from TwiVideoDownloader.fetch_source import VideoSourceFetcher
+from TwiVideoDownloader.batch import BatchScheduler, read_urls
+from TwiVideoDownloader.cache import SegmentCache
+from TwiVideoDownloader.metadata_cache import MetadataCache
+from TwiVideoDownloader.concurrency import AdaptiveConcurrency
+from TwiVideoDownloader.retry import RetryPolicy
+from TwiVideoDownloader.metrics import MetricsServer, get_global_metrics
+from TwiVideoDownloader.progress import ProgressEvent, format_eta, format_speed
+from TwiVideoDownloader.ratelimit import get_global_limiter
+from TwiVideoDownloader.selection import VariantChoice, VariantPolicy
 
 class ProgressManager:
-    """命令行进度显示管理器"""
+    """命令行进度显示管理器，每个流一个进度条，速度和剩余时间为视频和音频合计"""
     def __init__(self):
-        self.video_pbar = None
-        self.audio_pbar = None
-        self.current_type = None
-        self.speed_text = ""
+        self.pbars = {}
 
-    def handle_progress(self, type_str: str, current: int, total: int):
-        """更新下载进度条"""
-        if type_str != self.current_type:
-            self.current_type = type_str
-            if type_str == "视频":
-                self.video_pbar = tqdm(total=total, desc="下载视频", unit="片段")
-                self.video_pbar.n = current
-            else:
-                self.audio_pbar = tqdm(total=total, desc="下载音频", unit="片段")
-                self.audio_pbar.n = current
+    def handle_progress(self, event: ProgressEvent):
+        """按汇总的进度事件刷新进度条"""
+        for type_str, stream in event.streams.items():
+            pbar = self.pbars.get(type_str)
+            if pbar is None:
+                if not stream.total:
+                    continue
+                pbar = self.pbars[type_str] = tqdm(total=stream.total, desc=f"下载{type_str}", unit="片段")
+            if pbar.total != stream.total:
+                pbar.total = stream.total  # 跟随直播时片段总数不断增加
+            pbar.n = stream.completed
         
-        pbar = self.video_pbar if type_str == "视频" else self.audio_pbar
-        pbar.n = current
-        pbar.set_postfix_str(self.speed_text)
-        pbar.refresh()
-
-    def handle_speed(self, speed_str: str):
-        """更新下载速度显示"""
-        self.speed_text = speed_str
-        if self.current_type:
-            pbar = self.video_pbar if self.current_type == "视频" else self.audio_pbar
-            pbar.set_postfix_str(speed_str)
+        postfix = f"{format_speed(event.rate)} 剩余 {format_eta(event.eta)}"
+        if event.concurrency:
+            postfix += f" 并发 {event.concurrency}"
+        for pbar in self.pbars.values():
+            pbar.set_postfix_str(postfix, refresh=False)
             pbar.refresh()
 
     def close(self):
         """关闭进度条"""
-        if self.video_pbar:
-            self.video_pbar.close()
-        if self.audio_pbar:
-            self.audio_pbar.close()
+        for pbar in self.pbars.values():
+            pbar.close()
 
-async def main():
-    base_url = "https://video.twimg.com"
-    output_dir = "downloads"
-    max_workers = 5
+def parse_time(value: str) -> float:
+    """解析秒数或[时:]分:秒格式的时间"""
+    try:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的时间: {value}")
+    if seconds < 0 or value.count(':') > 2:
+        raise argparse.ArgumentTypeError(f"无效的时间: {value}")
+    return seconds
 
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
-    
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Twitter视频下载器")
+    parser.add_argument("urls", nargs="*", help="推文URL，可指定多个")
+    parser.add_argument("-i", "--input", help="从文件读取URL列表，每行一个，- 表示标准输入")
+    parser.add_argument("-o", "--output-dir", default="downloads", help="输出目录")
+    parser.add_argument("--summary", help="批量模式下写入JSONL格式结果汇总的文件")
+    parser.add_argument("--jobs", type=int, default=4, help="批量模式下同时进行的任务数")
+    parser.add_argument("--global-limit", type=int, default=32, help="所有任务共享的片段并发上限")
+    parser.add_argument("--per-job-limit", type=int, default=5, help="单个任务的片段并发上限")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="根据吞吐量、耗时和限流情况自动调整片段并发，--per-job-limit 作为初始值")
+    parser.add_argument("--adaptive-max", type=int, default=32, help="自适应并发的上限")
+    parser.add_argument("--retries", type=int, default=5, help="每个请求最多尝试的次数，失败后按指数退避等待")
+    parser.add_argument("--range-parts", type=int, default=4,
+                        help="大于1MB的片段拆成的并发范围请求数，1表示不拆分")
+    parser.add_argument("--no-hedge", action="store_true", help="关闭尾部对冲(重新请求最后几个慢片段)")
+    parser.add_argument("--rate-limit", type=float, default=0, help="所有任务合计的下载带宽上限(MB/s)，0表示不限")
+    parser.add_argument("--job-rate-limit", type=float, default=0, help="单个任务的下载带宽上限(MB/s)，0表示不限")
+    parser.add_argument("--max-height", type=int, help="清晰度上限，如720，按分辨率短边计算")
+    parser.add_argument("--min-height", type=int, help="清晰度下限，选不低于该清晰度的最小视频流")
+    parser.add_argument("--max-bitrate", type=int, help="码率上限(kbps)")
+    parser.add_argument("--max-size", type=float, help="预计大小上限(MB)，按平均码率乘以时长估计")
+    parser.add_argument("--start", type=parse_time, help="只下载从该时间开始的部分，秒数或[时:]分:秒")
+    parser.add_argument("--end", type=parse_time, help="只下载到该时间为止的部分，秒数或[时:]分:秒")
+    parser.add_argument("--exact-trim", action="store_true",
+                        help="配合--start/--end使用，合并时用ffmpeg重新编码精确裁剪，默认只裁到片段边界")
+    parser.add_argument("--follow", action="store_true",
+                        help="跟随进行中的直播，按播放列表的片段时长定期刷新并下载新片段，直到直播结束")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="不检查片段的box结构，也不记录摘要和写入清单(长度仍会与响应头核对)")
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread", help="下载引擎")
+    parser.add_argument("--mux-mode", choices=["file", "pipe"], default="file",
+                        help="合并方式: file 下载完成后合并, pipe 边下载边通过管道交给ffmpeg")
+    parser.add_argument("--muxer", choices=["auto", "python", "ffmpeg"], default="auto",
+                        help="文件合并使用的合并器: auto 优先内置合并器, 不支持时改用ffmpeg")
+    parser.add_argument("--mux-workers", type=int, default=0,
+                        help="批量模式下合并进程数，下载完成的任务交给进程池合并，下载名额让给下一个任务；0表示CPU核数")
+    parser.add_argument("--cache-dir", help="片段缓存目录，不指定时不使用缓存")
+    parser.add_argument("--cache-size", type=int, default=1024, help="片段缓存上限(MB)")
+    parser.add_argument("--metadata-ttl", type=int, default=600, help="配置和播放列表缓存有效期(秒)，0表示不缓存")
+    parser.add_argument("--metadata-cache", help="配置和播放列表缓存的保存文件，不指定时只缓存在内存中")
+    parser.add_argument("--metrics-port", type=int, help="在本机该端口提供 /metrics(Prometheus格式) 和 /metrics.json")
+    parser.add_argument("--metrics-json", help="结束时把片段和各阶段的指标写入该JSON文件")
+    return parser.parse_args(argv)
+
+def collect_urls(args) -> list:
+    """汇总命令行、文件和标准输入中的URL"""
+    urls = list(args.urls)
+    if args.input == "-":
+        urls.extend(read_urls(sys.stdin))
+    elif args.input:
+        with open(args.input, encoding="utf-8") as f:
+            urls.extend(read_urls(f))
+    elif not urls and not sys.stdin.isatty():
+        urls.extend(read_urls(sys.stdin))
+    return urls
+
+def variant_policy_from_args(args) -> VariantPolicy:
+    """根据命令行参数生成视频流选择策略，没有指定任何条件时返回None"""
+    if args.max_height is None and args.min_height is None and args.max_bitrate is None and args.max_size is None:
+        return None
+    return VariantPolicy(
+        max_height=args.max_height,
+        min_height=args.min_height,
+        max_bitrate=args.max_bitrate * 1000 if args.max_bitrate is not None else None,
+        max_bytes=int(args.max_size * 1024 * 1024) if args.max_size is not None else None
+    )
+
+def print_variant(choice: VariantChoice):
+    """输出选定的视频流和预计大小"""
+    line = f"视频流: {choice.stream.resolution or '未知分辨率'}, {choice.stream.bandwidth // 1000} kbps"
+    if choice.estimated_bytes is not None:
+        line += f", 时长 {choice.duration:.0f}s, 预计 {choice.estimated_bytes / (1024 * 1024):.1f} MB"
+    if not choice.within_policy:
+        line += " (没有满足条件的视频流，已选最接近的)"
+    print(line)
+
+def print_cache_stats(cache):
+    """输出片段缓存命中统计"""
+    if not cache:
+        return
+    stats = cache.stats()
+    print(f"片段缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+          f"命中率 {stats['hit_rate']:.1%}，占用 {stats['size_bytes'] / (1024 * 1024):.1f} MB，"
+          f"淘汰 {stats['evictions']} 个")
+
+async def download_single(tweet_url: str, args):
+    """下载单个推文视频并显示进度条"""
+    base_url = "https://video.twimg.com"
     progress_mgr = ProgressManager()
+    async_engine = None
+    if args.engine == "async":
+        # 配置、播放列表和片段共用一个引擎，都在事件循环中请求
+        async_engine = AsyncDownloadEngine(
+            base_url,
+            max_concurrency=args.per_job_limit,
+            cache=args.cache,
+            retry_policy=args.retry_policy,
+            range_parts=max(1, args.range_parts),
+            hedge=not args.no_hedge
+        )
     downloader = MediaDownloader(
         base_url, 
-        output_dir, 
-        max_workers,
-        progress_callback=progress_mgr.handle_progress,
-        speed_callback=progress_mgr.handle_speed
+        args.output_dir, 
+        args.per_job_limit,
+        progress_listener=progress_mgr.handle_progress,
+        variant_policy=args.variant_policy,
+        variant_callback=print_variant,
+        engine=args.engine,
+        async_engine=async_engine,
+        job_id=VideoSourceFetcher.extract_tweet_id(tweet_url),
+        cache=args.cache,
+        metadata_cache=args.metadata_cache,
+        mux_mode=args.mux_mode,
+        muxer=args.muxer,
+        concurrency=AdaptiveConcurrency(
+            initial=args.per_job_limit, maximum=args.adaptive_max
+        ) if args.adaptive else None,
+        retry_policy=args.retry_policy,
+        range_parts=max(1, args.range_parts),
+        hedge=not args.no_hedge,
+        rate_limit=args.job_rate_limit * 1024 * 1024,
+        verify=not args.no_verify
+    )
+    fetcher = VideoSourceFetcher(
+        engine=async_engine,
+        transport=downloader.transport,
+        metadata_cache=args.metadata_cache,
+        retry_policy=args.retry_policy
     )
-    fetcher = VideoSourceFetcher()
     
     try:
-        tweet_url = input("请输入推文URL: ")
         print("获取视频信息...")
         m3u8_content = await fetcher.fetch_m3u8_content(tweet_url)
         
-        output_file = await downloader.download(m3u8_content)
+        output_file = await downloader.download(m3u8_content, args.start, args.end, args.exact_trim, args.follow)
         print(f"\n下载完成! 文件保存在: {output_file}")
+        if downloader.manifest:
+            print(f"清单: {downloader.manifest}")
     except Exception as e:
         print(f"\n下载失败: {str(e)}")
     finally:
+        if async_engine:
+            await async_engine.close()
         progress_mgr.close()
+        print_cache_stats(args.cache)
+
+async def download_batch(urls: list, args):
+    """批量下载，按任务输出结果"""
+    def report(result):
+        if result.status == "ok":
+            estimate = f", 预计 {result.estimated_bytes / (1024 * 1024):.1f} MB" if result.estimated_bytes else ""
+            print(f"[完成] {result.tweet_id} -> {result.output} ({result.resolution}{estimate}, {result.elapsed:.1f}s)")
+        else:
+            print(f"[失败] {result.tweet_id}: {result.error}")
+
+    scheduler = BatchScheduler(
+        "https://video.twimg.com",
+        args.output_dir,
+        max_jobs=args.jobs,
+        global_segment_limit=args.global_limit,
+        per_job_segment_limit=args.per_job_limit,
+        summary_path=args.summary,
+        engine=args.engine,
+        job_callback=report,
+        cache=args.cache,
+        metadata_cache=args.metadata_cache,
+        mux_mode=args.mux_mode,
+        muxer=args.muxer,
+        adaptive_max=args.adaptive_max if args.adaptive else None,
+        retry_policy=args.retry_policy,
+        range_parts=max(1, args.range_parts),
+        hedge=not args.no_hedge,
+        job_rate_limit=args.job_rate_limit * 1024 * 1024,
+        variant_policy=args.variant_policy,
+        start=args.start,
+        end=args.end,
+        exact_trim=args.exact_trim,
+        follow=args.follow,
+        verify=not args.no_verify,
+        mux_workers=max(0, args.mux_workers)
+    )
+    results = await scheduler.run(urls)
+    succeeded = sum(1 for result in results if result.status == "ok")
+    print(f"\n共 {len(results)} 个任务，成功 {succeeded} 个，失败 {len(results) - succeeded} 个")
+    stats = scheduler.transport.stats()
+    print(f"HTTP请求 {stats['requests']} 次，新建连接 {stats['new_connections']} 个，"
+          f"复用连接 {stats['reused_connections']} 次")
+    print_cache_stats(args.cache)
+
+async def async_main(argv=None):
+    args = parse_args(argv)
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    args.cache = SegmentCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+    args.metadata_cache = (
+        MetadataCache(args.metadata_ttl, args.metadata_cache) if args.metadata_ttl > 0 else None
+    )
+    args.retry_policy = RetryPolicy(max_attempts=max(1, args.retries))
+    get_global_limiter().set_rate(args.rate_limit * 1024 * 1024)
+    args.variant_policy = variant_policy_from_args(args)
+    registry = get_global_metrics().registry
+    metrics_server = MetricsServer(registry, args.metrics_port).start() if args.metrics_port else None
+    
+    urls = collect_urls(args)
+    if not urls:
+        urls = [input("请输入推文URL: ")]
+    
+    try:
+        if len(urls) == 1 and not args.summary:
+            await download_single(urls[0], args)
+        else:
+            await download_batch(urls, args)
+    finally:
+        if args.metadata_cache:
+            args.metadata_cache.close()
+        if args.metrics_json:
+            registry.dump_json(args.metrics_json)
+        if metrics_server:
+            metrics_server.stop()
+
+def main():
+    multiprocessing.freeze_support()  # 打包后合并进程池的子进程从这里启动
+    asyncio.run(async_main())
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
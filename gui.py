@@ -9,12 +9,12 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from TwiVideoDownloader.media_downloader import MediaDownloader
 from TwiVideoDownloader.fetch_source import VideoSourceFetcher
+from TwiVideoDownloader.progress import ProgressEvent, format_eta, format_speed
 
 class DownloadWorker(QThread):
     """下载工作线程"""
     progress_updated = pyqtSignal(str, int)  # 状态和总进度
-    segment_progress = pyqtSignal(str, int, int)  # 分片下载进度 (类型, 当前, 总数)
-    speed_updated = pyqtSignal(str)  # 下载速度
+    download_progress = pyqtSignal(object)  # 汇总的下载进度(ProgressEvent)，最多每0.5秒一次
     download_complete = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
 
@@ -37,18 +37,18 @@ class DownloadWorker(QThread):
                 self.base_url, 
                 self.output_dir, 
                 self.max_workers,
-                progress_callback=self.handle_progress,
-                speed_callback=self.handle_speed
+                progress_listener=self.download_progress.emit,
+                variant_callback=self._report_variant,
+                job_id=VideoSourceFetcher.extract_tweet_id(self.url)
             )
             self.fetcher = VideoSourceFetcher()
 
-    def handle_progress(self, type_str: str, current: int, total: int):
-        """处理下载进度回调"""
-        self.segment_progress.emit(type_str, current, total)
-        
-    def handle_speed(self, speed_str: str):
-        """处理速度回调"""
-        self.speed_updated.emit(speed_str)
+    def _report_variant(self, choice):
+        """开始下载前显示选定的视频流和预计大小"""
+        message = f"开始下载 {choice.stream.resolution}"
+        if choice.estimated_bytes is not None:
+            message += f"，预计 {choice.estimated_bytes / (1024 * 1024):.1f} MB"
+        self.progress_updated.emit(message, 20)
 
     async def download_video(self):
         try:
@@ -93,6 +93,8 @@ class MainWindow(QMainWindow):
         # 状态显示
         self.status_label = QLabel("准备就绪")
         layout.addWidget(self.status_label)
+        self.speed_label = QLabel("")
+        layout.addWidget(self.speed_label)
         
         # 视频下载进度组
         video_group = QGroupBox("视频下载进度")
@@ -100,10 +102,8 @@ class MainWindow(QMainWindow):
         self.video_progress = QProgressBar()
         self.video_progress.setRange(0, 100)
         self.video_label = QLabel("0/0")
-        self.video_speed = QLabel("")
         video_layout.addWidget(self.video_progress)
         video_layout.addWidget(self.video_label)
-        video_layout.addWidget(self.video_speed)
         video_group.setLayout(video_layout)
         layout.addWidget(video_group)
         
@@ -113,10 +113,8 @@ class MainWindow(QMainWindow):
         self.audio_progress = QProgressBar()
         self.audio_progress.setRange(0, 100)
         self.audio_label = QLabel("0/0")
-        self.audio_speed = QLabel("")
         audio_layout.addWidget(self.audio_progress)
         audio_layout.addWidget(self.audio_label)
-        audio_layout.addWidget(self.audio_speed)
         audio_group.setLayout(audio_layout)
         layout.addWidget(audio_group)
         
@@ -141,14 +139,12 @@ class MainWindow(QMainWindow):
         self.status_label.setText("准备下载...")
         self.video_label.setText("0/0")
         self.audio_label.setText("0/0")
-        self.video_speed.clear()
-        self.audio_speed.clear()
+        self.speed_label.clear()
         self.output_label.clear()
         
         self.worker = DownloadWorker(url)
         self.worker.progress_updated.connect(self.update_progress)
-        self.worker.segment_progress.connect(self.update_segment_progress)
-        self.worker.speed_updated.connect(self.update_speed)
+        self.worker.download_progress.connect(self.update_download_progress)
         self.worker.download_complete.connect(self.download_finished)
         self.worker.error_occurred.connect(self.handle_error)
         self.worker.start()
@@ -156,20 +152,18 @@ class MainWindow(QMainWindow):
     def update_progress(self, status: str, value: int):
         self.status_label.setText(status)
 
-    def update_segment_progress(self, type_str: str, current: int, total: int):
-        progress = int((current / total) * 100)
-        if type_str == "视频":
-            self.video_progress.setValue(progress)
-            self.video_label.setText(f"{current}/{total}")
-        else:
-            self.audio_progress.setValue(progress)
-            self.audio_label.setText(f"{current}/{total}")
-
-    def update_speed(self, speed_str: str):
-        if self.video_progress.value() < 100 and self.audio_progress.value() == 0:
-            self.video_speed.setText(speed_str)
-        elif self.audio_progress.value() < 100:
-            self.audio_speed.setText(speed_str)
+    def update_download_progress(self, event: ProgressEvent):
+        for type_str, stream in event.streams.items():
+            if not stream.total:
+                continue
+            progress = int((stream.completed / stream.total) * 100)
+            if type_str == "视频":
+                self.video_progress.setValue(progress)
+                self.video_label.setText(f"{stream.completed}/{stream.total}")
+            else:
+                self.audio_progress.setValue(progress)
+                self.audio_label.setText(f"{stream.completed}/{stream.total}")
+        self.speed_label.setText(f"速度 {format_speed(event.rate)}  剩余 {format_eta(event.eta)}")
 
     def download_finished(self, output_file: str):
         self.status_label.setText("下载完成!")
@@ -10,6 +10,9 @@ setup(
         'ffmpeg-python>=0.2.0',
         'PyQt6>=6.4.0',
     ],
+    extras_require={
+        'async': ['aiohttp>=3.9.0'],
+    },
     entry_points={
         'console_scripts': [
             'twi-dl-cli=cli:main',